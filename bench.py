@@ -0,0 +1,750 @@
+#!/usr/bin/env python3
+# bench.py
+"""
+Performance benchmarks for db_conn.
+
+.. package:: db_utils.bench
+
+Each benchmark case is run in its own (forked) process with its own connection so that peak RSS (ru_maxrss) is
+measured per case and isn't polluted by earlier cases.  For each case we report rows, wall time, throughput, peak RSS
+and, for cases made of many small calls (lookups, batches, single row writes), the mean latency per call.
+
+usage: bench.py [-H host] [-P port] [-u user] [-p password] [-d db] [-q query] [-t table] [-n loadRows] [-r repeats]
+                [-f fixtureRows] [-M] [-o results.json] [-c baseline.json] [case ...]
+    With no cases listed, all are run.  Use -l to list available cases.
+    -t is a table with a unique indexed num column, used by the paging cases (default flask_data).
+    -f creates (or reuses if it already has that many rows) a synthetic flask_data like table -t with fixtureRows rows in
+       database -d, so the suite doesn't need the production ccgg database.  The cases also use the tmp database.
+    -M starts a throwaway local MariaDB server (mariadbd and mariadb-install-db must be on the PATH) with its data in a temp
+       dir, creates the bench and tmp databases and runs against it.  Use with -f.
+    -o writes the results (and the environment; python, server and db_utils versions) as json, and -c compares this run
+       to a saved one, flagging cases more than 10% slower.
+    Examples:
+        ./bench.py -H localhost -u bench -d bench -q "select * from flask_data" file-tmptable file-stream
+        ./bench.py -M -f 1000000 -o bench-$(git describe --always).json -c bench-baseline.json
+
+"""
+
+import os,sys
+import json
+import time,datetime
+import getopt
+import resource
+import tempfile,shutil
+import multiprocessing
+
+import db_utils.db_conn as db_conn
+
+
+#Benchmark cases.  Each is a function taking (db,opts) and returning the number of rows processed.
+#Register with the @case decorator.  Cases are run in registration order.
+_cases=dict()
+def case(name,desc):
+    def reg(func):
+        _cases[name]=(desc,func)
+        return func
+    return reg
+
+def _countLines(fn):
+    n=0
+    with open(fn,'rb') as f:
+        for line in f: n+=1
+    return n
+
+@case('file-tmptable','csv file output using the temp table + limit offset paging (stream=False)')
+def benchFileTmpTable(db,opts):
+    db.doquery(opts['query'],outfile=opts['outfile'],form='csv',stream=False)
+    return _countLines(opts['outfile'])-1
+
+@case('file-stream','csv file output using a streaming server side cursor (stream=True)')
+def benchFileStream(db,opts):
+    db.doquery(opts['query'],outfile=opts['outfile'],form='csv',stream=True)
+    return _countLines(opts['outfile'])-1
+
+@case('list-buffered','form=list with the default buffered cursor')
+def benchListBuffered(db,opts):
+    a=db.doquery(opts['query'],form='list')
+    return len(a) if a else 0
+
+@case('list-stream','form=list with a streaming cursor')
+def benchListStream(db,opts):
+    a=db.doquery(opts['query'],form='list',stream=True)
+    return len(a) if a else 0
+
+@case('iter-stream','form=iter, rows consumed one at a time off a streaming cursor')
+def benchIterStream(db,opts):
+    n=0
+    for row in db.doquery(opts['query'],form='iter') : n+=1
+    return n
+
+@case('numpy-rows','form=numpy using the original row based conversion (list of tuples -> zip -> np.asarray)')
+def benchNumpyRows(db,opts):
+    a=db.doquery(opts['query'],form='list')
+    if not a : return 0
+    header=[li[0] for li in db._c.description]
+    db.listToNumpy(a,header)
+    return len(a)
+
+@case('numpy-columnar','form=numpy using the chunked typed column builder (db_numpy)')
+def benchNumpyColumnar(db,opts):
+    b=db.doquery(opts['query'],form='numpy')
+    return len(next(iter(b.values()))) if b else 0
+
+@case('file-npz','npz file output (per column arrays) using a streaming cursor')
+def benchFileNpz(db,opts):
+    import numpy as np
+    db.doquery(opts['query'],outfile=opts['outfile'],form='npz')
+    with np.load(opts['outfile']) as z : return len(z[z.files[0]])
+
+@case('file-parquet','parquet file output using a streaming cursor (requires pyarrow)')
+def benchFileParquet(db,opts):
+    import pyarrow.parquet as pq
+    db.doquery(opts['query'],outfile=opts['outfile'],form='parquet')
+    return pq.ParquetFile(opts['outfile']).metadata.num_rows
+
+def _fileCase(form):
+    def bench(db,opts):
+        outfile=opts['outfile']+'.'+form
+        db.doquery(opts['query'],outfile=outfile,form=form)
+        if form=='npy' :
+            import numpy as np
+            return len(np.load(os.path.join(outfile,sorted(os.listdir(outfile))[0]),mmap_mode='r'))
+        if form=='arrow' :
+            import pyarrow.ipc as ipc
+            with ipc.open_file(outfile) as r : return sum(r.get_batch(i).num_rows for i in range(r.num_record_batches))
+        return _countLines(outfile)-1
+    return bench
+
+#The remaining doquery file forms, so every form is covered
+for _form,_desc in (('tsv','tsv'),('excel','excel dialect csv'),('csv-nq','unquoted csv'),('txt','formatted text'),
+        ('npy','npy directory (per column arrays)'),('arrow','arrow ipc (requires pyarrow)')):
+    case('file-'+_form,'%s file output (form=%s)' % (_desc,_form))(_fileCase(_form))
+
+@case('form-text','form=text (formatted lines in memory)')
+def benchFormText(db,opts):
+    a=db.doquery(opts['query'],form='text')
+    return len(a)-1 if a else 0
+
+@case('connect-new','open and close 100 new connections and run a trivial select on each')
+def benchConnectNew(db,opts):
+    for i in range(100):
+        d=db_conn.DatabaseConn(**opts['connArgs'])
+        d.doquery("select 1",numRows=0)
+        d.close()
+    return 100,100
+
+@case('connect-pool','check out 100 connections from a pool and run a trivial select on each')
+def benchConnectPool(db,opts):
+    import db_utils.db_pool as db_pool
+    pool=db_pool.ConnectionPool(resetSession=False)
+    for i in range(100):
+        d=db_conn.DatabaseConn(pool=pool,**opts['connArgs'])
+        d.doquery("select 1",numRows=0)
+        d.close()
+    pool.closeAll()
+    return 100,100
+
+def _loadRows(opts):
+    #Synthetic instrument rows like the Aerodyne example in doMultiInsert (dt,c2h6,ch4)
+    start=datetime.datetime(2020,1,1)
+    for i in range(opts['loadRows']):
+        yield (start+datetime.timedelta(seconds=i),1.5+(i%1000)*.001,1900.+(i%5000)*.01)
+
+def _loadTable(db):
+    db.doquery("drop temporary table if exists tmp.t__bench_load",commit=True)
+    db.doquery("create temporary table tmp.t__bench_load (dt datetime, c2h6 float, ch4 float)",commit=True)
+    return "tmp.t__bench_load"
+
+@case('load-executemany','insert loadRows synthetic rows with doMultiInsert (executemany, 10000 row batches)')
+def benchLoadExecutemany(db,opts):
+    table=_loadTable(db)
+    sql="insert "+table+" (dt,c2h6,ch4) values (%s,%s,%s)"
+    params=[]
+    for row in _loadRows(opts):
+        params.append(row)
+        if db.doMultiInsert(sql,params) : params=[]
+    db.doMultiInsert(sql,params,all=True)
+    return db.doquery("select count(*) from "+table,numRows=0)
+
+@case('load-values','insert loadRows synthetic rows with bulkLoad(method=values), packet sized multi row inserts')
+def benchLoadValues(db,opts):
+    table=_loadTable(db)
+    db.bulkLoad(table,['dt','c2h6','ch4'],_loadRows(opts),method='values')
+    return db.doquery("select count(*) from "+table,numRows=0)
+
+@case('load-infile','insert loadRows synthetic rows with bulkLoad(method=infile), load data local infile over a pipe')
+def benchLoadInfile(db,opts):
+    db=db_conn.DatabaseConn(localInfile=True,**opts['connArgs'])
+    table=_loadTable(db)
+    db.bulkLoad(table,['dt','c2h6','ch4'],_loadRows(opts),method='infile')
+    return db.doquery("select count(*) from "+table,numRows=0)
+
+@case('fanout-serial','run the query 20 times one after another on one DatabaseConn')
+def benchFanoutSerial(db,opts):
+    n=0
+    for i in range(20):
+        a=db.doquery(opts['query'],form='list')
+        n+=len(a) if a else 0
+    return n,20
+
+@case('fanout-async','run the query 20 times concurrently on an AsyncDatabaseConn (requires aiomysql)')
+def benchFanoutAsync(db,opts):
+    import asyncio
+    import db_utils.db_async as db_async
+    async def run():
+        async with db_async.AsyncDatabaseConn(**opts['connArgs']) as adb:
+            return await asyncio.gather(*[adb.doquery(opts['query'],form='list') for i in range(20)])
+    return sum(len(a) for a in asyncio.run(run()) if a),20
+
+@case('parallel-numpy','form=numpy split into 4 num range partitions with parallelQuery (set -q to a plain "select ... from t" with a num col)')
+def benchParallelNumpy(db,opts):
+    import db_utils.db_parallel as db_parallel
+    import db_utils.bldsql as bldsql
+    lo,hi=db.doquery("select min(num),max(num) from (%s) t" % opts['query'],form='list')[0]
+    sql=bldsql.BldSQL()
+    sql.table("(%s) t" % opts['query'])
+    sql.col("t.*")
+    b=db.parallelQuery(sql,"t.num",db_parallel.numRanges(lo,hi,4),form='numpy',concurrency=4)
+    return len(next(iter(b.values()))) if b else 0
+
+
+@case('dat-inmemory','formatted text file built in memory with listToTextCols (the original dat/txt method)')
+def benchDatInMemory(db,opts):
+    lines=db.doquery(opts['query'],form='text',stream=True)
+    if not lines : return 0
+    with open(opts['outfile'],'w') as f:
+        for line in lines : f.write('%s\n' % line)
+    return len(lines)-1
+
+@case('dat-exact','formatted text file, streamed with exact widths from a spooled first pass (textWidths=exact)')
+def benchDatExact(db,opts):
+    db.doquery(opts['query'],outfile=opts['outfile'],form='dat')
+    return _countLines(opts['outfile'])-1
+
+@case('dat-sample','formatted text file, streamed with widths from the first rows (textWidths=sample)')
+def benchDatSample(db,opts):
+    db.doquery(opts['query'],outfile=opts['outfile'],form='dat',textWidths='sample')
+    return _countLines(opts['outfile'])-1
+
+@case('lookup-text','2000 single row lookups by num built with BldSQL, sent as text queries (query needs a num col)')
+def benchLookupText(db,opts):
+    return _lookups(db,opts,False)
+
+@case('lookup-prepared','the same 2000 lookups as lookup-text run as a cached server side prepared statement (prepared=True)')
+def benchLookupPrepared(db,opts):
+    return _lookups(db,opts,True)
+
+def _lookups(db,opts,prepared):
+    import db_utils.bldsql as bldsql
+    lo,hi=db.doquery("select min(num),max(num) from (%s) t" % opts['query'],form='list')[0]
+    sql=bldsql.BldSQL()
+    sql.col("*")
+    sql.table("(%s) t" % opts['query'])
+    n=calls=0
+    for num in range(lo,hi+1,max(1,(hi-lo)//2000)):
+        sql.where("num=%s",num,replace=True)
+        a=db.doquery(sql,form='list',prepared=prepared)
+        n+=len(a) if a else 0
+        calls+=1
+    return n,calls
+
+def _batchLookups(db,opts):
+    #100 batches of 20 single row lookups by num from -t table
+    lo,hi=db.doquery("select min(num),max(num) from %s" % opts['table'],form='list')[0]
+    nums=list(range(lo,hi+1,max(1,(hi-lo)//2000)))[:2000]
+    return [[("select * from %s where num=%%s" % opts['table'],[num]) for num in nums[i:i+20]] for i in range(0,len(nums),20)]
+
+@case('batch-sequential','100 batches of 20 single row lookups by num on -t table, 1 doquery per lookup')
+def benchBatchSequential(db,opts):
+    n=calls=0
+    for batch in _batchLookups(db,opts):
+        for query,params in batch:
+            a=db.doquery(query,params,form='list')
+            n+=len(a) if a else 0
+            calls+=1
+    return n,calls
+
+@case('batch-doqueries','the same lookups as batch-sequential, each batch of 20 sent in 1 round trip with doqueries()')
+def benchBatchDoqueries(db,opts):
+    n=calls=0
+    for batch in _batchLookups(db,opts):
+        for a in db.doqueries(batch,form='list') : n+=len(a) if a else 0
+        calls+=1
+    return n,calls
+
+@case('page-offset','page through up to loadRows rows of -t table by num in 1000 row pages with limit offset,n')
+def benchPageOffset(db,opts):
+    n=0
+    while n<opts['loadRows'] :
+        a=db.doquery("select * from %s order by num limit %s,1000" % (opts['table'],n),form='list')
+        if not a : break
+        n+=len(a)
+    return n
+
+@case('page-keyset','page through the same rows as page-offset with keyset pagination (db.pages())')
+def benchPageKeyset(db,opts):
+    import db_utils.bldsql as bldsql
+    sql=bldsql.BldSQL()
+    sql.col("*")
+    sql.table(opts['table'])
+    n=0
+    for rows,token in db.pages(sql,'num',1000,form='list'):
+        n+=len(rows)
+        if n>=opts['loadRows'] : break
+    return n
+
+@case('wherein-inline','select 100k rows of -t table by a 100k value num in (...) list')
+def benchWhereinInline(db,opts):
+    return _wherein(db,opts,'inline')
+
+@case('wherein-temptable','the wherein-inline select with the values loaded into an indexed temp table (BldSQL wherein strategy temptable)')
+def benchWhereinTempTable(db,opts):
+    return _wherein(db,opts,'temptable')
+
+@case('wherein-chunk','the wherein-inline select run in chunks of BldSQL.whereinThreshold values (BldSQL wherein strategy chunk)')
+def benchWhereinChunk(db,opts):
+    return _wherein(db,opts,'chunk')
+
+def _wherein(db,opts,strategy):
+    import db_utils.bldsql as bldsql
+    nums=[r[0] for r in db.doquery("select num from %s limit 100000" % opts['table'],form='list')]
+    sql=bldsql.BldSQL()
+    sql.col("*")
+    sql.table(opts['table'])
+    sql.wherein("num in",nums,strategy=strategy)
+    a=db.doquery(sql,form='list')
+    return len(a) if a else 0
+
+@case('list-decimal','form=list with the default conversions (decimals as decimal.Decimal, convProfile=default)')
+def benchListDecimal(db,opts):
+    a=db.doquery(opts['query'],form='list',convProfile='default')
+    return len(a) if a else 0
+
+@case('list-raw','form=list with no conversion (convProfile=raw)')
+def benchListRaw(db,opts):
+    a=db.doquery(opts['query'],form='list',convProfile='raw')
+    return len(a) if a else 0
+
+@case('list-lazy','form=list with lazy conversion, only the first column is converted (convProfile=lazy)')
+def benchListLazy(db,opts):
+    a=db.doquery(opts['query'],form='list',convProfile='lazy')
+    if not a : return 0
+    a.column(0)
+    return len(a)
+
+@case('rows-dict','form=dict (a dict per row), reading 1 column of every row')
+def benchRowsDict(db,opts):
+    return _readRows(db.doquery(opts['query'],form='dict'))
+
+@case('rows-record','form=record (shared schema tuple rows), reading 1 column of every row')
+def benchRowsRecord(db,opts):
+    return _readRows(db.doquery(opts['query'],form='record'))
+
+@case('rows-resultset','form=resultset (columnar with row views), reading 1 column of every row')
+def benchRowsResultSet(db,opts):
+    return _readRows(db.doquery(opts['query'],form='resultset'))
+
+def _readRows(a):
+    if not a : return 0
+    n=0
+    col=list(a[0].keys())[0]
+    for row in a:
+        row[col]
+        n+=1
+    return n
+
+@case('csv-gzip','csv file output gzip compressed (compression=gzip)')
+def benchCsvGzip(db,opts):
+    db.doquery(opts['query'],outfile=opts['outfile'],form='csv',compression='gzip')
+    return _countLinesGz(opts['outfile'])-1
+
+@case('csv-gzip-parallel','csv file output gzip compressed on 4 threads (compression=gzip,compressThreads=4)')
+def benchCsvGzipParallel(db,opts):
+    db.doquery(opts['query'],outfile=opts['outfile'],form='csv',compression='gzip',compressThreads=4)
+    return _countLinesGz(opts['outfile'])-1
+
+@case('csv-zstd','csv file output zstd compressed on 4 threads (compression=zstd,compressThreads=4, requires zstandard)')
+def benchCsvZstd(db,opts):
+    db.doquery(opts['query'],outfile=opts['outfile'],form='csv',compression='zstd',compressThreads=4)
+    import zstandard,io
+    with open(opts['outfile'],'rb') as f:
+        return sum(1 for line in io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(f)))-1
+
+def _countLinesGz(fn):
+    import gzip
+    with gzip.open(fn,'rt') as f : return sum(1 for line in f)
+
+def _txnRows(opts):
+    import itertools
+    return itertools.islice(_loadRows(opts),min(opts['loadRows'],20000))
+
+@case('txn-autocommit','single row inserts (up to 20000 of loadRows), 1 doquery (and commit) per row')
+def benchTxnAutocommit(db,opts):
+    table=_loadTable(db)
+    sql="insert "+table+" (dt,c2h6,ch4) values (%s,%s,%s)"
+    for row in _txnRows(opts) : db.doquery(sql,row)
+    n=db.doquery("select count(*) from "+table,numRows=0)
+    return n,n
+
+@case('txn-execute','single row inserts (up to 20000 of loadRows) in 1 transaction, 1 round trip per row (transaction().execute)')
+def benchTxnExecute(db,opts):
+    table=_loadTable(db)
+    sql="insert "+table+" (dt,c2h6,ch4) values (%s,%s,%s)"
+    with db.transaction() as t:
+        for row in _txnRows(opts) : t.execute(sql,row)
+    n=db.doquery("select count(*) from "+table,numRows=0)
+    return n,n
+
+@case('txn-batched','single row inserts (up to 20000 of loadRows) in 1 transaction, sent in multi statement batches (transaction().add)')
+def benchTxnBatched(db,opts):
+    table=_loadTable(db)
+    sql="insert "+table+" (dt,c2h6,ch4) values (%s,%s,%s)"
+    with db.transaction() as t:
+        for row in _txnRows(opts) : t.add(sql,row)
+    n=db.doquery("select count(*) from "+table,numRows=0)
+    return n,n
+
+def _snapshotSql(opts):
+    import db_utils.bldsql as bldsql
+    sql=bldsql.BldSQL()
+    sql.col("*")
+    sql.table(opts['table'])
+    return sql
+
+@case('snapshot-full','build a local snapshot of the -t table (db.snapshot(refresh=True)), reading every row of 1 mapped column')
+def benchSnapshotFull(db,opts):
+    a=db.snapshot(_snapshotSql(opts),opts['outfile']+'_snap',key='num',refresh=True)
+    return len(a['num']) if a else 0
+
+@case('snapshot-delta','sync the snapshot made by snapshot-full (only rows past its high-water mark are selected), reading 1 mapped column')
+def benchSnapshotDelta(db,opts):
+    a=db.snapshot(_snapshotSql(opts),opts['outfile']+'_snap',key='num')
+    return len(a['num']) if a else 0
+
+@case('downsample','load loadRows synthetic 1s rows, then plot sized (2000 point) series; raw numpy pull + client binning vs server minmax and lttb')
+def benchDownsample(db,opts):
+    import math
+    import numpy as np
+    import db_utils.bldsql as bldsql
+    import db_utils.db_downsample as db_downsample
+    table=_loadTable(db)
+    db.bulkLoad(table,['dt','c2h6','ch4'],_loadRows(opts))
+    sql=bldsql.BldSQL()
+    sql.table(table);sql.col("dt");sql.col("ch4")
+    start=time.time()
+    a=db.doquery(sql,form='numpy',numpyDatetime64=True)
+    #the same epoch aligned time buckets as the server minmax method (points/2 buckets over the time range)
+    t=a['dt'].astype('datetime64[s]').view(np.int64)
+    order=np.argsort(t,kind='stable')
+    t,v=t[order],a['ch4'][order]
+    seconds=max(1,int(math.ceil((t[-1]-t[0])/1000.)))
+    keys=t//seconds
+    edges=np.concatenate(([0],np.flatnonzero(np.diff(keys))+1))
+    x,y=db_downsample.minMaxPoints((keys[edges]*seconds).astype('datetime64[s]'),np.minimum.reduceat(v,edges),np.maximum.reduceat(v,edges))
+    print("  raw pull + client minmax: %s rows transferred, %s points, %.3fs" % (len(v),len(y),time.time()-start))
+    for method in ('minmax','lttb'):
+        start=time.time()
+        b=db.downsample(sql,'dt','ch4',2000,method)
+        print("  server %-6s: %s points, %.3fs" % (method,len(b['ch4']),time.time()-start))
+        if method=='minmax' and not (np.array_equal(b['dt'],x) and np.allclose(b['ch4'],y)) : raise AssertionError("client and server minmax points differ")
+    return len(v)
+
+_handoffWorkers=4
+def _handoffSum(a):
+    #what each worker does with the result; touch every value of every numeric column
+    return sum(int(v.size) for v in a.values() if v.dtype.kind in 'iufM')
+
+def _handoffRequery(args):
+    connArgs,query=args
+    return _handoffSum(db_conn.DatabaseConn(**connArgs).doquery(query,form='numpy'))
+
+def _handoffPickled(a):
+    return _handoffSum(a)
+
+def _handoffShared(h):
+    with h as a : return _handoffSum(a)
+
+@case('handoff-requery','4 pool worker processes that each need the form=numpy result, each running the query itself')
+def benchHandoffRequery(db,opts):
+    with multiprocessing.Pool(_handoffWorkers) as pool:
+        r=pool.map(_handoffRequery,[(opts['connArgs'],opts['query'])]*_handoffWorkers)
+    return r[0]
+
+@case('handoff-pickle','the handoff-requery workers given the numpy result of 1 query, pickled to each')
+def benchHandoffPickle(db,opts):
+    a=db.doquery(opts['query'],form='numpy')
+    with multiprocessing.Pool(_handoffWorkers) as pool:
+        r=pool.map(_handoffPickled,[a]*_handoffWorkers)
+    return r[0]
+
+@case('handoff-shared','the handoff-requery workers attaching zero copy to the result of 1 query in shared memory (shared=True)')
+def benchHandoffShared(db,opts):
+    h=db.doquery(opts['query'],form='numpy',shared=True)
+    try:
+        with multiprocessing.Pool(_handoffWorkers) as pool:
+            r=pool.map(_handoffShared,[h]*_handoffWorkers)
+    finally:
+        h.release()
+    return r[0]
+
+_startupScript="""
+import sys,json,time
+connArgs=json.loads(sys.stdin.read())
+t=[time.perf_counter()]
+import db_utils.db_conn as db_conn
+t.append(time.perf_counter())
+db=db_conn.DatabaseConn(**connArgs)
+t.append(time.perf_counter())
+db.connect()
+t.append(time.perf_counter())
+db.doquery("select 1",numRows=0)
+t.append(time.perf_counter())
+db.doquery("select 1",form='list')
+t.append(time.perf_counter())
+print(json.dumps([b-a for a,b in zip(t,t[1:])]))
+"""
+
+@case('startup','startup cost of a short script in a fresh interpreter; import db_conn, DatabaseConn(), connect, first and second query')
+def benchStartup(db,opts):
+    import json,subprocess
+    p=subprocess.run([sys.executable,'-X','importtime','-c',_startupScript],input=json.dumps(opts['connArgs']),capture_output=True,text=True)
+    if p.returncode : raise Exception(p.stderr.strip().splitlines()[-1] if p.stderr.strip() else "startup script failed")
+    times=json.loads(p.stdout.strip().splitlines()[-1])
+    for label,secs in zip(('import db_conn','DatabaseConn()','connect','first query','second query'),times):
+        print("  %-16s %8.2f ms" % (label,secs*1000))
+    #-X importtime lines are 'import time: self | cumulative | module' (microseconds), nested modules indented
+    mods=[]
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line : continue
+        selfUs,cumUs,name=line[12:].split('|')
+        mods.append((int(selfUs),int(cumUs),name.strip()))
+    print("  slowest imports (self ms, cumulative ms):")
+    for selfUs,cumUs,name in sorted(mods,reverse=True)[:10] : print("    %-30s %8.2f %8.2f" % (name,selfUs/1000.,cumUs/1000.))
+    return 1
+
+
+def _maxRSS():
+    #peak resident set size of this process in MB (ru_maxrss is kb on linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+def _runCase(name,connArgs,opts,conn):
+    #Child process body.  Sends back a dict of results.
+    try:
+        desc,func=_cases[name]
+        db=db_conn.DatabaseConn(**connArgs)
+        rss0=_maxRSS()
+        start=time.time()
+        rows=func(db,opts)
+        wall=time.time()-start
+        rss1=_maxRSS()
+        calls=None
+        if isinstance(rows,tuple) : rows,calls=rows #cases made of many small calls also return the number of calls
+        r=dict(case=name,rows=rows,wall=wall,rowsPerSec=rows/wall if wall else 0,peakRSS=rss1,deltaRSS=rss1-rss0)
+        if calls : r.update(calls=calls,latencyMs=wall*1000./calls)
+        conn.send(r)
+    except Exception as e:
+        conn.send(dict(case=name,error=str(e)))
+    finally:
+        conn.close()
+
+def runCase(name,connArgs,opts):
+    #Runs benchmark case name in a separate process and returns the results dict
+    ctx=multiprocessing.get_context('fork')
+    parent,child=ctx.Pipe(duplex=False)
+    p=ctx.Process(target=_runCase,args=(name,connArgs,opts,child))
+    p.start()
+    child.close()
+    ret=parent.recv()
+    p.join()
+    return ret
+
+def printResult(r):
+    if 'error' in r : print("%-20s ERROR: %s" % (r['case'],r['error']))
+    else :
+        latency=" latency(ms):%.3f" % r['latencyMs'] if 'latencyMs' in r else ""
+        print("%-20s rows:%-10s wall(s):%-10.3f rows/s:%-12.0f peakRSS(MB):%-10.1f deltaRSS(MB):%.1f%s" % (r['case'],r['rows'],r['wall'],r['rowsPerSec'],r['peakRSS'],r['deltaRSS'],latency))
+
+
+#Synthetic fixture data, so the suite can run against any (local) server
+_fixtureCols=['num','event_num','site_num','parameter_num','program_num','ev_datetime','value','unc','flag','inst','comment']
+
+def _fixtureRows(n):
+    #Deterministic flask_data like rows; ~2 events per day at 60 sites, 6 parameters per event, a few NULL values and comments
+    import random
+    rnd=random.Random(42)
+    start=datetime.datetime(2000,1,1)
+    flags=['...']*18+['..>','X..']
+    insts=['H4','H6','L8','M3','CS1']
+    for i in range(n):
+        event=i//6
+        parameter=1+i%6
+        dt=start+datetime.timedelta(seconds=event*720+rnd.randrange(600))
+        value=None if rnd.random()<.02 else round(rnd.gauss((400,1850,320,110,1.5,2.)[parameter-1],5),4)
+        comment='retained sample %s' % event if rnd.random()<.01 else None
+        yield (i+1,event+1,1+event%60,parameter,1,dt,value,round(rnd.random()*.5,3),rnd.choice(flags),rnd.choice(insts),comment)
+
+def createFixture(db,table,rows,force=False):
+    #Creates synthetic flask_data like table (in the connection's db) with rows rows, unless it already has that many
+    exists=db.doquery("select count(*) from information_schema.tables where table_schema=database() and table_name=%s",[table],numRows=0)
+    if exists and not force and db.doquery("select count(*) from "+table,numRows=0)==rows :
+        print("Using existing fixture table %s (%s rows)" % (table,rows))
+        return
+    print("Creating fixture table %s with %s rows" % (table,rows))
+    start=time.time()
+    db.doquery("drop table if exists "+table)
+    db.doquery("""create table %s (
+        num int unsigned not null primary key,
+        event_num int unsigned not null,
+        site_num smallint unsigned not null,
+        parameter_num smallint unsigned not null,
+        program_num tinyint unsigned not null,
+        ev_datetime datetime not null,
+        value decimal(12,4),
+        unc float,
+        flag char(3) not null,
+        inst varchar(8) not null,
+        comment varchar(255),
+        modification_datetime timestamp not null default current_timestamp on update current_timestamp,
+        key (event_num),
+        key (site_num,parameter_num,ev_datetime))""" % table)
+    r=db.bulkLoad(table,_fixtureCols,_fixtureRows(rows))
+    db.doquery("analyze table "+table)
+    print("  loaded %s rows in %.1fs (%s)" % (rows,time.time()-start,r['method']))
+
+def startServer(tmpdir):
+    #Starts a throwaway MariaDB server on a free local port with its data dir in tmpdir.  Returns (connArgs,process)
+    import socket,subprocess,pwd
+    server=shutil.which('mariadbd') or shutil.which('mysqld')
+    install=shutil.which('mariadb-install-db') or shutil.which('mysql_install_db')
+    if not server or not install : raise Exception("-M needs mariadbd and mariadb-install-db on the PATH")
+    user=pwd.getpwuid(os.getuid()).pw_name
+    datadir=os.path.join(tmpdir,'data')
+    subprocess.run([install,'--no-defaults','--datadir='+datadir,'--user='+user,'--auth-root-authentication-method=normal','--skip-test-db'],
+        check=True,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1',0))
+        port=sock.getsockname()[1]
+    log=open(os.path.join(tmpdir,'server.log'),'w')
+    p=subprocess.Popen([server,'--no-defaults','--datadir='+datadir,'--user='+user,'--port=%d' % port,'--bind-address=127.0.0.1',
+        '--socket='+os.path.join(tmpdir,'server.sock'),'--local-infile=1','--max-allowed-packet=64M','--innodb-buffer-pool-size=1G',
+        '--innodb-flush-log-at-trx-commit=2','--skip-log-bin'],stdout=log,stderr=log)
+    connArgs=dict(host='127.0.0.1',port=port,user='root',password='',db='bench')
+    import MySQLdb
+    for i in range(300):
+        if p.poll() is not None : raise Exception("mariadbd exited, see %s" % log.name)
+        try:
+            conn=MySQLdb.connect(host='127.0.0.1',port=port,user='root',passwd='')
+            break
+        except MySQLdb.OperationalError : time.sleep(.1)
+    else : raise Exception("mariadbd didn't start, see %s" % log.name)
+    c=conn.cursor()
+    for db in ('bench','tmp') : c.execute("create database if not exists "+db)
+    conn.close()
+    print("Started %s on port %s" % (server,port))
+    return connArgs,p
+
+def environment(connArgs):
+    #Versions and settings stored with json results
+    import platform,subprocess
+    env=dict(time=datetime.datetime.now().isoformat(timespec='seconds'),python=platform.python_version(),platform=platform.platform(),
+        host=connArgs.get('host'),db=connArgs.get('db'))
+    try:
+        here=os.path.dirname(os.path.abspath(__file__))
+        env['db_utils']=subprocess.run(['git','-C',here,'describe','--always','--dirty'],capture_output=True,text=True,check=True).stdout.strip()
+    except Exception : env['db_utils']=None
+    try:
+        db=db_conn.DatabaseConn(**connArgs)
+        env['server']=db.doquery("select version()",numRows=0)
+        db.close()
+    except Exception : env['server']=None
+    return env
+
+def compareResults(results,baselineFile,threshold=1.1):
+    #Prints wall time ratios of results to the saved results in baselineFile, flagging cases slower by more than threshold
+    with open(baselineFile) as f : baseline=json.load(f)
+    base=dict()
+    for r in baseline['results'] :
+        if 'error' not in r : base.setdefault(r['case'],[]).append(r['wall'])
+    cur=dict()
+    for r in results :
+        if 'error' not in r : cur.setdefault(r['case'],[]).append(r['wall'])
+    print("\nCompared to %s (db_utils %s, %s):" % (baselineFile,baseline['environment'].get('db_utils'),baseline['environment'].get('time')))
+    for name,walls in cur.items():
+        if name not in base : continue
+        ratio=min(walls)/min(base[name]) if min(base[name]) else 0
+        flag="  SLOWER" if ratio>threshold else ("  faster" if ratio<1/threshold else "")
+        print("%-20s wall(s):%-10.3f baseline:%-10.3f ratio:%.2f%s" % (name,min(walls),min(base[name]),ratio,flag))
+
+def usage():
+    print(__doc__)
+    sys.exit()
+
+def main(argv):
+    connArgs=dict(host='localhost',user='guest',password='',db='ccgg')
+    opts=dict(query="select * from flask_data",table="flask_data",outfile=None,loadRows=1000000)
+    repeats=1
+    fixtureRows=None
+    localServer=False
+    jsonFile=None
+    baselineFile=None
+    try:
+        o,args=getopt.getopt(argv,"H:P:u:p:d:q:t:n:r:f:Mo:c:lh")
+    except getopt.GetoptError as e:
+        print(e)
+        usage()
+    for k,v in o:
+        if k=='-H' : connArgs['host']=v
+        elif k=='-P' : connArgs['port']=int(v)
+        elif k=='-u' : connArgs['user']=v
+        elif k=='-p' : connArgs['password']=v
+        elif k=='-d' : connArgs['db']=v
+        elif k=='-q' : opts['query']=v
+        elif k=='-t' : opts['table']=v
+        elif k=='-n' : opts['loadRows']=int(v)
+        elif k=='-r' : repeats=int(v)
+        elif k=='-f' : fixtureRows=int(v)
+        elif k=='-M' : localServer=True
+        elif k=='-o' : jsonFile=v
+        elif k=='-c' : baselineFile=v
+        elif k=='-l' :
+            for name,(desc,func) in _cases.items(): print("%-20s %s" % (name,desc))
+            sys.exit()
+        else : usage()
+
+    names=args if args else list(_cases.keys())
+    for name in names:
+        if name not in _cases :
+            print("Unknown case: %s" % name)
+            usage()
+
+    tmpdir=tempfile.mkdtemp(prefix='db_utils_bench_')
+    opts['outfile']=os.path.join(tmpdir,'out')
+    server=None
+    results=[]
+    try:
+        if localServer : connArgs,server=startServer(tmpdir)
+        if fixtureRows :
+            db=db_conn.DatabaseConn(localInfile=True,**connArgs)
+            createFixture(db,opts['table'],fixtureRows)
+            db.close()
+        opts['connArgs']=connArgs
+        for name in names:
+            for i in range(repeats):
+                r=runCase(name,connArgs,opts)
+                printResult(r)
+                results.append(r)
+        if jsonFile or baselineFile :
+            out=dict(environment=environment(connArgs),options=dict(query=opts['query'],table=opts['table'],loadRows=opts['loadRows'],
+                fixtureRows=fixtureRows,repeats=repeats),results=results)
+            if jsonFile :
+                with open(jsonFile,'w') as f : json.dump(out,f,indent=1)
+                print("Results written to %s" % jsonFile)
+            if baselineFile : compareResults(results,baselineFile)
+    finally:
+        if server is not None :
+            server.terminate()
+            server.wait(60)
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -13,9 +13,39 @@ See example.py in same directory for sample code.
 
 """
 
+import copy
+import hashlib
+import itertools
+
+_tableIds=itertools.count(1) #for unique wherein() temp table names
+
+def resultName(column):
+    #Returns the result column name of select column expression column ('d.value' -> 'value', "avg(v) as 'mean'" -> 'mean')
+    c=column.strip()
+    i=c.lower().rfind(' as ')
+    if i>=0 : c=c[i+4:]
+    else : c=c.split('.')[-1]
+    return c.strip().strip("`'\"")
+
+def _expression(column):
+    #Returns select column expression column without its alias ("avg(v) as 'mean'" -> 'avg(v)')
+    c=column.strip()
+    i=c.lower().rfind(' as ')
+    return c[:i].strip() if i>=0 else c
+
+
+def _inList(whereClause,n):
+    #whereClause ("id_num in ") with an in list of n %s place holders.  An empty list can't be written as in (), so it becomes
+    #a condition that's always false (always true for 'not in').
+    if n : return "%s (%s)" % (whereClause,",".join(['%s']*n))
+    return "1=1" if whereClause.strip()[-7:].lower()==' not in' else "1=0"
+
 
 class BldSQL(object):
     """Class to generate sql statements programmatically using a query builder"""
+
+    whereinThreshold=1000 #wherein() lists longer than this use a temp table instead of an inline in (...) list.  Set per object to change
+
     def __init__(self):
         self.initQuery()
         
@@ -28,73 +58,256 @@ class BldSQL(object):
         self._orderbys=[]
         self._limitKeyword=''
         self._parameters=[]
+        self._whereParams=[] #number of bind parameters of each where clause, to find a clause's parameters for where(...,replace=True)
         self._leftJoins=[]
         self._tempTableName=""
         self._tempTableIndex=""
         self._innerJoins=[]
+        self._whereinTables=[] #(table,column,values,fromClause) for wherein() lists loaded into temp tables (fromClause None for this query's)
+        self._whereinChunk=None #wherein(...,strategy='chunk') list, run as several queries by doquery
+        self._seekKeys=[]
+        self._seekAfter=None
+        self._seekDesc=False
+        self._cmd=None #compiled sql, cached by cmd() until the query structure changes
         
     def col(self,column): #add a column to the select.  It can be just the column or with an alias "col as 'name'"
-        if (column not in self._cols) : self._cols.append(column)
+        if (column not in self._cols) :
+            self._cols.append(column)
+            self._cmd=None
+
+    def colExpression(self,column):
+        #Returns the select expression of result column column, for use in a where clause (which can't refer to select aliases).
+        #column can be a result name or alias ('mdt' for col "modification_datetime as mdt" -> 'modification_datetime') or a select
+        #expression; it's returned as is (without any alias) if it isn't one of the selected columns.
+        name=resultName(column)
+        for c in self._cols:
+            if resultName(c)==name : return _expression(c)
+        return _expression(column)
     
     def table(self,tableName): #Add a table to the from clause.  Can be table name or with alias "mytable t"
-        if tableName not in self._tables : self._tables.append(tableName)
+        if tableName not in self._tables :
+            self._tables.append(tableName)
+            self._cmd=None
         
     def createTempTable(self,tempTableName,index=None):
         #This creates temp table tempTableName with index using query
         #Index should be passed like: 'index_name (col1,col2)'
         self._tempTableName=tempTableName
         if index : self._tempTableIndex=index
+        self._cmd=None
         
     def innerJoin(self,tableClause):
         #add inner join clause ex: inner join table2 t2 on baseTable.num=t2.num
         ij="inner join "+tableClause
-        if ij not in self._innerJoins : self._innerJoins.append(ij)
+        if ij not in self._innerJoins :
+            self._innerJoins.append(ij)
+            self._cmd=None
         
     def leftJoin(self,tableClause): #Add a left join to the from clause
         #Not sure this is working yet.. ran into trouble with other joins not being straight/inner and it gives error 'unknown col...'
         lj="left join "+tableClause
-        if(lj not in self._leftJoins) : self._leftJoins.append(lj)
+        if(lj not in self._leftJoins) :
+            self._leftJoins.append(lj)
+            self._cmd=None
         
     def where(self,whereClause,bindParameter=None,replace=False): #Add clause to the where conditions.  All are and'd together.
         #If passing a bind param, use a %s place holder in the where clause like this: where('num=%s',event_num)
         #% can be escaped by doubling: where("name like 'john%%'")
-        #If bind parameter passed, you can also use replace=True to change the value (like for a loop)
+        #If bind parameter passed, you can also use replace=True to change the value (like for a loop).  This only changes the
+        #bind parameters, so the compiled sql from cmd() is reused.
         i=None
         if(whereClause in self._wheres) : i=self._wheres.index(whereClause) 
         if(i!=None and replace):
-            if(bindParameter!=None): self._parameters[i]=bindParameter
+            if(bindParameter!=None):
+                if self._whereParams[i]!=1 : raise ValueError("where clause '%s' doesn't have 1 bind parameter to replace" % whereClause)
+                self._parameters[len(self._parameters)-sum(self._whereParams[i:])]=bindParameter #(parameters before the wheres are from derived())
         else:
             self._wheres.append(whereClause)
-            if(bindParameter) : self._parameters.append(bindParameter)
+            self._whereParams.append(1 if bindParameter!=None else 0)
+            if(bindParameter!=None) : self._parameters.append(bindParameter) #!=None so 0/'' bind values aren't dropped
+            self._cmd=None
             
-    def wherein(self,whereClause,bindParameters):
+    def wherein(self,whereClause,bindParameters,strategy=None,threshold=None):
         #Pass the where clause like "id_num in " this will append '(%s,%s,%s...)' for each bindParameter and then add them as params
-        whereClause+=" ("
-        t=""
-        for p in bindParameters:
-            t=self.appendToList(t,'%s') #build the bind placeholders
-            self._parameters.append(p)
-        whereClause+=t
-        whereClause+=")"
-        self._wheres.append(whereClause)
+        #Large lists (100k event nums) make huge sql that the server plans poorly and can go over max_allowed_packet, so lists longer
+        #than threshold (default self.whereinThreshold) use a different strategy:
+        #   -'temptable' (default for long lists); doquery bulk loads the (distinct) values into an indexed temporary table and
+        #       the clause becomes "id_num in (select v from <temp table>)" which the server runs as a semi join.  The temp table
+        #       column is created with the same type as id_num.  'not in' clauses are supported too.
+        #   -'chunk'; doquery runs the query once per threshold sized chunk of values (with an inline in list) and merges the results.
+        #       Only for plain selects returning 'dict','list' or 'numpy' (order by, group by, limit and distinct apply per chunk).
+        #   -'inline'; always use an inline in (...) list
+        #Note the temptable and chunk strategies need doquery (or iterquery) to run the query, cmd() alone isn't enough.
+        values=list(bindParameters)
+        if threshold is None : threshold=self.whereinThreshold
+        if strategy is None : strategy='temptable' if len(values)>threshold else 'inline'
+        if strategy not in ('inline','temptable','chunk') : raise ValueError("Unknown wherein strategy '%s'" % strategy)
+        self._cmd=None
+
+        if strategy=='temptable' :
+            column=whereClause.strip()
+            if column[-3:].lower()!=' in' : raise ValueError("wherein clause must end with 'in' for the temptable strategy: %s" % whereClause)
+            column=column[:-3]
+            neg=""
+            if column[-4:].lower()==' not' : column,neg=column[:-4],"not "
+            table="tmp.t__bldsql_in%d" % next(_tableIds)
+            self._whereinTables.append((table,column.strip(),list(dict.fromkeys(v for v in values if v is not None)),None))
+            self._wheres.append("%s %sin (select v from %s)" % (column.strip(),neg,table))
+            self._whereParams.append(0)
+            return
+
+        if strategy=='chunk' :
+            if self._whereinChunk is not None : raise ValueError("Only 1 wherein list per query can use the chunk strategy")
+            if not threshold>0 : raise ValueError("wherein chunk size (threshold) must be at least 1, not %s" % threshold)
+            self._whereinChunk=dict(where=len(self._wheres),pos=len(self._parameters),clause=whereClause,values=values,size=threshold)
+        self._wheres.append(_inList(whereClause,len(values)))
+        self._whereParams.append(len(values))
+        self._parameters.extend(values)
+
+    def whereinTables(self):
+        #Returns a list of (table,createSQL,values) for wherein() lists using the temptable strategy.  createSQL makes the empty
+        #temp table with a single primary key column v of the same type as the column it's compared to.  Used by doquery.
+        return [(table,"create temporary table %s (primary key (v)) select %s as v from %s where 1=0" % (table,column,frm or self._fromClause()),values)
+            for table,column,values,frm in self._whereinTables]
+
+    def _fromClause(self):
+        return " ".join([", ".join(self._tables)]+self._innerJoins+self._leftJoins)
+
+    def whereinChunks(self):
+        #Returns a list of BldSQL copies, 1 per chunk of the wherein(...,strategy='chunk') list, or None if there isn't one.  Used by doquery.
+        w=self._whereinChunk
+        if w is None : return None
+        n=len(w['values'])
+        before,after=self._parameters[:w['pos']],self._parameters[w['pos']+n:]
+        out=[]
+        for i in range(0,max(n,1),w['size']):
+            #Shallow copies (a deepcopy would copy the whole value list for every chunk); the clause lists are copied so the
+            #chunks don't share them and only this chunk's values are spliced into the parameters.
+            chunk=w['values'][i:i+w['size']]
+            s=copy.copy(self)
+            for k,v in self.__dict__.items():
+                if isinstance(v,list) and k!='_parameters' : setattr(s,k,list(v))
+            s._whereinChunk=None
+            s._wheres[w['where']]=_inList(w['clause'],len(chunk))
+            s._whereParams[w['where']]=len(chunk)
+            s._parameters=before+chunk+after
+            s._cmd=None
+            out.append(s)
+        return out
+
+    def whereinKey(self):
+        #Digest of the temp table wherein() values (which aren't in the sql text or bind parameters), for result caching
+        if not self._whereinTables : return None
+        return hashlib.sha1(repr([v for t,c,v,f in self._whereinTables]).encode('utf-8')).hexdigest()
     
+    def seek(self,keys,after=None,descending=False):
+        #Keyset (seek) pagination.  keys is an ordered unique (not null) key; a column or list of columns like 'num' or ['date','num'].
+        #Rows are ordered by keys (this replaces any orderby()) and if after is passed (the key values of the last row of the previous
+        #page, a value or tuple) only rows after it are selected.  Use with limit(pageSize).  Unlike 'limit offset,n' paging, the server
+        #seeks straight to the start of the page on the key's index, so every page costs the same.
+        #Call again with the next after value for the next page; only the bind parameters change so the compiled sql is reused.
+        #See DatabaseConn.page() for a wrapper that returns an opaque continuation token.
+        if isinstance(keys,str) : keys=[keys]
+        if after is not None and not isinstance(after,(list,tuple)) : after=(after,)
+        if after is not None and len(after)!=len(keys) : raise ValueError("seek after has %s values for %s keys" % (len(after),len(keys)))
+        if list(keys)!=self._seekKeys or descending!=self._seekDesc or (after is None)!=(self._seekAfter is None) : self._cmd=None
+        self._seekKeys=list(keys)
+        self._seekAfter=tuple(after) if after is not None else None
+        self._seekDesc=descending
+
+    def _seekWhere(self):
+        #Returns (predicate,parameters) selecting rows after self._seekAfter.  Composite keys are expanded to
+        #k1>=%s and (k1>%s or (k1=%s and k2>%s)) (rather than a row comparison) so the optimizer uses a range on the index.
+        op='<' if self._seekDesc else '>'
+        keys=self._seekKeys
+        after=self._seekAfter
+        pred="%s%s%%s" % (keys[-1],op)
+        params=[after[-1]]
+        for k,v in zip(reversed(keys[:-1]),reversed(after[:-1])):
+            pred="(%s%s%%s or (%s=%%s and %s))" % (k,op,k,pred)
+            params=[v,v]+params
+        if len(keys)>1 :
+            pred="(%s%s=%%s and %s)" % (keys[0],op,pred)
+            params=[after[0]]+params
+        return pred,params
+
+    #Time series aggregation.  These return a new BldSQL (this one isn't changed) that selects from this query as a derived table,
+    #so the aggregation of any built query runs on the server and only 1 row per time bucket comes back.  Run them with
+    #doquery(form='numpy',numpyDatetime64=True) for compact arrays.  See also DatabaseConn.downsample()
+    #   example; hourly means of a year of minute data (8760 rows instead of 525600):
+    #     sql.initQuery();sql.table("insitu_data");sql.col("datetime");sql.col("value");sql.where("site_num=%s",75)
+    #     a=db.doquery(sql.timeBucket("datetime",3600,"value",('mean','min','max','count')),form='numpy',numpyDatetime64=True)
+    #     a['bucket'],a['value_mean'],a['value_min']...
+    aggregates={'mean':'avg','min':'min','max':'max','count':'count','sum':'sum','std':'stddev_samp'}
+
+    def derived(self):
+        #Returns a new BldSQL selecting from this query as a derived table aliased q (refer to its result columns as q.<name>).
+        #Bind parameters and wherein() temp tables carry over.
+        if self._whereinChunk : raise ValueError("The wherein chunk strategy can't be used in a derived table")
+        if self._tempTableName : raise ValueError("A createTempTable() query can't be used as a derived table")
+        d=BldSQL()
+        d.table("(%s) as q" % self.cmd())
+        d._parameters=list(self.bind() or ())
+        d._whereinTables=[(t,c,v,f or self._fromClause()) for t,c,v,f in self._whereinTables] #typed from the inner query's tables
+        return d
+
+    def timeBucket(self,timeCol,seconds,values,aggs=('mean','min','max','count')):
+        #Returns a new BldSQL aggregating this query's rows into seconds wide buckets of datetime column timeCol, ordered by time.
+        #Buckets are aligned to the epoch (seconds=3600 buckets start on the hour) and empty buckets are left out.
+        #  -timeCol, values; result columns of this query (a name or list of names for values).
+        #  -aggs; any of 'mean','min','max','count','sum','std'.
+        #Result columns are bucket (the bucket start time) and <value>_<agg> for each value and agg.
+        if isinstance(values,str) : values=[values]
+        for agg in aggs :
+            if agg not in self.aggregates : raise ValueError("Unknown aggregate '%s', use one of %s" % (agg,list(self.aggregates)))
+        seconds=int(seconds)
+        if seconds<1 : raise ValueError("timeBucket seconds must be at least 1")
+        d=self.derived()
+        #timestampdiff from a fixed datetime (rather than unix_timestamp()) so buckets don't depend on the session time zone
+        d.col("timestamp'1970-01-01 00:00:00' + interval floor(timestampdiff(second,timestamp'1970-01-01 00:00:00',q.%s)/%d)*%d second as bucket"
+            % (resultName(timeCol),seconds,seconds))
+        for v in values :
+            v=resultName(v)
+            for agg in aggs : d.col("%s(q.%s) as %s_%s" % (self.aggregates[agg],v,v,agg))
+        d.where("q.%s is not null" % resultName(timeCol))
+        d.groupby("bucket")
+        d.orderby("bucket")
+        return d
+
+    def timeRange(self,timeCol):
+        #Returns a new BldSQL selecting the min and max of timeCol (as tmin,tmax) over this query's rows
+        d=self.derived()
+        d.col("min(q.%s) as tmin" % resultName(timeCol))
+        d.col("max(q.%s) as tmax" % resultName(timeCol))
+        return d
+
     def whereCount(self) : #returns the number of where clauses
         return len(self._wheres)
     
     def distinct(self) : #set distinct
         self._distinctKeyword="distinct"
+        self._cmd=None
         
     def orderby (self,column) : #set order by columns
-        if(column not in self._orderbys) : self._orderbys.append(column)
+        if(column not in self._orderbys) :
+            self._orderbys.append(column)
+            self._cmd=None
     
     def groupby (self,column) : #set group by columns
-        if(column not in self._groupbys) : self._groupbys.append(column)
+        if(column not in self._groupbys) :
+            self._groupbys.append(column)
+            self._cmd=None
         
     def limit (self,num) : #set result set row limit
         self._limitKeyword="limit %s" % str(num)
+        self._cmd=None
     
     def cmd (self): #generate sql string for passing to doquery below.  Add newlines for debugging (mysql doesn't care)
+        #The string is built once and reused until the query is changed (where(...,replace=True) only changes bind parameters).
+        if self._cmd is None : self._cmd=self._compile()
+        return self._cmd
 
+    def _compile (self):
         #select
         sql="\nselect %s %s " % (self._distinctKeyword,", ".join(self._cols))
         #from
@@ -109,13 +322,16 @@ class BldSQL(object):
         if(lj) : sql+="\n "+lj
         
         #where
-        where=" and ".join(self._wheres)
+        wheres=self._wheres
+        if self._seekAfter is not None : wheres=wheres+[self._seekWhere()[0]]
+        where=" and ".join(wheres)
         if(where) : sql+=" \nwhere %s " % (where)
         #group by
         group = ", ".join(self._groupbys)
         if(group) : sql+=" \ngroup by %s " % (group)
         #order by
         order = ", ".join(self._orderbys)
+        if self._seekKeys : order=", ".join(k+(" desc" if self._seekDesc else "") for k in self._seekKeys)
         if(order) : sql+=" \norder by %s " % (order)
         #limit
         sql+=self._limitKeyword
@@ -126,7 +342,9 @@ class BldSQL(object):
         return sql
     
     def bind (self): #return bind parameters for use in doquery
-        if (self._parameters) : return tuple(self._parameters)
+        parameters=self._parameters
+        if self._seekAfter is not None : parameters=parameters+self._seekWhere()[1]
+        if (parameters) : return tuple(parameters)
         else : return None
         
     #General utility functions
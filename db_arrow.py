@@ -0,0 +1,68 @@
+# db_arrow.py
+"""
+Arrow IPC and Parquet file output for db_conn.
+
+.. package:: db_utils.db_arrow
+
+Rows are read from a (streaming) cursor a chunk at a time and written out as record batches, so output size isn't
+limited by memory.  The arrow schema is built up front from the cursor.description type codes so all batches match.
+
+This is imported by db_conn only when arrow/parquet output is requested as pyarrow is an optional dependency.
+"""
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+try : from MySQLdb.constants import FIELD_TYPE,FLAG
+except ImportError : from pymysql.constants import FIELD_TYPE,FLAG #same codes, for the async (aiomysql) driver
+
+_intTypes=(FIELD_TYPE.TINY,FIELD_TYPE.SHORT,FIELD_TYPE.LONG,FIELD_TYPE.LONGLONG,FIELD_TYPE.INT24,FIELD_TYPE.YEAR)
+_floatTypes=(FIELD_TYPE.FLOAT,FIELD_TYPE.DOUBLE,FIELD_TYPE.DECIMAL,FIELD_TYPE.NEWDECIMAL)
+_binaryTypes=(FIELD_TYPE.TINY_BLOB,FIELD_TYPE.MEDIUM_BLOB,FIELD_TYPE.LONG_BLOB,FIELD_TYPE.BLOB,FIELD_TYPE.STRING,FIELD_TYPE.VAR_STRING,FIELD_TYPE.VARCHAR)
+
+def arrowSchema(description,flags=None):
+    #Returns a pyarrow schema for passed cursor.description (flags is cursor.description_flags).  All fields are nullable.
+    fields=[]
+    for i,d in enumerate(description):
+        t=d[1]
+        binary=flags is not None and (flags[i] & FLAG.BINARY) and t in _binaryTypes
+        unsigned=flags is not None and (flags[i] & FLAG.UNSIGNED)
+        if t in _intTypes : typ=pa.uint64() if (unsigned and t==FIELD_TYPE.LONGLONG) else pa.int64()
+        elif t in _floatTypes : typ=pa.float64()
+        elif t in (FIELD_TYPE.DATETIME,FIELD_TYPE.TIMESTAMP) : typ=pa.timestamp('us')
+        elif t==FIELD_TYPE.DATE : typ=pa.date32()
+        elif t==FIELD_TYPE.TIME : typ=pa.duration('us')
+        elif binary : typ=pa.binary()
+        else : typ=pa.string()
+        fields.append(pa.field(d[0],typ))
+    return pa.schema(fields)
+
+def _column(col,field):
+    #Returns a pyarrow array for a column chunk, converting values the driver returned as other python types (Decimal, set...) as needed
+    try : return pa.array(col,type=field.type)
+    except (pa.ArrowInvalid,pa.ArrowTypeError):
+        if pa.types.is_floating(field.type) : return pa.array([None if v is None else float(v) for v in col],type=field.type)
+        if pa.types.is_string(field.type) : return pa.array([None if v is None else str(v) for v in col],type=field.type)
+        raise
+
+def cursorToArrow(cursor,outfile,form='arrow',chunk=100000,timerName=None):
+    #Writes the remaining rows of cursor to outfile.
+    #  form='arrow'; Arrow IPC file format.  Readers can memory map it: pa.ipc.open_file(pa.memory_map(outfile)).read_all()
+    #  form='parquet'; Parquet file, 1 row group per chunk.
+    #Returns the number of rows written.
+    schema=arrowSchema(cursor.description,getattr(cursor,'description_flags',None))
+    if form=='parquet' : writer=pq.ParquetWriter(outfile,schema)
+    else : writer=pa.ipc.new_file(outfile,schema)
+    try:
+        n=0
+        rows=cursor.fetchmany(chunk)
+        while rows :
+            if timerName : print("Timer:%s writing rows %s to %s"%(timerName,n,n+len(rows)-1))
+            batch=pa.record_batch([_column(col,field) for col,field in zip(zip(*rows),schema)],schema=schema)
+            if form=='parquet' : writer.write_table(pa.Table.from_batches([batch]))
+            else : writer.write_batch(batch)
+            n+=len(rows)
+            rows=cursor.fetchmany(chunk)
+    finally:
+        writer.close()
+    return n
@@ -0,0 +1,226 @@
+# db_async.py
+"""
+asyncio database connection.
+
+.. package:: db_utils.db_async
+
+AsyncDatabaseConn mirrors DatabaseConn.doquery() (form, numRows, insert, multiInsert, commit, BldSQL queries...) on the
+aiomysql driver with an async connection pool, so services can run many queries concurrently instead of serially.
+Packaging results (dict/numpy/text) and writing output files is done on a thread pool so it doesn't block the event loop.
+
+Requires aiomysql (pip install aiomysql).
+
+Example:
+    import asyncio
+    import db_utils.db_async as db_async
+    import db_utils.bldsql as bldsql
+
+    async def main():
+        async with db_async.AsyncDatabaseConn(user='guest',host='localhost',db='ccgg') as db:
+            sqls=[]
+            for site in ('MLO','BRW','SPO'):
+                sql=bldsql.BldSQL()
+                sql.table("flask_data_view")
+                sql.col("ev_datetime");sql.col("value")
+                sql.where("site=%s",site)
+                sqls.append(sql)
+            results=await asyncio.gather(*[db.doquery(sql,form='numpy') for sql in sqls])
+
+    asyncio.run(main())
+
+Note; unlike DatabaseConn, each doquery() call runs on its own pooled connection, so session state (temp tables, user
+variables, 'start transaction') does not carry over between calls.  Use transaction() to run several statements on one connection.
+"""
+
+import time
+import asyncio
+import contextlib
+import concurrent.futures
+import aiomysql
+import pymysql.err
+import pymysql.converters
+from pymysql.constants import FIELD_TYPE
+
+import db_utils.bldsql as bldsql
+import db_utils.db_conn as db_conn
+
+
+class AsyncDatabaseConn(object):
+    """asyncio db abstraction utility class with a connection pool"""
+
+    #  -minSize/maxSize; connection pool limits.  At most maxSize queries run at once, others wait for a connection.
+    #  -executor; concurrent.futures executor for result packaging/file output (default; a thread pool shared by this object)
+
+    def __init__(self,user='guest',password='',db='ccgg',host='db-int2',convertDecToFloat=True,minSize=1,maxSize=10,executor=None,port=3306):
+        self._connArgs=dict(host=host,user=user,password=password,db=db,port=port)
+        if(convertDecToFloat): #Same ~3x speed up as DatabaseConn, but on a copy of the converters so other connections aren't affected.
+            conv=pymysql.converters.conversions.copy()
+            conv[FIELD_TYPE.DECIMAL]=float
+            conv[FIELD_TYPE.NEWDECIMAL]=float
+            self._connArgs['conv']=conv
+        self._minSize=minSize
+        self._maxSize=maxSize
+        self._pool=None
+        self._executor=executor
+        self._ownExecutor=executor is None
+        self.sql=bldsql.BldSQL()
+
+    async def connect(self):
+        #Create the connection pool.  Called automatically on first query or by async with.
+        if self._pool is None :
+            self._pool=await aiomysql.create_pool(minsize=self._minSize,maxsize=self._maxSize,**self._connArgs)
+            if self._executor is None : self._executor=concurrent.futures.ThreadPoolExecutor(max_workers=self._maxSize)
+        return self
+
+    async def close(self):
+        if self._pool is not None :
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool=None
+        if self._ownExecutor and self._executor is not None :
+            self._executor.shutdown(wait=False)
+            self._executor=None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self,exc_type,exc_value,tb):
+        await self.close()
+        return False
+
+    async def _offload(self,func,*args):
+        #Run func(*args) on the executor so per row work doesn't block the event loop
+        return await asyncio.get_running_loop().run_in_executor(self._executor,func,*args)
+
+    async def doquery(self,query=None,parameters=None,numRows=-1,form='dict',numpyFloat64=True,outfile=None,timerName=None,commit=True,multiInsert=False,insert=False,numpyDatetime64=False,textWidths='exact',textOverflow='grow'):
+        #Async version of DatabaseConn.doquery(), see it for argument documentation.  query can be sql text or a BldSQL object.
+        #Supported forms are 'dict','list','record','resultset','numpy','text' and the text file formats ('csv','tsv','dat','txt','excel','csv-nq').
+        #File output is streamed with an unbuffered cursor and written on the executor a chunk at a time ('dat'/'txt' through db_text
+        #with textWidths/textOverflow, as DatabaseConn does).  Server errors are raised as db_conn.QueryError (DeadlockError, LockWaitTimeout).
+        #Screen forms ('std','scr'), iterators and binary file formats aren't supported; use DatabaseConn for those.
+        await self.connect()
+        start=time.time()
+        end=0
+        ret=None
+        if query==None : query=self.sql
+        if isinstance(query,bldsql.BldSQL) :
+            #The long wherein() list strategies need the temp tables (or chunked runs) DatabaseConn.doquery() does
+            if query.whereinTables() or query.whereinChunks() : raise ValueError("wherein temptable/chunk strategies aren't supported by AsyncDatabaseConn, use strategy='inline'")
+            if parameters==None : parameters=query.bind()
+            query=query.cmd()
+
+        outToFile=form in ('csv','tsv','dat','txt','excel','csv-nq')
+        if form not in ('dict','list','record','resultset','numpy','text') and not outToFile : raise ValueError("form '%s' is not supported by AsyncDatabaseConn" % form)
+
+        async with self._pool.acquire() as conn:
+            try:
+                await conn.autocommit(commit)
+                cursorClass=aiomysql.SSCursor if (outToFile and not (insert or multiInsert)) else aiomysql.Cursor
+                async with conn.cursor(cursorClass) as c:
+                    if multiInsert :
+                        await c.executemany(query,parameters)
+                        return
+                    await c.execute(query,parameters)
+                    if insert : return c.lastrowid
+                    end=time.time() #Skips post processing
+
+                    if c.description is None : #dml statement, return number of rows affected (if any)
+                        if c.rowcount>0 : ret=c.rowcount
+                    elif numRows==0 :
+                        a=await c.fetchone()
+                        if a : ret=a[0]
+                    elif outToFile : ret=await self._outputToFile(c,outfile,form,timerName,textWidths,textOverflow)
+                    else :
+                        a=await c.fetchall()
+                        if a :
+                            if form=='numpy' :
+                                import db_utils.db_numpy as db_numpy
+                                ret=await self._offload(db_numpy.rowsToNumpy,a,c.description,None,numpyFloat64,numpyDatetime64)
+                            else :
+                                header=[li[0] for li in c.description]
+                                ret=await self._offload(db_conn.DatabaseConn.packageRows,list(a),header,form)
+            except Exception as e:
+                print("\n\nSQL that cause error:\n%s" % (query,))
+                print("\nBind parameters: " )
+                print(parameters)
+                print("\n\n")
+                raise db_conn.queryError(e) from e
+
+        if(timerName) : print ("%s (s):%s" % (timerName,str(end-start)))
+        return ret
+
+    async def _outputToFile(self,c,outfile,form,timerName,textWidths='exact',textOverflow='grow',chunk=100000):
+        #Write the streaming result on cursor c to outfile, formatting/writing each chunk on the executor.
+        if outfile==None : raise ValueError("outfile is required for file output")
+        header=[li[0] for li in c.description]
+        f=await self._offload(open,outfile,'wt')
+        try:
+            if form in ('dat','txt') : await self._textToFile(c,f,header,textWidths,textOverflow,chunk)
+            else :
+                writer=db_conn.DatabaseConn._csvWriter(f,form)
+                await self._offload(writer.writerow,header)
+                n=0
+                rows=await c.fetchmany(chunk)
+                while rows :
+                    if timerName : print("Timer:%s writing rows %s to %s"%(timerName,n,n+len(rows)-1))
+                    await self._offload(writer.writerows,rows)
+                    n+=len(rows)
+                    rows=await c.fetchmany(chunk)
+        finally:
+            await self._offload(f.close)
+        return True
+
+    async def _textToFile(self,c,f,header,textWidths,textOverflow,chunk):
+        #Fixed width text output (see db_text.py).  The lines are formatted and written by 1 executor thread reading fetched
+        #chunks from a bounded queue, so rows stream through (spooled for textWidths='exact') instead of being fetched all at once.
+        import queue
+        import threading
+        import db_utils.db_text as db_text
+        q=queue.Queue(maxsize=4)
+        done=threading.Event()
+        def write():
+            try : db_text.writeLines(db_text.chunkLines(header,iter(q.get,None),textWidths,textOverflow,c.description,emptyHeader=True),f)
+            finally : done.set()
+        def put(rows):
+            while not done.is_set(): #the writer stopped (error), drop the rest
+                try : return q.put(rows,timeout=.1)
+                except queue.Full : pass
+        writer=asyncio.ensure_future(self._offload(write))
+        try:
+            rows=await c.fetchmany(chunk)
+            while rows and not done.is_set():
+                await asyncio.to_thread(put,rows)
+                rows=await c.fetchmany(chunk)
+        finally:
+            await asyncio.to_thread(put,None)
+            await writer
+
+    async def doMultiInsert(self,sql,params,maxLen=10000,all=False):
+        #Async version of DatabaseConn.doMultiInsert()
+        if len(params)>maxLen or all:#send thru
+            await self.doquery(sql,params,commit=True,multiInsert=True)
+            return True
+        return False
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        #Run several statements on one connection in a transaction.  Commits on exit, rolls back on exception.
+        #   async with db.transaction() as c:
+        #       await c.execute("call tagwr_addFlaskDataTag(%s,%s,%s,%s)",[12357175, 10, '','John'])
+        #c is an aiomysql cursor.  Server errors are raised (after the rollback) as db_conn.QueryError/DeadlockError/LockWaitTimeout.
+        await self.connect()
+        async with self._pool.acquire() as conn:
+            await conn.autocommit(False)
+            await conn.begin()
+            try:
+                async with conn.cursor() as c:
+                    yield c
+                await conn.commit()
+            except pymysql.err.MySQLError as e:
+                await conn.rollback()
+                raise db_conn.queryError(e) from e
+            except BaseException:
+                await conn.rollback()
+                raise
+            finally:
+                await conn.autocommit(True)
@@ -0,0 +1,99 @@
+# db_batch.py
+"""
+Batched query execution for db_conn.
+
+.. package:: db_utils.db_batch
+
+Normally used through DatabaseConn.doqueries().  Several independent queries are sent to the server as 1 multi statement
+packet (mysqlclient connects with CLIENT.MULTI_STATEMENTS and MULTI_RESULTS) and the result sets read back in order
+with nextset(), so n small queries cost 1 round trip instead of n.
+
+    a,b,c=db.doqueries([
+        ("select * from gmd.site where num=%s",[75],'dict'),
+        (sql,None,'numpy'),                      #BldSQL objects work as in doquery()
+        "select count(*) from flask_event",      #just a query; default form
+    ])
+
+Parameters are interpolated on the client (as MySQLdb's execute does), so prepared statements aren't used.  Stored procedure
+calls (call ...) return an extra status result so can't be batched; run them with doquery().
+"""
+
+import time
+
+import db_utils.db_conn as db_conn
+
+forms=('dict','list','record','resultset','text','numpy','scalar')
+
+
+def interpolate(conn,query,parameters=None):
+    #Returns query (str) with parameters (sequence or dict) escaped and substituted in by MySQLdb connection conn, as bytes
+    if parameters is None : return query.encode('utf-8')
+    if isinstance(parameters,dict) : args={(k.encode('utf-8') if isinstance(k,str) else k):conn.literal(v) for k,v in parameters.items()} #%(name)s in a bytes query looks up bytes keys
+    else : args=tuple(conn.literal(v) for v in parameters)
+    return query.encode('utf-8') % args
+
+def _entry(e,form):
+    #Returns (query,parameters,form,sqlObj) for a doqueries() entry
+    if isinstance(e,str) or db_conn._isBldSQL(e) : e=(e,)
+    e=tuple(e)+(None,)*(3-len(e))
+    query,parameters,f=e[:3]
+    f=f or form
+    if f not in forms : raise ValueError("form '%s' is not supported by doqueries, use one of %s" % (f,forms))
+    sqlObj=None
+    if db_conn._isBldSQL(query) :
+        sqlObj=query
+        if sqlObj.whereinChunks() : raise ValueError("The wherein chunk strategy isn't supported by doqueries")
+        query=sqlObj.cmd()
+        if parameters is None : parameters=sqlObj.bind()
+    if query.lstrip()[:5].lower()=='call ' : raise ValueError("Stored procedure calls can't be batched with doqueries: %s" % query)
+    return query,parameters,f,sqlObj
+
+def _package(db,c,form,numpyFloat64,numpyDatetime64):
+    #Returns the current result set of cursor c packaged per form (rows affected for statements without results)
+    if c.description is None : return c.rowcount
+    rows=c.fetchall()
+    if not rows : return None
+    if form=='scalar' : return rows[0][0]
+    if form=='numpy' :
+        import db_utils.db_numpy as db_numpy
+        return db_numpy.rowsToNumpy(rows,c.description,getattr(c,'description_flags',None),numpyFloat64,numpyDatetime64)
+    return db.packageRows(list(rows),[d[0] for d in c.description],form)
+
+def doqueries(db,entries,form='dict',numpyFloat64=True,numpyDatetime64=False,commit=True):
+    #See DatabaseConn.doqueries()
+    entries=[_entry(e,form) for e in entries]
+    if not entries : return []
+    conn=db._conn
+    stmts=[interpolate(conn,q,p) for q,p,f,s in entries]
+    inTables=[t for q,p,f,s in entries if s is not None for t in s.whereinTables()]
+    if inTables : db._loadWhereinTables(inTables)
+    ret=[]
+    c=conn.cursor()
+    c._defer_warnings=True
+    try:
+        try:
+            conn.autocommit(commit)
+            c.execute(b";\n".join(stmts))
+            while True:
+                ret.append(_package(db,c,entries[len(ret)][2],numpyFloat64,numpyDatetime64))
+                if not c.nextset() : break
+                if len(ret)==len(entries) : #more results than queries
+                    ret.append(None)
+                    break
+        except Exception as e:
+            #the server stops at the first failing statement
+            print("\n\nSQL that cause error:\n%s" % (stmts[len(ret)].decode('utf-8','replace') if len(ret)<len(stmts) else b";\n".join(stmts).decode('utf-8','replace'),))
+            print("\n\n")
+            raise db_conn.queryError(e) from e
+    finally:
+        c.close()
+        if inTables : db._dropWhereinTables(inTables)
+    if len(ret)!=len(entries) : raise ValueError("doqueries got %s results for %s queries (an entry with more than 1 statement?)" % (len(ret),len(entries)))
+    if db._router is not None :
+        import db_utils.db_router as db_router
+        if not all(db_router.isReadOnly(q) for q,p,f,s in entries) : db._lastWrite=time.time()
+    if db._cache is not None :
+        import db_utils.db_cache as db_cache
+        tags=[t for q,p,f,s in entries if db_cache.isWrite(q) for t in db_cache.writeTags(q)]
+        if tags : db._cache.invalidate(tags)
+    return ret
@@ -0,0 +1,162 @@
+# db_bulk.py
+"""
+Bulk loading for db_conn.
+
+.. package:: db_utils.db_bulk
+
+Loads rows from any iterable (list, generator, file reader...) into a table without holding them all in memory.
+Normally called through DatabaseConn.bulkLoad().
+
+Two methods:
+    'infile'; streams rows as tab separated text through LOAD DATA LOCAL INFILE.  This is by far the fastest, but requires
+        the connection be made with localInfile=True and the server to allow local_infile.  Rows are written to a named
+        pipe (fifo) read by the client library as the load runs (pipe=True), or to a temp file first (pipe=False).
+    'values'; multi row "insert into t (cols) values (..),(..),..." statements, each filled up to a byte budget sized to the
+        server's max_allowed_packet (instead of a fixed row count like doMultiInsert).
+
+"""
+
+import os
+import time
+import tempfile
+import threading
+import datetime
+import MySQLdb
+
+
+def _tsvValue(v):
+    #Returns v as LOAD DATA text (default escaping: \N for NULL, backslash escapes for tab, newline...)
+    if v is None : return '\\N'
+    if isinstance(v,str) : return v.replace('\\','\\\\').replace('\t','\\t').replace('\n','\\n').replace('\r','\\r').replace('\0','\\0')
+    if isinstance(v,bool) : return '1' if v else '0'
+    if isinstance(v,float) : return repr(v)
+    if isinstance(v,(bytes,bytearray)) : return _tsvValue(bytes(v).decode('utf-8','surrogateescape'))
+    if isinstance(v,datetime.datetime) : return v.isoformat(' ')
+    if isinstance(v,datetime.timedelta) : return _timeValue(v)
+    return str(v)
+
+def _timeValue(td):
+    #Returns timedelta td as TIME text [-]H:MM:SS[.ffffff] (str() gives '1 day, 2:00:00', which load data misreads)
+    us=td//datetime.timedelta(microseconds=1)
+    sign='-' if us<0 else ''
+    s,us=divmod(abs(us),1000000)
+    m,s=divmod(s,60)
+    h,m=divmod(m,60)
+    return "%s%d:%02d:%02d%s" % (sign,h,m,s,".%06d" % us if us else "")
+
+def _writeTSV(f,rows,counter,chunk=10000):
+    #Write rows to binary file handle f as tab separated text.  counter[0] is updated with the row count.
+    buf=[]
+    for row in rows:
+        buf.append('\t'.join([_tsvValue(v) for v in row]))
+        if len(buf)>=chunk :
+            f.write(('\n'.join(buf)+'\n').encode('utf-8','surrogateescape'))
+            counter[0]+=len(buf)
+            buf=[]
+    if buf :
+        f.write(('\n'.join(buf)+'\n').encode('utf-8','surrogateescape'))
+        counter[0]+=len(buf)
+
+def _loadDataSQL(table,columns,duplicates):
+    dup={'replace':'replace ','ignore':'ignore '}.get(duplicates,'')
+    cols=" (%s)" % ",".join(columns) if columns else ""
+    return ("load data local infile %%s %sinto table %s character set utf8mb4 fields terminated by '\\t' escaped by '\\\\' lines terminated by '\\n'%s"
+        % (dup,table,cols))
+
+def loadInfile(conn,table,columns,rows,duplicates=None,pipe=True):
+    #Load rows via LOAD DATA LOCAL INFILE on MySQLdb connection conn.  Returns (rows,statements)
+    sql=_loadDataSQL(table,columns,duplicates)
+    counter=[0]
+    tmpdir=tempfile.mkdtemp(prefix='db_bulk_')
+    path=os.path.join(tmpdir,'rows.tsv')
+    c=conn.cursor()
+    try:
+        if not pipe :
+            with open(path,'wb') as f : _writeTSV(f,rows,counter)
+            c.execute(sql,(path,))
+        else :
+            #The client lib opens and reads the fifo while the load statement runs, we write to it from a thread.
+            os.mkfifo(path)
+            err=[]
+            def writer():
+                try:
+                    with open(path,'wb') as f : _writeTSV(f,rows,counter)
+                except Exception as e : err.append(e)
+            t=threading.Thread(target=writer,daemon=True)
+            t.start()
+            try:
+                c.execute(sql,(path,))
+            finally:
+                #If the statement failed before the client opened the fifo, the writer is blocked on open(); open the read end
+                #ourselves so it unblocks (it then fails with a broken pipe, which we ignore as the execute error is raised).
+                if t.is_alive() :
+                    try:
+                        fd=os.open(path,os.O_RDONLY|os.O_NONBLOCK)
+                        t.join(1)
+                        os.close(fd)
+                    except OSError : pass
+                t.join()
+            if err : raise err[0]
+    finally:
+        c.close()
+        if os.path.exists(path) : os.remove(path)
+        os.rmdir(tmpdir)
+    return counter[0],1
+
+def maxPacket(conn):
+    #Returns the server's max_allowed_packet
+    c=conn.cursor()
+    try:
+        c.execute("select @@max_allowed_packet")
+        return int(c.fetchone()[0])
+    finally:
+        c.close()
+
+def loadValues(conn,table,columns,rows,duplicates=None,packetBytes=None):
+    #Load rows via multi row insert statements, each up to packetBytes (default 90% of max_allowed_packet, max 16mb).  Returns (rows,statements)
+    if duplicates=='update' and not columns : raise ValueError("duplicates='update' needs the column names to update")
+    if not packetBytes : packetBytes=min(int(maxPacket(conn)*.9),16*1024*1024)
+    verb={'replace':'replace','ignore':'insert ignore'}.get(duplicates,'insert')
+    cols=" (%s)" % ",".join(columns) if columns else ""
+    head=("%s into %s%s values " % (verb,table,cols)).encode('utf-8')
+    if duplicates=='update' and columns :
+        tail=(" on duplicate key update "+",".join("%s=values(%s)" % (col,col) for col in columns)).encode('utf-8')
+    else : tail=b''
+
+    n=0;statements=0
+    c=conn.cursor()
+    try:
+        buf=[];size=len(head)+len(tail)
+        for row in rows:
+            v=conn.literal(tuple(row)) #b"(val,val,...)", escaped for this connection
+            if buf and size+len(v)+1>packetBytes :
+                c.execute(head+b','.join(buf)+tail)
+                statements+=1
+                buf=[];size=len(head)+len(tail)
+            buf.append(v)
+            size+=len(v)+1
+            n+=1
+        if buf :
+            c.execute(head+b','.join(buf)+tail)
+            statements+=1
+    finally:
+        c.close()
+    return n,statements
+
+def bulkLoad(conn,table,columns,rows,method='auto',duplicates=None,pipe=True,packetBytes=None,localInfile=False):
+    #See DatabaseConn.bulkLoad()
+    start=time.time()
+    used=method
+    if method=='auto' : used='infile' if (localInfile and duplicates!='update') else 'values'
+    if used=='infile' and duplicates=='update' : raise ValueError("duplicates='update' isn't supported by load data, use method='values'")
+    if used=='infile' :
+        try:
+            n,statements=loadInfile(conn,table,columns,rows,duplicates,pipe)
+        except MySQLdb.OperationalError :
+            #local infile disabled on the server (1148/3948).  Fall back to inserts if we can replay the rows (a generator has been consumed).
+            if method!='auto' or not isinstance(rows,(list,tuple)) : raise
+            used='values'
+            n,statements=loadValues(conn,table,columns,rows,duplicates,packetBytes)
+    else : n,statements=loadValues(conn,table,columns,rows,duplicates,packetBytes)
+    secs=time.time()-start
+    return dict(rows=n,seconds=secs,rowsPerSec=n/secs if secs else 0,method=used,statements=statements)
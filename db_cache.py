@@ -0,0 +1,298 @@
+# db_cache.py
+"""
+Query result cache for db_conn.
+
+.. package:: db_utils.db_cache
+
+Opt-in cache of doquery() select results keyed on the normalized sql, bind parameters and output form.  Intended for
+repeated read only selects against slow changing reference tables (gmd.site...).
+
+Example:
+    import db_utils.db_conn as db_conn
+    db=db_conn.RO(cache=True) #use the shared default cache (db_cache.defaultCache())
+    sites=db.doquery("select * from gmd.site",cacheTTL=600) #cached for 10 minutes
+
+Entries are tagged with the tables they select from (every table of comma and join lists, subqueries included, plus any
+cacheTags passed to doquery) and evicted least recently used first once the cache is over its memory budget.  Writes
+issued through a connection with a cache (insert, multiInsert, update/delete/replace, multi table update/delete, ddl...)
+invalidate entries tagged with the written tables (plus passed cacheTags).  Writes whose tables can't be parsed (stored
+procedure calls...) clear the whole cache.
+
+If diskDir is set, entries are also written there (numpy results as .npz, others pickled) so they survive between
+processes.  Note that invalidation only reaches the disk store and the memory of the process doing the write; other
+processes' in memory copies expire on their TTL.
+
+Cached results are shared between callers, so don't modify them in place.
+"""
+
+import os
+import re
+import time
+import json
+import pickle
+import hashlib
+import threading
+import collections
+
+import db_utils.db_stats as db_stats
+
+
+_quoted=re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""")
+_space=re.compile(r"\s+")
+_strings=re.compile(r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*\"""")
+_name=r"(?:`[^`]+`|[\w$]+)"
+_tableRef=re.compile(r"\s*(%s(?:\.%s)?)(?:\s+(?:as\s+)?(%s))?" % (_name,_name,_name),re.I) #table [as] [alias]
+_comma=re.compile(r"\s*,")
+_refStart=re.compile(r"\b(?:from|join|using)\s+",re.I)
+_notAlias=set("""where join left right inner outer cross natural straight_join on using group order limit having union set for lock into
+    window partition force use ignore values select procedure except intersect returning""".split())
+_insert=re.compile(r"^(?:insert|replace)\s+(?:(?:low_priority|delayed|high_priority|ignore)\s+)*(?:into\s+)?(%s(?:\.%s)?)" % (_name,_name),re.I)
+_update=re.compile(r"^update\s+(?:(?:low_priority|ignore)\s+)*(.*?)\s+set\b",re.I|re.S)
+_ddl=re.compile(r"^(?:truncate(?:\s+table)?|alter\s+(?:online\s+|ignore\s+)*table|(?:create|drop)\s+(?:temporary\s+)?table(?:\s+if\s+(?:not\s+)?exists)?|"
+    r"load\s+data\b.*?\binto\s+table|rename\s+table)\s+",re.I|re.S)
+_writeStart=re.compile(r"^(?:insert|replace|update|delete|truncate|alter|create|drop|load|rename|call|handler|import)\b",re.I)
+_cteWrite=re.compile(r"^with\b.*\b(?:update|delete|insert|replace)\b",re.I|re.S)
+
+#Tag invalidating every entry; used for writes whose tables can't be parsed (stored procedure calls, ddl on other objects...)
+allTables='*'
+
+def normalizeSQL(query):
+    #Returns query with runs of whitespace (outside of quoted strings/identifiers) collapsed to a single space
+    parts=_quoted.split(query)
+    for i in range(0,len(parts),2) : parts[i]=_space.sub(' ',parts[i])
+    return ''.join(parts).strip()
+
+def _statements(query):
+    #Returns the normalized statements in query, with string literals blanked so their contents aren't parsed
+    return [q.strip() for q in _strings.sub("''",normalizeSQL(query)).split(';') if q.strip()]
+
+def _tableTags(names):
+    #Returns a list of tags for passed table names; 'gmd.site' is tagged as both 'gmd.site' and 'site'
+    tags=[]
+    for name in names:
+        name=name.replace('`','').lower()
+        if name not in tags : tags.append(name)
+        if '.' in name and name.split('.')[-1] not in tags : tags.append(name.split('.')[-1])
+    return tags
+
+def _refList(q,pos):
+    #Returns the table names of the comma separated table reference list (tables with optional aliases) at q[pos:]
+    names=[]
+    while True:
+        m=_tableRef.match(q,pos)
+        if not m : break
+        names.append(m.group(1))
+        pos=m.end(1)
+        if m.group(2) and m.group(2).lower() not in _notAlias : pos=m.end()
+        m=_comma.match(q,pos)
+        if not m : break
+        pos=m.end()
+    return names
+
+def _tables(q):
+    #Returns the table names after every from, join and using in statement q (subqueries included)
+    return [name for m in _refStart.finditer(q) for name in _refList(q,m.end())]
+
+def _writeTables(q):
+    #Returns the tables statement q writes to, None if it isn't a write, [allTables] if it is but they can't be parsed.
+    #Multi table updates and deletes return every table they reference.
+    if not _writeStart.match(q) : return [allTables] if _cteWrite.match(q) else None
+    m=_insert.match(q)
+    if m : return [m.group(1)]
+    m=_update.match(q)
+    if m : return _refList(m.group(1),0)+_tables(m.group(1)) or [allTables]
+    if q[:6].lower()=='delete' : return _tables(q) or [allTables]
+    m=_ddl.match(q)
+    if m : return _refList(q,m.end()) or [allTables]
+    return [allTables]
+
+def readTags(query):
+    #Returns tags for the tables a select reads from
+    return _tableTags(name for q in _statements(query) for name in _tables(q))
+
+def writeTags(query):
+    #Returns tags for the tables a dml/ddl statement writes to (empty list if not a write).  Writes whose tables can't be parsed
+    #(stored procedure calls...) return [allTables] so that invalidate() drops everything rather than leaving stale entries.
+    tags=[]
+    for q in _statements(query):
+        for t in _tableTags(_writeTables(q) or []):
+            if t not in tags : tags.append(t)
+    return [allTables] if allTables in tags else tags
+
+def isWrite(query):
+    #True if query is a recognized write statement (dml/ddl on a table, or a stored procedure call)
+    return bool(writeTags(query))
+
+class QueryCache(object):
+    """Thread safe TTL + LRU cache of query results with table tag invalidation and optional disk backing store"""
+
+    #  -maxBytes is the (approximate) memory budget.  Least recently used entries are evicted to stay under it.
+    #  -defaultTTL (seconds) used by put() when no ttl is passed.
+    #  -diskDir; optional directory for the on disk store (created if needed).
+
+    cacheableForms=('dict','list','record','resultset','numpy','text')
+
+    def __init__(self,maxBytes=256*1024*1024,defaultTTL=300,diskDir=None):
+        self.maxBytes=maxBytes
+        self.defaultTTL=defaultTTL
+        self.diskDir=diskDir
+        if diskDir and not os.path.isdir(diskDir) : os.makedirs(diskDir)
+
+        self._lock=threading.RLock()
+        self._entries=collections.OrderedDict() #key -> (value,expires,tags,size), in lru order (most recent last)
+        self._tags=collections.defaultdict(set) #tag -> keys
+        self._bytes=0
+        self._counters=dict(hits=0,misses=0,diskHits=0,puts=0,evictions=0,expirations=0,invalidations=0)
+
+    def key(self,query,parameters,*args):
+        #Returns the cache key for a query, its bind parameters and any other args that change the result (form, numRows, namespace...)
+        s=repr((normalizeSQL(query),tuple(parameters) if isinstance(parameters,list) else parameters,args))
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    def get(self,key):
+        #Returns (hit,value).  Checks memory, then the disk store.
+        now=time.time()
+        with self._lock:
+            e=self._entries.get(key)
+            if e is not None :
+                if e[1]>now :
+                    self._entries.move_to_end(key)
+                    self._counters['hits']+=1
+                    return True,e[0]
+                self._remove(key)
+                self._counters['expirations']+=1
+        if self.diskDir :
+            e=self._diskGet(key,now)
+            if e is not None :
+                value,expires,tags=e
+                with self._lock:
+                    self._counters['diskHits']+=1
+                    self._add(key,value,expires,tags)
+                return True,value
+        with self._lock : self._counters['misses']+=1
+        return False,None
+
+    def put(self,key,value,ttl=None,tags=()):
+        #Add a result to the cache for ttl seconds (defaultTTL if None), tagged with tags (list of table names...)
+        expires=time.time()+(ttl if ttl is not None else self.defaultTTL)
+        tags=[t.lower() for t in tags]
+        with self._lock:
+            self._counters['puts']+=1
+            self._add(key,value,expires,tags)
+        if self.diskDir : self._diskPut(key,value,expires,tags)
+
+    def invalidate(self,tags):
+        #Remove all entries tagged with any of passed tags (in memory and on disk), or every entry if tags includes allTables
+        tags=[t.lower() for t in tags]
+        if allTables in tags :
+            with self._lock : self._counters['invalidations']+=len(self._entries)
+            self.clear()
+            return
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag,())):
+                    self._remove(key)
+                    self._counters['invalidations']+=1
+        if self.diskDir : self._diskInvalidate(tags)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes=0
+        if self.diskDir :
+            for fn in os.listdir(self.diskDir):
+                if fn.endswith('.meta') : self._diskRemove(fn[:-5])
+
+    def stats(self):
+        #Returns a dict of counters plus current entries and bytes
+        with self._lock:
+            s=dict(self._counters)
+            s['entries']=len(self._entries)
+            s['bytes']=self._bytes
+        return s
+
+    def _add(self,key,value,expires,tags):
+        #Caller holds the lock
+        if key in self._entries : self._remove(key)
+        size=db_stats.sizeOf(value)
+        if size>self.maxBytes : return #Too big to cache
+        self._entries[key]=(value,expires,tags,size)
+        for tag in tags : self._tags[tag].add(key)
+        self._bytes+=size
+        while self._bytes>self.maxBytes :
+            self._remove(next(iter(self._entries)))
+            self._counters['evictions']+=1
+
+    def _remove(self,key):
+        #Caller holds the lock
+        value,expires,tags,size=self._entries.pop(key)
+        self._bytes-=size
+        for tag in tags:
+            keys=self._tags.get(tag)
+            if keys is not None :
+                keys.discard(key)
+                if not keys : del self._tags[tag]
+
+    #Disk store.  Each entry is a <key>.meta json file (expires, tags, format) and a <key>.npz or <key>.pkl data file.
+    def _diskPath(self,key,ext):
+        return os.path.join(self.diskDir,key+ext)
+
+    def _diskPut(self,key,value,expires,tags):
+        fmt='pkl'
+        try:
+            if isinstance(value,dict) and value and all(hasattr(v,'dtype') and v.dtype!=object for v in value.values()) :
+                import numpy as np
+                fmt='npz'
+                tmp=self._diskPath(key,'.tmp.npz')
+                np.savez(tmp,**value)
+            else :
+                tmp=self._diskPath(key,'.tmp')
+                with open(tmp,'wb') as f : pickle.dump(value,f,protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp,self._diskPath(key,'.'+fmt))
+            with open(self._diskPath(key,'.meta.tmp'),'w') as f : json.dump(dict(expires=expires,tags=tags,format=fmt),f)
+            os.replace(self._diskPath(key,'.meta.tmp'),self._diskPath(key,'.meta'))
+        except Exception as e: #best effort; unpicklable results (TypeError, AttributeError...) mustn't fail the query
+            print("db_cache: unable to write %s to disk store: %s" % (key,e))
+            for ext in ('.tmp','.tmp.npz','.meta.tmp'):
+                try : os.remove(self._diskPath(key,ext))
+                except OSError : pass
+            self._diskRemove(key)
+
+    def _diskGet(self,key,now):
+        try:
+            with open(self._diskPath(key,'.meta')) as f : meta=json.load(f)
+            if meta['expires']<=now :
+                self._diskRemove(key)
+                return None
+            if meta['format']=='npz' :
+                import numpy as np
+                with np.load(self._diskPath(key,'.npz')) as z : value={k:z[k] for k in z.files}
+            else :
+                with open(self._diskPath(key,'.pkl'),'rb') as f : value=pickle.load(f)
+            return value,meta['expires'],meta['tags']
+        except (OSError,ValueError,KeyError,EOFError,pickle.UnpicklingError):
+            return None
+
+    def _diskInvalidate(self,tags):
+        for fn in os.listdir(self.diskDir):
+            if not fn.endswith('.meta') : continue
+            try:
+                with open(os.path.join(self.diskDir,fn)) as f : meta=json.load(f)
+            except (OSError,ValueError): continue
+            if set(meta.get('tags',())) & set(tags) : self._diskRemove(fn[:-5])
+
+    def _diskRemove(self,key):
+        for ext in ('.meta','.npz','.pkl'):
+            try : os.remove(self._diskPath(key,ext))
+            except OSError : pass
+
+
+_defaultCache=None
+_defaultCacheLock=threading.Lock()
+def defaultCache():
+    #Returns the process wide shared cache, used by DatabaseConn(cache=True), RO(cache=True)...
+    global _defaultCache
+    with _defaultCacheLock:
+        if _defaultCache is None : _defaultCache=QueryCache()
+    return _defaultCache
@@ -0,0 +1,145 @@
+# db_compress.py
+"""
+Compressed and pipelined text file output for db_conn.
+
+.. package:: db_utils.db_compress
+
+Used by DatabaseConn.doquery() for the text file forms ('csv','tsv','excel','csv-nq','dat','txt'):
+    -compression; 'gzip' or 'zstd' (requires the zstandard package), picked from the outfile extension (.gz, .zst) when
+        not passed.  Pass compression='none' to write plain text whatever the extension.
+    -compressThreads; with more than 1, gzip output is compressed on a thread pool in independent blocks, each written as
+        its own gzip member (a multi member gzip file, readable by gunzip, zcat, python's gzip...).  zstd uses its own
+        worker threads.  zlib/zstd release the GIL so this scales with cores.
+    Rows are fetched on a background thread (fetchChunks()) while the previous chunk is formatted and written, so
+    waiting on the server, formatting and compression overlap.
+"""
+
+import io
+import gzip
+import queue
+import threading
+import collections
+import concurrent.futures
+import importlib.util
+
+compressions=('gzip','zstd')
+_extensions={'.gz':'gzip','.gzip':'gzip','.zst':'zstd','.zstd':'zstd'}
+
+
+def compressionFor(outfile,compression=None):
+    #Returns 'gzip','zstd' or None for outfile and requested compression (None to pick from the extension, 'none' for plain)
+    if compression in (None,'') :
+        for ext,c in _extensions.items():
+            if outfile.lower().endswith(ext) : return c
+        return None
+    if compression in ('none',False) : return None
+    if compression not in compressions : raise ValueError("Unknown compression '%s', use one of %s" % (compression,compressions))
+    return compression
+
+def available():
+    #Returns the compressions available in this environment
+    return ['gzip']+(['zstd'] if importlib.util.find_spec('zstandard') else [])
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """Writable binary file compressing blocks on a thread pool, each as its own gzip member"""
+
+    def __init__(self,fileobj,level=6,threads=4,blockSize=4*1024*1024):
+        self._f=fileobj
+        self.level=level
+        self.threads=threads
+        self.blockSize=blockSize
+        self._pool=concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self._pending=collections.deque()
+        self._buf=bytearray()
+        self._members=0
+
+    def writable(self):
+        return True
+
+    def write(self,b):
+        self._buf+=b
+        while len(self._buf)>=self.blockSize :
+            self._submit(bytes(self._buf[:self.blockSize]))
+            del self._buf[:self.blockSize]
+        return len(b)
+
+    def _submit(self,block):
+        self._pending.append(self._pool.submit(gzip.compress,block,self.level))
+        self._members+=1
+        while len(self._pending)>self.threads*2 : self._f.write(self._pending.popleft().result()) #in order, bounded memory
+
+    def close(self):
+        if self.closed : return
+        try:
+            if self._buf or not self._members : self._submit(bytes(self._buf)) #at least 1 member so an empty file is valid gzip
+            self._buf=bytearray()
+            while self._pending : self._f.write(self._pending.popleft().result())
+        finally:
+            self._pool.shutdown()
+            self._f.close()
+            super().close()
+
+
+def openBinary(outfile,compression=None,level=None,threads=1):
+    #Returns a binary file object writing to outfile, compressed per compressionFor(outfile,compression)
+    compression=compressionFor(outfile,compression)
+    if compression is None : return open(outfile,'wb')
+    if compression=='gzip' :
+        if threads and threads>1 : return io.BufferedWriter(ParallelGzipWriter(open(outfile,'wb'),level if level is not None else 6,threads),1024*1024)
+        return gzip.open(outfile,'wb',compresslevel=level if level is not None else 6)
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the zstandard package (pip install zstandard)")
+    cctx=zstandard.ZstdCompressor(level=level if level is not None else 3,threads=threads if threads and threads>1 else 0)
+    return cctx.stream_writer(open(outfile,'wb'),closefd=True)
+
+def openText(outfile,compression=None,level=None,threads=1):
+    #Returns a text file object (for csv writers...) writing to outfile, compressed per compressionFor(outfile,compression)
+    if compressionFor(outfile,compression) is None : return open(outfile,'wt')
+    return io.TextIOWrapper(openBinary(outfile,compression,level,threads),encoding='utf-8')
+
+
+def fetchChunks(cursor,chunk=100000,depth=2):
+    #Generator of row chunks from cursor, fetched on a background thread so the next chunk is read from the server while the caller
+    #works on the last one (MySQLdb releases the GIL while reading).  At most depth chunks are queued.
+    q=queue.Queue(maxsize=depth)
+    stop=threading.Event()
+    def producer():
+        try:
+            rows=cursor.fetchmany(chunk)
+            while rows and not stop.is_set() :
+                q.put(rows)
+                rows=cursor.fetchmany(chunk)
+            q.put(None)
+        except BaseException as e:
+            q.put(e)
+    t=threading.Thread(target=producer,daemon=True)
+    t.start()
+    try:
+        while True:
+            item=q.get()
+            if item is None : return
+            if isinstance(item,BaseException) : raise item
+            yield item
+    finally:
+        #Stop the producer (unblocking its put if the queue is full) before anyone else uses the cursor
+        stop.set()
+        while t.is_alive():
+            try : q.get(timeout=.1)
+            except queue.Empty : pass
+        t.join()
+
+def writeCsv(cursor,f,writerFactory,header,chunk=100000,timerName=None):
+    #Write the result on cursor to text file f with csv writers from writerFactory(fileobj).  Each chunk is formatted into a
+    #buffer and written in one call while the next chunk is fetched.  Returns the number of rows written.
+    writerFactory(f).writerow(header)
+    n=0
+    for rows in fetchChunks(cursor,chunk):
+        if timerName : print("Timer:%s writing rows %s to %s"%(timerName,n,n+len(rows)-1))
+        buf=io.StringIO()
+        writerFactory(buf).writerows(rows)
+        f.write(buf.getvalue())
+        n+=len(rows)
+    return n
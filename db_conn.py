@@ -10,15 +10,43 @@ File created on 11/1/2016.
 Database abstraction api
 """
 
-import os,subprocess
-import sys,errno
-import datetime,time
-import getopt
-import MySQLdb #Note; python3 installations must install mysqlclient, which is a 3 compliant fork.  We may want to look into
+import os,sys,errno
+import time
+#Everything else (MySQLdb, bldsql, csv, subprocess, numpy...) is imported where it's used so that importing this module, and
+#making a DatabaseConn that may never run a query, is cheap for short lived scripts.  The connection itself is opened on first
+#use (see __init__ lazy).  The bench.py 'startup' case measures the import, connect and first query times.
+#Note; MySQLdb on python3 installations is mysqlclient, which is a 3 compliant fork.  We may want to look into
 #other client libs like native mysql connector.
-import decimal
-import csv
-import db_utils.bldsql as bldsql
+
+def _isBldSQL(obj):
+    #True if obj is a BldSQL object.  If bldsql was never imported, nothing can be one.
+    m=sys.modules.get('db_utils.bldsql')
+    return m is not None and isinstance(obj,m.BldSQL)
+
+def _statsEnabled():
+    #True if db_stats hooks are registered.  Hooks can only be added by importing db_stats, so it isn't imported here until then.
+    m=sys.modules.get('db_utils.db_stats')
+    return m is not None and m.enabled()
+
+
+class QueryError(Exception):
+    """Error from the server on a query.  errno is the mysql error number (None if unknown)."""
+    def __init__(self,e):
+        super().__init__(e)
+        self.errno=e.args[0] if getattr(e,'args',None) and isinstance(e.args[0],int) else None
+
+class DeadlockError(QueryError):
+    """Deadlock found (1213).  The server has rolled back the transaction, it can be retried."""
+
+class LockWaitTimeout(QueryError):
+    """Lock wait timeout exceeded (1205).  The statement was rolled back, it can be retried."""
+
+_errorClasses={1213:DeadlockError,1205:LockWaitTimeout}
+def queryError(e):
+    #Returns the QueryError (or retryable subclass) for exception e
+    if isinstance(e,QueryError) : return e
+    errno=e.args[0] if getattr(e,'args',None) and isinstance(e.args[0],int) else None
+    return _errorClasses.get(errno,QueryError)(e)
 
 
 class DatabaseConn(object):
@@ -48,7 +76,7 @@ class DatabaseConn(object):
     #######
 
 
-    def doquery(self,query=None,parameters=None, numRows=-1, form='dict',numpyFloat64=True,outfile=None,timerName=None,commit=True,multiInsert=False,insert=False):
+    def doquery(self,query=None,parameters=None, numRows=-1, form='dict',numpyFloat64=True,outfile=None,timerName=None,commit=True,multiInsert=False,insert=False,stream=None,numpyDatetime64=False,cacheTTL=None,cacheTags=None,textWidths='exact',textOverflow='grow',prepared=False,convProfile=None,compression=None,compressThreads=1,shared=None):
         #  This is used to issue a sql query or dml statement.
         #
         #  If sql is a dml statement (update/delete), this returns the number of affected rows.  If inster=true, it returns the last insert id (if applicable).
@@ -61,7 +89,23 @@ class DatabaseConn(object):
         #       -'list' (faster for large sets) it returns a list of row lists
         #       -'numpy' results are a dictionary of numpy arrays, 1 array for each column.  Col names are keys into the dictionary.
         #           if numpy and nympyFloat64 is true, number arrays that are automatically created as decimal.Decimal objects will be created as float64 types instead (default)
+        #           Column dtypes are taken from the column types (see db_numpy.py); int/float/decimal cols are int64/float64 arrays, NULLs in float cols are NaN
+        #           and int cols with NULLs are returned as float64 with NaN.  Other types (strings...) are auto detected by numpy.
+        #           If numpyDatetime64 is true, datetime/timestamp cols are returned as datetime64[us] and date cols as datetime64[D] (NULL is NaT)
+        #           instead of arrays of python datetime objects.
+        #           If shared is passed, the arrays are copied into shared memory for other processes and a db_shm.SharedResult handle is
+        #           returned instead (None if no rows).  Pass the handle to multiprocessing workers, which attach to the arrays zero copy
+        #           (with h as a: ...).  shared=True (or 'shm') uses multiprocessing.shared_memory, 'file' a memory mapped temp file.
+        #           The data is removed when the caller and every attached worker have released it (h.release()).  See db_shm.py
         #       -'text' it returns a nicely formatted list of strings
+        #       -'record' list of compact Record rows (tuples with row['col'] and row.col access by column name).  Much less memory than 'dict'.
+        #       -'resultset' a columnar db_records.ResultSet; columns are stored as lists and rows are handed out as views (rs[i]['col'], for row in rs:)
+        #           See db_records.py
+
+        #       iterators: (rows are pulled lazily off a streaming cursor, see iterquery() for details)
+        #       -'iter' returns a generator yielding row tuples
+        #       -'iterdict' returns a generator yielding row dictionaries
+        #       -'batches' returns a generator yielding lists of (up to) 10000 row tuples.  Use iterquery() directly for other batch sizes.
 
         #       file output: (requires outfile)
         #       -'csv' sends to outfile in csv format.  all strings are quoted, embedded quotes are double quoted.  comma separator.
@@ -70,14 +114,30 @@ class DatabaseConn(object):
         #       -'dat' sends formatted text lines to outfile
         #       -'txt' sends formatted text lines to outfile
         #       -'excel' sends excel compatible csv file to outfile
-        #       -'npy' creates a npy format result file that can be imported in other programs.(not programmed yet)
-        #           You can call availableFileFormats() to get a list of available formats
         #       -'csv-nq' sends to outfile without any quoting
+        #       Text files can be compressed; -compression 'gzip' or 'zstd' (zstandard package), picked from the outfile extension
+        #           (.gz/.zst) if not passed ('none' for plain).  -compressThreads >1 compresses on that many threads.  See db_compress.py
+        #           Rows are fetched on a background thread while the last chunk is formatted and written.
+        #       binary columnar formats (written in chunks, see db_numpy.py and db_arrow.py):
+        #       -'npy' outfile is a directory with 1 <col>.npy numpy array file per column.  Memory map with np.load(file,mmap_mode='r') (requires numpy)
+        #       -'npz' outfile is a np.savez style (uncompressed) zip of per column arrays.  Load with np.load(outfile) (requires numpy)
+        #       -'arrow' Arrow IPC file.  Memory map with pyarrow.ipc.open_file(pyarrow.memory_map(outfile)) (requires pyarrow)
+        #       -'parquet' Parquet file (requires pyarrow)
+        #           You can call availableFileFormats() to get a list of available formats (binary formats are only listed when their library is installed)
 
         #       screen output:
         #	-'std' formatted text output to standard out (using print)
         #       -'scr' formatted text output to screen (less viewer)
 
+        #  -textWidths, textOverflow; how column widths are found for the formatted text forms ('dat','txt','std','scr'), see db_text.py.
+        #       These are written a chunk at a time without holding the result set in memory.
+        #       -'exact' (default) rows are spooled to a temp file while the widths are found, then written.  Same output as before.
+        #       -'sample' widths from the first 1000 rows, then rows are written as they are read
+        #       -'description' widths from the column definitions, rows are written as they are read
+        #       -list of ints; fixed widths
+        #       textOverflow is what happens to values wider than their column in the non exact modes; 'grow' (default) widens the column
+        #       from that row on, 'truncate' cuts the value, 'shift' writes it in full pushing the rest of the line right.
+
         #  -If numRows=0, this returns the first value of the first row (convienence), None on no results
         #       -1 (default) for all results, or dml statement (like drop table.)
         #
@@ -86,9 +146,32 @@ class DatabaseConn(object):
         #   To pass insert/update to mysql null, use None in python bind value
 
         #  -If timerName is passed, a the query is timed results printed.
+        #   For detailed metrics (execute/fetch/conversion times, rows, bytes, memory, per query percentiles, slow query log with explain)
+        #   register a hook with db_stats.addHook(), see db_stats.py.
+
+        #  -stream; If True, an unbuffered server side cursor (SSCursor) is used so rows are pulled from the server as they are consumed instead
+        #   of the whole result set being loaded into client memory on execute.
+        #       None (default) streams all file output and screen formats and buffers the python native forms.  Pass stream=True to stream those too
+        #       (lower peak memory, the server holds the result open until it is read).
+        #       stream=False with a text file format uses the old temp table + limit paging method (outputToFileTmpTable), mostly kept for comparison.
+        #       Binary file formats are always streamed.
+        #       Note; while a streaming result is being read, no other query can be issued on this connection.
+
+        #  -prepared; If True, the query is run as a server side prepared statement (see db_prepared.py), prepared once per connection
+        #   and reused on later calls with the same sql text, so the server skips re-parsing it.  Useful for a query run many times
+        #   in a loop with different bind parameters (a BldSQL object with where(...,replace=True) keeps the same sql text).
+        #   Only %s placeholders are supported.  Ignored for multiInsert and the stream=False temp table file output.
+
+        #  -convProfile; result conversion profile for this query, overriding the connection's (see db_convert.py and __init__).
+        #   'default' (Decimal...), 'decfloat' (decimals as floats), 'epoch' (as decfloat with datetime/date cols as int epoch seconds),
+        #   'raw' (no conversion) or 'lazy' (form='list' returns a db_convert.LazyRows that converts values as they're accessed).
+        #   'lazy' only applies to the 'list','dict','text','record' and 'resultset' forms, others use the connection's profile.  With 'epoch', numpyDatetime64 is ignored.
+        #   The binary file forms ('npy','npz','arrow','parquet') type datetime columns themselves, so they always convert with 'decfloat'
+        #   (or 'default' if convertDecToFloat=False); epoch ints or raw bytes would be written as wrong dates.
 
         #  You can use the BldSQL sql object to build a query (see it's documentation), which is convient when building programmatically.
         #  As a convience, If you don't pass query (or parameters), then the BldSQL object is used to generate the query (and parameters)
+        #       You can also pass any BldSQL object as the query (handy when building several queries at once).
         #       You could also use sql.cmd() and sql.bind() to get them
 
         # If commit=True, then autocommit is set true and every command is implicitly commited.
@@ -99,6 +182,16 @@ class DatabaseConn(object):
             #a=db.doquery("start transaction", commit=False)
             #a=db.doquery("call tagwr_addFlaskDataTag(%s,%s,%s,%s)",[12357175, 10, '','John'],commit=False)
             #a=db.doquery("rollback", commit=False)
+            # or use transaction() (savepoints, batched statements) or runInTransaction() (retries deadlocks)
+        # Server errors are raised as QueryError (DeadlockError and LockWaitTimeout for the retryable ones), all Exception subclasses.
+
+        # If the connection was created with a result cache (cache=, see db_cache.py):
+        #   -cacheTTL (seconds); select results for 'dict','list','record','resultset','numpy','text' forms (and numRows=0) are cached for cacheTTL seconds and
+        #       repeat calls with the same (normalized) query, parameters and form are returned from the cache.  Nothing is cached if cacheTTL isn't passed.
+        #       Cached results are shared, so don't modify them in place.
+        #   -cacheTags; optional list of extra tags for the cached entry.  Entries are automatically tagged with the tables they select from.
+        #   -Writes (insert, multiInsert, update/delete/replace, multi table update/delete...) invalidate cached entries tagged with the tables written
+        #       to and any cacheTags passed.  Writes the tables can't be parsed from, like stored procedure calls, clear the whole cache.
 
         # If multiInsert=True then we do a executeMany instead of execute.  Parameters should be a list of tuples
         # If insert=True, this returns lastinsertid (if appropriate)
@@ -109,117 +202,381 @@ class DatabaseConn(object):
 
         #See examples.py for working examples
 
+        if shared :
+            if form!='numpy' : raise ValueError("shared is only supported with form='numpy'")
+            import db_utils.db_shm as db_shm
+            a=self.doquery(query,parameters,numRows,form,numpyFloat64,outfile,timerName,commit,multiInsert,insert,stream,numpyDatetime64,
+                cacheTTL,cacheTags,textWidths,textOverflow,prepared,convProfile,compression,compressThreads)
+            return db_shm.share(a,'shm' if shared is True else shared) if a is not None else None
+
         start=time.time()#For timing purposes
         end=0
         ret=None
-        #If no query (or params) passed, load them from the BldSQL object.
-        if(query==None) :
-            query=self.sql.cmd()
-            if parameters==None : parameters=self.sql.bind() #Only check this if query is using query builder too.
+        #If no query (or params) passed, load them from the BldSQL object.  A BldSQL object can also be passed as the query.
+        sqlObj=None
+        if _isBldSQL(query) : sqlObj=query
+        elif(query==None) : sqlObj=self.sql
+        if sqlObj is not None :
+            #Long wherein() lists (see BldSQL.wherein()) are either run in chunks or loaded into temp tables before the query
+            chunks=sqlObj.whereinChunks() if parameters==None else None
+            if chunks :
+                return self._chunkedQuery(chunks,form=form,numpyFloat64=numpyFloat64,numpyDatetime64=numpyDatetime64,timerName=timerName,
+                    commit=commit,cacheTTL=cacheTTL,cacheTags=cacheTags,prepared=prepared)
+            query=sqlObj.cmd()
+            if parameters==None : parameters=sqlObj.bind() #Only check this if query is using query builder too.
+        inTables=sqlObj.whereinTables() if sqlObj is not None else []
+
+        #Result cache lookup (or note what to invalidate for writes).  Skipped by the rerun of a routed read, the routing call did it.
+        cacheKey=None;invalidate=None
+        if self._cache is not None and self._routed is None :
+            import db_utils.db_cache as db_cache
+            if multiInsert or insert or db_cache.isWrite(query) :
+                invalidate=db_cache.writeTags(query)+list(cacheTags or [])
+            elif cacheTTL and (form in self._cache.cacheableForms or numRows==0) :
+                cacheKey=self._cache.key(query,parameters,form,numRows,numpyFloat64,numpyDatetime64,self._host,self._db,convProfile,sqlObj.whereinKey() if inTables else None)
+                hit,ret=self._cache.get(cacheKey)
+                if hit :
+                    if(timerName) : print ("%s (s):%s (cached)" % (timerName,str(time.time()-start)))
+                    return ret
+
+        #Read replica routing (see db_router.py).  Reads are rerun by _onReplica() with the connection switched to a replica; the rerun
+        #skips the cache (so it's checked and counted once) and the result is cached here.
+        if self._router is not None and self._routed is None and form not in ('iter','iterdict','batches') :
+            if self._readable(query,commit,multiInsert or insert,inTables,outfile is not None and stream is False) :
+                ret=self._onReplica(lambda: self.doquery(query,parameters,numRows,form,numpyFloat64,outfile,timerName,commit,multiInsert,insert,stream,
+                    numpyDatetime64,cacheTTL,cacheTags,textWidths,textOverflow,prepared,convProfile,compression,compressThreads))
+                if cacheKey : self._cache.put(cacheKey,ret,cacheTTL,db_cache.readTags(query)+list(cacheTags or []))
+                return ret
+
+        stats=None
+        if _statsEnabled() : #Only instrument if someone is listening
+            import db_utils.db_stats as db_stats
+            stats=db_stats.QueryStats(query,parameters,form)
+        tm=dict() #timing marks and counts for stats
+
+        if self._routed is None and self._rawConn is None : self.connect() #lazy connection, opened on the first query that isn't a cache hit
+
+        if inTables : self._loadWhereinTables(inTables)
+
+        if form in ('iter','iterdict','batches') : #(wherein temp tables are left for the next load to drop as the query runs lazily)
+            return self.iterquery(query,parameters,form='dict' if form=='iterdict' else 'list',batchSize=10000 if form=='batches' else None,commit=commit)
 
         try:
+            outToFile= True if form in self.availableFileFormats() else False #For file output we'll iterate over the results so we don't need to bring the whole set into memory.
+            if stream is None or form in self.binaryFileFormats : stream=outToFile or form in ('std','scr')
+            if multiInsert or insert : stream=False
+            profile=convProfile or self._convProfile
+            if profile=='lazy' and (form not in ('list','dict','text','record','resultset') or numRows!=-1) : profile=self._eagerProfile
+            if form in self.binaryFileFormats and profile not in ('default','decfloat') : profile=self._eagerProfile
+            if profile=='epoch' : numpyDatetime64=False
+
             self._conn.autocommit(commit)#I think its safe to set this every time.
-            self._c = self._conn.cursor()
+            if stream :
+                import MySQLdb.cursors
+                self._c = self._conn.cursor(MySQLdb.cursors.SSCursor) #unbuffered, rows are fetched from the server as we iterate.
+            else : self._c = self._conn.cursor()
             self._c._defer_warnings = True #Not entirely clear on effect this has, but put it in on rec from the internets to suppress annoying warning messages on things like drop table if exists
 
-            outToFile= True if form in self.availableFileFormats() else False #For file output we'll iterate over the results so we don't need to bring the whole set into memory.
-
+            if stats : tm['rss']=db_stats.peakRSS()
+            tm['execute']=time.time()
             if multiInsert :
                 self._c.executemany(query,parameters)
                 #if commit : self._conn.commit()  #jwm 3.25-leavinig old commits commented for time being incase we need to revert or lookup where called.
+                tm['rows']=self._c.rowcount
                 self._c.close()
+                if invalidate : self._cache.invalidate(invalidate)
+                if stats : self._recordStats(stats,tm,None,None)
                 return
             elif insert :
-                self._c.execute(query,parameters)
+                self._execute(query,parameters,prepared,profile)
                 #if commit : self._conn.commit()
                 id=self._c.lastrowid
+                tm['rows']=self._c.rowcount
                 self._c.close()
+                if invalidate : self._cache.invalidate(invalidate)
+                if stats : self._recordStats(stats,tm,None,None)
                 return id
-            elif outToFile :
+            elif outToFile and not stream :
                 #Select results into a temp table to iterate over.  This adds time (particularly on large datasets), but is safetest way to chunk through the results without trying to load here or altering query.
-                #See comments below in outputToFile
+                #See comments below in outputToFileTmpTable
                 self._c.execute("drop temporary table if exists tmp.t__db_conn_work_tbl",None)
                 self._c.execute("create temporary table tmp.t__db_conn_work_tbl as "+query,parameters)
 
-            else : self._c.execute(query,parameters)
+            else : self._execute(query,parameters,prepared,profile)
 
             end=time.time() #Skips post processing
+            tm['fetch']=end
             a=None
 
-            if (form=='numpy' or form=='npy') : import numpy as np #Only load conditionally as not all environments will have this available. Note we'll let this fail ungracefully
-            #on error for now.
-
-            if self._c.rowcount>0 :
+            #Streaming cursors don't know the row count until the whole set is read, so use the description (None for dml) to tell if there is a result set.
+            if stream and self._c.description is None :
+                if self._c.rowcount>0 : ret = self._c.rowcount #DML statement, return number of rows affected (if any)
+            elif stream or self._c.rowcount>0 :
                 if numRows==0 :
                     a=self._c.fetchone()
                     if a : ret=a[0]
                 if numRows==-1 :
 
-                    if outToFile : ret = self.outputToFile(outfile,form,timerName)
+                    if outToFile :
+                        if stream : ret = self.outputToFile(outfile,form,timerName,textWidths,textOverflow,compression,compressThreads)
+                        else : ret = self.outputToFileTmpTable(outfile,form,timerName,textWidths,textOverflow,compression,compressThreads)
+
+                    elif form=='numpy' and self._c.description is not None : #dict of numpy arrays, 1 per col.  dict keys are column names
+                        #Only load conditionally as not all environments will have numpy available. Note we'll let this fail ungracefully on error for now.
+                        import db_utils.db_numpy as db_numpy
+                        #Rows are fetched and converted in chunks into typed (preallocated when the row count is known) column arrays.
+                        ret = db_numpy.cursorToNumpy(self._c,numpyFloat64,numpyDatetime64,size=None if stream else self._c.rowcount)
+
+                    elif form in ('std','scr') and self._c.description is not None : #formatted text to standard out or the less viewer, written as read
+                        import db_utils.db_text as db_text
+                        lines=db_text.cursorLines(self._c,textWidths,textOverflow)
+                        if form=='scr' : self.outputToScreen(lines)
+                        else :
+                            for line in lines: print(line)
 
                     #The rest of the output formats all return the data in a list or massage the list first and return, so fetch all results (inefficient on large sets!)
                     #and process as needed.
                     else:
                         a=list(self._c)
+                        tm['convert']=time.time()
 
                         if(a): #if we have a result set, package up per request and return it.
                             header=[li[0] for li in self._c.description] #list of column names
-
-                            if(form=='dict'):#a list of row dictionaries with col names as keys
-                                b=list()
-                                for row in a:
-                                    b.append(dict(zip(header,row)))
-                                ret = b
-                            elif(form=='numpy') : #dict of numpy arrays, 1 per col.  dict keys are column names
-                                keys=[li[0] for li in self._c.description]
-                                cols=zip(*a)#convert to column lists
-                                b=dict()
-                                for i,col in enumerate(cols):
-                                    dtype=None #default to auto detect type
-
-                                    if(numpyFloat64) : #Check to see if number is a 'decimal' type and force to be float64 (for compatibility with downstream uses)
-                                        #jwm - 1/19 - added logic to find first non-none value
-                                        first=next((item for item in col if item is not None),None)
-                                        if isinstance(first,(decimal.Decimal,)) : dtype=np.float64
-
-                                    arr=np.asarray(col,dtype=dtype)
-
-                                    b[keys[i]]=arr #Set results into dictionary
-
-                                    ret = b
-                            elif form=='text' : #formatted text output
-                                ret = self.listToTextCols(a,header)
-
-                            elif form=='scr' : #formatted text to less editor (if available)
-                                self.outputToScreen(self.listToTextCols(a,header))
-
-                            elif form=='std' : #formatted text to standard out
-                                out=self.listToTextCols(a,header)
-                                for line in out: print(line)
-
-                            else : #list of lists
-                                ret = a
-
-                        else :
+                            if profile=='lazy' : #values are unconverted, convert with per column converters built once from the description
+                                import db_utils.db_convert as db_convert
+                                convs=db_convert.columnConverters(self._c.description,self._eagerProfile!='default')
+                                if form=='list' : ret = db_convert.LazyRows(a,convs,header)
+                                else : ret = self.packageRows(db_convert.convertRows(a,convs),header,form)
+                            else : ret = self.packageRows(a,header,form) #dict, record, resultset, text or list
+
+                        elif self._c.description is None :
                             #if commit : self._conn.commit() #Send through commit if requested
                             ret = self._c.rowcount #DML statement, return number of rows affected (if any)
+            tm['rows']=self._c.rownumber if self._c.description is not None else self._c.rowcount
             self._c.close()
 
 
         except Exception as e:
             self._c.close()
+            if inTables : self._dropWhereinTables(inTables)
+            if stats : self._recordStats(stats,tm,None,None,error=e)
             print("\n\nSQL that cause error:\n%s" % (query,))
             print("\nBind parameters: " )
             print(parameters)
             print("\n\n")
-            raise Exception(e)
+            raise queryError(e) from e
             sys.exit();
 
 
         if(timerName) : print ("%s (s):%s" % (timerName,str(end-start)))
 
+        if cacheKey : self._cache.put(cacheKey,ret,cacheTTL,db_cache.readTags(query)+list(cacheTags or []))
+        if invalidate : self._cache.invalidate(invalidate)
+        try:
+            if stats : self._recordStats(stats,tm,ret,outfile if outToFile else None) #before the temp tables are dropped; hooks may EXPLAIN the query
+        finally:
+            if inTables : self._dropWhereinTables(inTables)
+
         return ret
 
+    def _loadWhereinTables(self,inTables):
+        #Create and bulk load the temp tables for long BldSQL wherein() lists (see BldSQL.whereinTables())
+        import db_utils.db_bulk as db_bulk
+        c=self._conn.cursor()
+        try:
+            for table,create,values in inTables:
+                c.execute("drop temporary table if exists "+table)
+                c.execute(create)
+                db_bulk.loadValues(self._conn,table,['v'],[(v,) for v in values],duplicates='ignore') #values equal in the column's collation ('a','A') share a key
+        finally:
+            c.close()
+
+    def _dropWhereinTables(self,inTables):
+        c=self._conn.cursor()
+        try:
+            for table,create,values in inTables : c.execute("drop temporary table if exists "+table)
+        finally:
+            c.close()
+
+    def _chunkedQuery(self,chunks,form,**kwargs):
+        #Run BldSQL copies chunks (from BldSQL.whereinChunks()) and merge their results
+        if form not in ('dict','list','record','numpy') : raise ValueError("form '%s' is not supported with the wherein chunk strategy" % form)
+        import db_utils.db_parallel as db_parallel
+        return db_parallel.mergeResults([self.doquery(s,form=form,**kwargs) for s in chunks],form)
+
+    def _execute(self,query,parameters,prepared,profile=None):
+        #Execute on the current cursor, as a (cached) server side prepared statement if requested.
+        #If profile isn't the connection's conversion profile, its converters are swapped in for the execute (MySQLdb picks the
+        #per column converters when the result is created, so they apply to the whole result even on a streaming cursor).
+        swap=profile is not None and profile!=self._convProfile
+        if swap :
+            import db_utils.db_convert as db_convert
+            converter=self._conn.converter
+            self._conn.converter=db_convert.decoders(profile)
+        try:
+            if prepared :
+                import db_utils.db_prepared as db_prepared
+                db_prepared.execute(self._conn,self._c,query,parameters)
+            else : self._c.execute(query,parameters)
+        finally:
+            if swap : self._conn.converter=converter
+
+    def _recordStats(self,stats,tm,ret,outfile,error=None):
+        #Fill in stats from doquery timing marks (tm) and result and pass to the db_stats hooks
+        import db_utils.db_stats as db_stats
+        now=time.time()
+        stats.totalTime=now-stats.start
+        if 'execute' in tm : stats.executeTime=tm.get('fetch',now)-tm['execute']
+        if 'fetch' in tm : stats.fetchTime=tm.get('convert',now)-tm['fetch']
+        if 'convert' in tm : stats.convertTime=now-tm['convert']
+        stats.rows=max(tm.get('rows',0),0)
+        if outfile and os.path.isdir(outfile) : stats.bytes=sum(os.path.getsize(os.path.join(outfile,fn)) for fn in os.listdir(outfile))
+        elif outfile and os.path.exists(outfile) : stats.bytes=os.path.getsize(outfile)
+        else : stats.bytes=db_stats.sizeOf(ret)
+        if 'rss' in tm : stats.memDelta=db_stats.peakRSS()-tm['rss']
+        if error is not None : stats.error=str(error)
+        db_stats.record(stats,self)
+
+    def explain(self,query,parameters=None):
+        #Returns the EXPLAIN output rows (list of dicts) for a select.  Used by db_stats.SlowQueryLog
+        c=self._conn.cursor()
+        try:
+            c.execute("explain "+query,parameters)
+            header=[li[0] for li in c.description]
+            return [dict(zip(header,row)) for row in c.fetchall()]
+        finally:
+            c.close()
+
+    def iterquery(self,query=None,parameters=None,form='list',batchSize=None,commit=True):
+        #Generator version of doquery() for selects.  Rows are yielded straight off an unbuffered (SSCursor) server side cursor
+        #so only the current chunk of rows is held in memory no matter how big the result set is.
+        #  -form 'list' (default) yields row tuples, 'dict' yields row dictionaries with col names as keys.
+        #  -batchSize; if passed, yields lists of up to batchSize rows (in requested form) instead of single rows.
+        #  -query, parameters and commit are as in doquery().  If query isn't passed, the BldSQL object is used (or pass a BldSQL object as the query).
+        #   example:
+        #     for row in db.iterquery("select num,value from flask_data where date>%s",('2016-01-01',),form='dict'):
+        #         print(row['num'],row['value'])
+        #
+        #  The query isn't run until the first row is requested.  The cursor is closed when the generator is exhausted, closed or garbage collected,
+        #  so it is safe for the consumer to break out of the loop early.  Note though that closing early still has to read (and discard) the
+        #  remainder of the result set off the wire before the connection can be used again, so add a limit if you only need the first part.
+        #  Like any streaming cursor, no other query can be run on this connection until iteration is finished (or the generator closed).
+        sqlObj=None
+        if _isBldSQL(query) : sqlObj=query
+        elif(query==None) : sqlObj=self.sql
+        inTables=[]
+        if sqlObj is not None :
+            if sqlObj.whereinChunks() : raise ValueError("The wherein chunk strategy isn't supported by iterquery")
+            query=sqlObj.cmd()
+            if parameters==None : parameters=sqlObj.bind()
+            inTables=sqlObj.whereinTables()
+            if inTables : self._loadWhereinTables(inTables)
+
+        chunk=batchSize if batchSize else 1000 #rows to pull per fetch when yielding single rows.
+        asDict=(form=='dict')
+
+        import MySQLdb.cursors
+        conn,replica=self._conn,None
+        if self._router is not None and self._readable(query,commit,False,inTables,False) : conn,replica=self._pickReplica()
+        try:
+            c=conn.cursor(MySQLdb.cursors.SSCursor)
+        except BaseException :
+            if replica : self._router.release(replica)
+            raise
+        c._defer_warnings = True
+        try:
+            try:
+                conn.autocommit(commit)
+                c.execute(query,parameters)
+            except Exception as e:
+                print("\n\nSQL that cause error:\n%s" % (query,))
+                print("\nBind parameters: " )
+                print(parameters)
+                print("\n\n")
+                raise queryError(e) from e
+
+            if c.description is None : return #dml statement, nothing to iterate over.
+            header=[li[0] for li in c.description] #list of column names
+
+            rows=c.fetchmany(chunk)
+            while rows :
+                if asDict : rows=[dict(zip(header,row)) for row in rows]
+                if batchSize : yield rows
+                else :
+                    for row in rows : yield row
+                rows=c.fetchmany(chunk)
+        finally:
+            c.close()
+            if replica : self._router.release(replica)
+            if inTables : self._dropWhereinTables(inTables)
+
+    def _readable(self,query,commit,write,inTables,tmpTable):
+        #True if query should go to a replica.  Anything else goes to the primary, and writes start the read your writes window.
+        import db_utils.db_router as db_router
+        readOnly=db_router.isReadOnly(query)
+        if not readOnly or write :
+            self._lastWrite=time.time()
+            return False
+        return commit and not inTables and not tmpTable and time.time()-self._lastWrite>=self._router.stickySeconds
+
+    def _pickReplica(self,tried=()):
+        #Returns (connection,replica name) for a read, counted as in flight on the router (release() it after).
+        #Returns the primary connection and None if no replica is usable.  Due health checks are run first.
+        for name in self._router.dueForCheck() : self._checkReplica(name)
+        tried=list(tried)
+        while True:
+            name=self._router.choose(tried)
+            if name is None : return self._conn,None
+            try : return self._replicaConn(name),name
+            except Exception :
+                self._router.release(name)
+                self._router.markDown(name)
+                tried.append(name)
+
+    def _onReplica(self,run):
+        #Runs run() (a doquery call) with the connection switched to a replica.  If the replica drops the connection it's marked
+        #down and the query rerun on the next one (or the primary).
+        import db_utils.db_router as db_router
+        tried=[]
+        while True:
+            conn,name=self._pickReplica(tried)
+            self._routed=conn
+            try : return run()
+            except QueryError as e :
+                if name is None or e.errno not in db_router.connectionErrors : raise
+                self._dropReplica(name)
+                self._router.markDown(name)
+                tried.append(name)
+            finally:
+                self._routed=None
+                if name is not None : self._router.release(name)
+
+    def _replicaConn(self,name):
+        conn=self._replicaConns.get(name)
+        if conn is None :
+            import db_utils.db_router as db_router
+            host,port=db_router.parseHost(name)
+            conn=self._replicaConns[name]=self._open(host,port)
+        return conn
+
+    def _checkReplica(self,name):
+        import db_utils.db_router as db_router
+        try : self._router.checked(name,*db_router.checkHost(self._replicaConn(name)))
+        except Exception :
+            self._dropReplica(name)
+            self._router.markDown(name)
+
+    def _dropReplica(self,name):
+        #Close a failed replica connection (not returned to the pool)
+        conn=self._replicaConns.pop(name,None)
+        if conn is not None :
+            try : conn.close()
+            except Exception : pass
+
+    def replicaStats(self):
+        #Returns the router's per replica state (in flight, latency, lag, down...), None if this connection has no replicas.  See db_router.py
+        return self._router.stats() if self._router is not None else None
+
     def doMultiInsert(self,sql,params,maxLen=10000,all=False):
         #wrapper to do a multi insert.. mostly just to handle when to send through if appending in a loop.
         #Call with all=True after loop to send through any remaining
@@ -242,10 +599,181 @@ class DatabaseConn(object):
             return True
         return False
 
+    def bulkLoad(self,table,columns,rows,method='auto',duplicates=None,pipe=True,packetBytes=None):
+        #Load rows from any iterable (list of lists, generator, file reader...) into table without holding them all in memory.
+        #Faster alternative to doMultiInsert() for large loads.  See db_bulk.py for details.
+        #  -columns is a list of column names in the same order as the values in each row (None for all table cols in table order).
+        #  -method
+        #       'infile' streams rows through LOAD DATA LOCAL INFILE (fastest).  Requires the connection be made with localInfile=True
+        #           and the server to allow local_infile.  pipe=True (default) feeds the load through a named pipe as rows are generated,
+        #           pipe=False writes them to a temp file first.
+        #       'values' sends multi row insert statements, each sized to fit the server's max_allowed_packet (or packetBytes if passed)
+        #       'auto' (default) uses infile if the connection has localInfile, falling back to values if the server refuses it (list rows only,
+        #           a generator can't be replayed).
+        #  -duplicates; None (error/warning per method defaults), 'ignore', 'replace' or 'update' (values only, with columns; on duplicate key update all columns)
+        #  Each statement is autocommitted.  Returns a dict with rows, seconds, rowsPerSec, method (used) and statements (number sent).
+        #   example (see doMultiInsert):
+        #     rows=([row[2],row[0],row[1]] for row in fh.readf(delim=',',skip_lines=1))
+        #     r=db.bulkLoad("mund_dev.t_brmAerodyneData",['dt','c2h6','ch4'],rows)
+        #     print("%s rows/sec" % r['rowsPerSec'])
+        import db_utils.db_bulk as db_bulk
+        self._conn.autocommit(True)
+        r=db_bulk.bulkLoad(self._conn,table,columns,rows,method,duplicates,pipe,packetBytes,self._localInfile)
+        self._lastWrite=time.time()
+        if self._cache is not None :
+            import db_utils.db_cache as db_cache
+            self._cache.invalidate(db_cache.writeTags("insert into "+table))
+        return r
+
+    def parallelQuery(self,sql,key,partitions,form='numpy',concurrency=4,ordered=True,outfile=None,processes=False,**kwargs):
+        #Split BldSQL query sql into partitions on column key and run them concurrently on their own (pooled) connections, merging the results.
+        #  -partitions is a list of (lo,hi) ranges (key>=lo and key<hi) or a list of value lists (key in (...)).
+        #       See db_parallel.numRanges(), dateRanges() and valueChunks() to generate them.
+        #  -form; 'numpy' (columns concatenated), 'list'/'dict'/'record' (lists concatenated) or 'csv','tsv','excel','csv-nq' (written to outfile).
+        #  -concurrency; number of partitions run at once.
+        #  -ordered; if True (default) results are merged in partition order, so if partitions are in key order and the query is
+        #       ordered by key, the merged result is too.  If False they're merged as they complete.
+        #  -processes; use a process pool instead of threads.  Better when conversion (numpy/dict packaging) is the bottleneck,
+        #       but results are pickled back to this process.
+        #  -kwargs are passed to each partition's doquery (numpyFloat64, numpyDatetime64...)
+        #   example:
+        #     import db_utils.db_parallel as db_parallel
+        #     sql=db.sql
+        #     sql.initQuery();sql.table("flask_data_view");sql.col("data_num");sql.col("value");sql.where("parameter_num=%s",1)
+        #     a=db.parallelQuery(sql,"data_num",db_parallel.numRanges(1,20000000,8),concurrency=8)
+        import db_utils.db_parallel as db_parallel
+        return db_parallel.parallelQuery(self._connArgs,sql,key,partitions,form=form,concurrency=concurrency,ordered=ordered,
+            outfile=outfile,processes=processes,pool=self._pool,**kwargs)
+
+    def page(self,sql,keys,pageSize,token=None,form='dict',descending=False,**kwargs):
+        #Keyset (seek) pagination of BldSQL query sql.  Returns (rows,token) for the page after token (first page if None).
+        #token is None on the last page; otherwise pass it back to get the next page.  Each page costs the same no matter how deep.
+        #  -keys; ordered unique (not null) key of the results, a column or list of columns like 'num' or ['date','num'].
+        #       The key columns must be selected, and the results are ordered by them.  See BldSQL.seek()
+        #  -form; 'dict','record','resultset','list' or 'numpy'.  descending pages from the end of the key backwards.
+        #  -kwargs are passed to doquery (numpyFloat64, cacheTTL...).  sql isn't modified.
+        #   example:
+        #     rows,token=db.page(sql,['ev_date','num'],500,token=request.args.get('next'))
+        import db_utils.db_paging as db_paging
+        return db_paging.page(self,sql,keys,pageSize,token,form,descending,**kwargs)
+
+    def pages(self,sql,keys,pageSize,token=None,form='dict',descending=False,**kwargs):
+        #Generator of (rows,token) for every page from token on.  See page()
+        import db_utils.db_paging as db_paging
+        return db_paging.pages(self,sql,keys,pageSize,token,form,descending,**kwargs)
+
+    def downsample(self,sql,timeCol,valueCol,points=2000,method='minmax',factor=4,seconds=None):
+        #Returns a time series from BldSQL query sql reduced on the server to about points points for plotting, as a dict of 2 numpy
+        #arrays keyed by the time and value column names (None if no rows).  Requires numpy.
+        #  -timeCol,valueCol; datetime and numeric result columns of sql.
+        #  -method; 'minmax' (min and max of each of points/2 time buckets, keeps spikes), 'lttb' (Largest Triangle Three Buckets over
+        #       the min/max of factor*points/2 finer buckets) or 'mean' (bucket means).
+        #  -seconds; bucket width.  By default it's picked from the time range of the rows (1 extra min/max query).
+        #   example:
+        #     a=db.downsample(sql,'datetime','value',points=1500,method='lttb')
+        #     plt.plot(a['datetime'],a['value'])
+        #  For other aggregates (count, std...) run BldSQL.timeBucket() queries directly.  See db_downsample.py
+        import db_utils.db_downsample as db_downsample
+        return db_downsample.downsample(self,sql,timeCol,valueCol,points,method,factor,seconds)
+
+    def snapshot(self,sql,path,key='num',since=None,numpyFloat64=True,refresh=False):
+        #Keeps the results of BldSQL query sql in local snapshot directory path and returns them as a dict of read only memory mapped
+        #numpy arrays (as form='numpy', None if no rows).  The first call selects everything; later calls only select rows past the
+        #snapshot's high-water mark and merge them in.  Requires numpy.
+        #  -key; unique (not null) column of the results.  Rows are kept in key order.
+        #  -since; column to select new rows by (default key, for append only data).  Pass a modification timestamp column to also pick
+        #       up changed rows, which replace the old ones by key.
+        #  -refresh; rebuild from scratch (deleted rows aren't otherwise detected).  Changing the query also rebuilds.
+        #   example:
+        #     a=db.snapshot(sql,'/scratch/co2_snap',key='data_num')
+        #  See db_snapshot.py
+        import db_utils.db_snapshot as db_snapshot
+        meta,n=db_snapshot.sync(self,sql,path,key,since,numpyFloat64,refresh)
+        return db_snapshot.load(path,meta)
+
+    def doqueries(self,entries,form='dict',numpyFloat64=True,numpyDatetime64=False,commit=True):
+        #Runs several queries in 1 round trip (sent as a multi statement packet, results read with nextset()) and returns a list with
+        #each query's result.  For scripts running a series of small independent queries, especially over remote links.
+        #  -entries; list of (query,parameters,form) tuples.  query can be a BldSQL object (as in doquery()); parameters and form can
+        #       be left off (or None).  A plain query string is also accepted.
+        #  -form; default form for entries that don't give one.  'dict','list','record','resultset','text','numpy' or 'scalar' (the first
+        #       value of the first row, like doquery numRows=0).  Empty results are None, statements without results give the rows affected.
+        #  numpyFloat64, numpyDatetime64 and commit are as in doquery().  Results aren't cached.
+        #   example:
+        #     sites,n=db.doqueries([("select * from gmd.site where num=%s",[75]),("select count(*) from flask_event",None,'scalar')])
+        #  See db_batch.py
+        import db_utils.db_batch as db_batch
+        return db_batch.doqueries(self,entries,form,numpyFloat64,numpyDatetime64,commit)
+
+    def transaction(self,isolation=None,batchBytes=None):
+        #Returns a db_txn.Transaction; use in a with block.  Committed when the block ends, rolled back if it raises.
+        #  -isolation; optional isolation level for this transaction ('read committed','repeatable read','serializable'...)
+        #  -batchBytes; max size of the multi statement packets sent by add() (default from the server's max_allowed_packet)
+        #   example:
+        #     with db.transaction() as t:
+        #         t.execute("update flask_data set flag=%s where num=%s",('..x',12345))
+        #         with t.savepoint(): t.execute("delete from flask_data_tag_range where data_num=%s",(12345,))
+        #         for num in nums : t.add("call tagwr_addFlaskDataTag(%s,%s,%s,%s)",[num,10,'','John'])
+        #  See db_txn.py
+        import db_utils.db_txn as db_txn
+        return db_txn.Transaction(self,isolation,batchBytes)
+
+    def runInTransaction(self,func,retries=5,backoff=.05,maxBackoff=2.,isolation=None,batchBytes=None):
+        #Calls func(t) in a transaction t (see transaction()) and returns its result.  On a deadlock or lock wait timeout the
+        #transaction is rolled back and func rerun, up to retries times, sleeping backoff*2^n (max maxBackoff, +-50% jitter) seconds between.
+        #func should only change the database through t, as it may be called more than once.
+        #   example:
+        #     def move(t):
+        #         t.execute("update a set n=n-1 where id=%s",(1,)); t.execute("update b set n=n+1 where id=%s",(1,))
+        #     db.runInTransaction(move)
+        import db_utils.db_txn as db_txn
+        return db_txn.runInTransaction(self,func,retries,backoff,maxBackoff,isolation,batchBytes)
+
+    binaryFileFormats=('npy','npz','arrow','parquet')
+    _fileFormats=None
     def availableFileFormats(self):
         #returns a list of currently available file output formats
-        return ['csv','tsv','dat','txt','excel','csv-nq']
-    def outputToFile(self,outfile,form,timerName):
+        #The binary formats depend on optional libraries, so are only listed if those are installed (checked once, doquery calls this every query).
+        if DatabaseConn._fileFormats is None :
+            import importlib.util
+            formats=['csv','tsv','dat','txt','excel','csv-nq']
+            if importlib.util.find_spec('numpy') : formats+=['npy','npz']
+            if importlib.util.find_spec('pyarrow') : formats+=['arrow','parquet']
+            DatabaseConn._fileFormats=formats
+        return list(DatabaseConn._fileFormats)
+    def outputToFile(self,outfile,form,timerName,textWidths='exact',textOverflow='grow',compression=None,compressThreads=1):
+        #Output current result set to file.  See comments above for available form (file formats)
+        #The result set is read from a streaming (SSCursor) cursor so we only ever hold a chunk of rows in memory and the server only
+        #runs the query once (unlike the temp table/limit paging in outputToFileTmpTable which rescans the work table for each chunk).
+        if outfile==None :
+            print("outfile is required for file output")
+            sys.exit()
+        import db_utils.db_compress as db_compress
+        f=None if form in self.binaryFileFormats else db_compress.openText(outfile,compression,threads=compressThreads) #binary writers manage their own files
+        try:
+            header=[li[0] for li in self._c.description] #list of column names
+
+            if form in ('npy','npz') :
+                import db_utils.db_numpy as db_numpy
+                db_numpy.cursorToNpy(self._c,outfile,form,timerName=timerName)
+
+            elif form in ('arrow','parquet') :
+                import db_utils.db_arrow as db_arrow
+                db_arrow.cursorToArrow(self._c,outfile,form,timerName=timerName)
+
+            #Text formatted (space delim) file, formatted and written a chunk at a time (see db_text.py for how column widths are found)
+            elif(form=='dat' or form=='txt') :
+                import db_utils.db_text as db_text
+                db_text.writeLines(db_text.cursorLines(self._c,textWidths,textOverflow,emptyHeader=True),f)
+
+            else: #use the csv writer to format output as requested.  Chunks are fetched on a thread while the last is formatted/written
+                db_compress.writeCsv(self._c,f,lambda fo: self._csvWriter(fo,form),header,chunk=100000,timerName=timerName)
+        finally:
+            if f : f.close()
+
+        return True
+
+    def outputToFileTmpTable(self,outfile,form,timerName,textWidths='exact',textOverflow='grow',compression=None,compressThreads=1):
         #Output current result set to file.  See comments above for available form (file formats)
         #We don't pass results because we don't want to load the full set into memory if we don't have to.. we'll just read/write a chunk at time.
         #Note, the mysqldb lib apparently reads the whole rs into memory even when using fetch many, so we'll implement our own,
@@ -255,23 +783,17 @@ class DatabaseConn(object):
             print("outfile is required for file output")
             sys.exit()
         query="select * from tmp.t__db_conn_work_tbl"
-        f=open(outfile,'wt')
+        import db_utils.db_compress as db_compress
+        f=db_compress.openText(outfile,compression,threads=compressThreads)
         try:
-            #If we're writing a text formatted (space delim) file, read whole results into a list, format and write out.  Hopefully not too big
+            #Text formatted (space delim) file, see db_text.py
             if(form=='dat' or form=='txt') :
+                import db_utils.db_text as db_text
                 self._c.execute(query)
-                header=[li[0] for li in self._c.description] #list of column names
-                b=self.listToTextCols(list(self._c),header)
-                for row in b:
-                    f.write('%s\n' % row)
+                db_text.writeLines(db_text.cursorLines(self._c,textWidths,textOverflow,emptyHeader=True),f)
 
             else: #use the csv writer to format output as requested.
-                if(form=='excel'):
-                    writer=csv.writer(f,dialect='excel')
-                else:
-                    delim=' ' if form == 'tsv' else ','
-                    quoting=csv.QUOTE_NONNUMERIC if form != 'csv-nq' else csv.QUOTE_NONE
-                    writer=csv.writer(f,delimiter=delim,quoting=quoting)
+                writer=self._csvWriter(f,form)
 
                 chunk=100000 #arbitrary
                 limitFrom=0
@@ -297,6 +819,18 @@ class DatabaseConn(object):
 
         return True
 
+    @staticmethod
+    def _csvWriter(f,form):
+        #Returns a csv writer on file handle f for passed file form
+        import csv
+        if(form=='excel'):
+            writer=csv.writer(f,dialect='excel')
+        else:
+            delim=' ' if form == 'tsv' else ','
+            quoting=csv.QUOTE_NONNUMERIC if form != 'csv-nq' else csv.QUOTE_NONE
+            writer=csv.writer(f,delimiter=delim,quoting=quoting)
+        return writer
+
     def outputToFileOld(self,outfile,form):
         #Output current result set to file.  See comments above for available form (file formats)
         #We don't pass results because we don't want to load the full set into memory if we don't have to.. we'll just read/write a line at time.
@@ -304,6 +838,7 @@ class DatabaseConn(object):
             print("outfile is required for file output")
             sys.exit()
 
+        import csv
         f=open(outfile,'wt')
         try:
             header=[li[0] for li in self._c.description] #list of column names
@@ -332,6 +867,7 @@ class DatabaseConn(object):
 
     def outputToScreen(self,lines):
         #Outputs lines to less viewer
+        import subprocess
         try:
             #editor=os.getenv('EDITOR','vi') less worked better...
             pager=subprocess.Popen(['less', '-F', '-R', '-S', '-X', '-K'], stdin=subprocess.PIPE, stdout=sys.stdout,text=True)
@@ -353,64 +889,177 @@ class DatabaseConn(object):
 
         return True
 
-    def listToTextCols(self,lines,header):
+    def listToNumpy(self,lines,header,numpyFloat64=True):
+        #Returns a dict of numpy arrays (1 per col, col names as keys) from passed list of row lists.
+        #This was the original row based form='numpy' implementation (doquery now uses db_numpy.cursorToNumpy()).  Kept for comparison, see bench.py
+        import numpy as np
+        import decimal
+        cols=zip(*lines)#convert to column lists
+        b=dict()
+        for i,col in enumerate(cols):
+            dtype=None #default to auto detect type
+
+            if(numpyFloat64) : #Check to see if number is a 'decimal' type and force to be float64 (for compatibility with downstream uses)
+                #jwm - 1/19 - added logic to find first non-none value
+                first=next((item for item in col if item is not None),None)
+                if isinstance(first,(decimal.Decimal,)) : dtype=np.float64
+
+            b[header[i]]=np.asarray(col,dtype=dtype) #Set results into dictionary
+        return b
+
+    @staticmethod
+    def packageRows(a,header,form):
+        #Returns list of row tuples a packaged per form ('dict','record','resultset','text' or 'list'), see doquery().  Shared with db_async.
+        if(form=='dict'):#a list of row dictionaries with col names as keys
+            b=list()
+            for row in a:
+                b.append(dict(zip(header,row)))
+            return b
+        elif form in ('record','resultset') : #compact alternatives to dict, see db_records.py
+            import db_utils.db_records as db_records
+            if form=='record' : return db_records.toRecords(a,header)
+            return db_records.ResultSet.fromRows(a,header)
+        elif form=='text' : #formatted text output
+            return DatabaseConn.listToTextCols(a,header)
+        return a #list of lists
+
+    @staticmethod
+    def listToTextCols(lines,header):
         #Returns a formatted list of passed list of output lines
-        #These will be space delimited with min 3 space gap
-        spacing=3
-
-        #We need the headers in with the lines to figure out the widths, but don't want to insert (inefficient) so we'll add temporarily to the end
-        lines.append(header)
-        widths = [max(len(str(value)) for value in column) + spacing
-              for column in zip(*lines)]
-        lines.pop() #pull off the header
-
-        out=[]
-        #Insert the column headers
-        out.append(''.join('%-*s' % item for item in zip(widths, header)))
-        #and all the data
-        for line in lines:
-           out.append(''.join('%-*s' % item for item in zip(widths, line)))
-
-        return out
+        #These will be space delimited with min 3 space gap.  For large result sets, see db_text.py for the streaming version.
+        import db_utils.db_text as db_text
+        return db_text.rowsToLines(header,lines)
 
     def getSelectedDB(self):
         return self.doquery("select database()", numRows=0)
 
 
-    def __init__(self,user='guest',password='',db='ccgg',host='db-int2',convertDecToFloat=True):
+    def __init__(self,user='guest',password='',db='ccgg',host='db-int2',convertDecToFloat=True,pool=None,cache=None,localInfile=False,convProfile=None,lazy=True,port=None,replicas=None):
         #Class instance variables
         self._c = None
-        self._conn = None
-        self.sql = bldsql.BldSQL()
-
+        self._rawConn = None #the MySQLdb connection, see _conn
+        self._closed = False
+        self._pool = None
+        self._sql = None
+        self._routed = None #replica connection in use by the current doquery
+        self._replicaConns = dict()
+        self._lastWrite = 0
+        self._host = host
+        self._db = db
+        self._localInfile = localInfile #Allow LOAD DATA LOCAL INFILE (see bulkLoad())
+        self._connArgs = dict(user=user,password=password,db=db,host=host,convertDecToFloat=convertDecToFloat,localInfile=localInfile,convProfile=convProfile,port=port) #for opening more connections like this one (parallelQuery())
+
+        #Result conversion profile (see db_convert.py).  convertDecToFloat selects 'decfloat' (decimals as floats, ~3x speed up on large selects)
+        #or 'default'; pass convProfile to use another.  Profiles are copies, the global MySQLdb converters aren't changed.
+        self._eagerProfile = 'decfloat' if convertDecToFloat else 'default' #also what 'lazy' converts to
+        self._convProfile = convProfile or self._eagerProfile
+
+        #cache; pass a db_cache.QueryCache (or True for the shared default cache) to enable the doquery cacheTTL option.  See db_cache.py
+        if cache is True :
+            import db_utils.db_cache as db_cache
+            cache=db_cache.defaultCache()
+        self._cache = cache
+
+        #pool; pass a db_pool.ConnectionPool (or True for the shared default pool) to draw the connection from a pool instead of
+        #opening a new one.  The connection is returned to the pool on close() (or when this object is garbage collected).  See db_pool.py
+        if pool is True :
+            import db_utils.db_pool as db_pool
+            pool=db_pool.defaultPool()
+        self._pool = pool or None
+
+        #lazy; the connection is opened (or checked out of the pool) on first use instead of here, so scripts that exit before
+        #running a query (or only get cache hits) never connect.  Connection errors are then raised by the first query.
+        #Pass lazy=False (or call connect()) to connect now, eg to check the login up front.
+        #replicas; list of read replica hosts ('host' or 'host:port') or a db_router.Router.  Read only selects are then sent to a
+        #replica (picked by the router's policy, skipping lagging or down ones) and everything else to host.  See db_router.py
+        self._router = None
+        if replicas :
+            import db_utils.db_router as db_router
+            self._router = replicas if isinstance(replicas,db_router.Router) else db_router.router(host+(":%s" % port if port else ""),list(replicas))
+
+        if not lazy : self.connect()
+
+    def connect(self):
+        #Opens the connection if it isn't already open (it's normally opened on first use).  Returns self.
+        if self._rawConn is not None : return self
+        if self._closed : raise Exception("Connection is closed")
         try:
-            if(convertDecToFloat):#Mapping mysql dec to python native floats (instead of dec obj) results in ~3x speed up on large selects
-            #I don't think it causes any issues, but making fully optional just in case.
-                from MySQLdb.converters import conversions
-                from MySQLdb.constants import FIELD_TYPE
-                conversions[FIELD_TYPE.DECIMAL] = float
-                conversions[FIELD_TYPE.NEWDECIMAL] = float
-                self._conn=MySQLdb.connect(host=host ,user=user, passwd=password, db=db,conv=conversions)
-            else : self._conn=MySQLdb.connect(host=host ,user=user, passwd=password, db=db)
-
+            self._rawConn=self._open(self._connArgs['host'],self._connArgs['port'])
         except Exception as e:
             raise Exception(e)
-            sys.exit();
+        return self
+
+    def _open(self,host,port):
+        #Returns a new (or pooled) MySQLdb connection to host with this object's login and settings
+        import MySQLdb
+        import db_utils.db_convert as db_convert
+        a=self._connArgs
+        conv=db_convert.connConverters(self._convProfile)
+        args=dict(local_infile=1) if self._localInfile else dict()
+        if port : args['port']=port #default 3306
+        if self._pool : return self._pool.checkout(host,a['user'],a['password'],a['db'],conv=conv,convKey=self._convProfile,**args)
+        return MySQLdb.connect(host=host ,user=a['user'], passwd=a['password'], db=a['db'],conv=conv,**args)
+
+    @property
+    def _conn(self):
+        #The MySQLdb connection, opened on first use.  While doquery runs a read on a replica, that replica's connection.
+        if self._routed is not None : return self._routed
+        if self._rawConn is None : self.connect()
+        return self._rawConn
+
+    @property
+    def connected(self):
+        return self._rawConn is not None
+
+    @property
+    def sql(self):
+        #BldSQL query builder for this connection (see doquery()), made on first use
+        if self._sql is None :
+            import db_utils.bldsql as bldsql
+            self._sql=bldsql.BldSQL()
+        return self._sql
+
+    @sql.setter
+    def sql(self,sql):
+        self._sql=sql
+
+    def close(self):
+        #Close the connection (or return it to the pool if from one).  This object can't be used after.
+        self._closed=True
+        conns=list(self._replicaConns.values())
+        self._replicaConns.clear()
+        if self._rawConn is not None : conns.append(self._rawConn)
+        self._rawConn=None
+        prepared=sys.modules.get('db_utils.db_prepared') #only loaded if prepared=True was used
+        for conn in conns:
+            if prepared : prepared.release(conn)
+            if self._pool : self._pool.checkin(conn)
+            else : conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,tb):
+        self.close()
+        return False
 
     def __del__(self):
-        self._conn.close()
+        self.close()
 
 
 
 
 
 #Convience subclasses to log in to user/dbs
+#Pass pool=True to draw connections from the shared connection pool (see db_pool.py)
+#Pass replicas=[hosts] to send read only selects to read replicas (see db_router.py)
+#Pass cache=True to use the shared query result cache (see db_cache.py).  ProdDB writes through a cached connection invalidate affected entries.
 class RO(DatabaseConn):#select and temp tables & exec
-    def __init__(self,db='ccgg'):
+    def __init__(self,db='ccgg',pool=None,cache=None,lazy=True,replicas=None):
         pw="";u="";
-        DatabaseConn.__init__(self,user=u,password=pw,db=db)
+        DatabaseConn.__init__(self,user=u,password=pw,db=db,pool=pool,cache=cache,lazy=lazy,replicas=replicas)
 class ProdDB(DatabaseConn):
-    def __init__(self,db='ccgg'):
+    def __init__(self,db='ccgg',pool=None,cache=None,lazy=True):
         pw="";u="";
-        DatabaseConn.__init__(self,user=u,password=pw,db=db)
+        DatabaseConn.__init__(self,user=u,password=pw,db=db,pool=pool,cache=cache,lazy=lazy)
 
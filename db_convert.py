@@ -0,0 +1,136 @@
+# db_convert.py
+"""
+Result conversion profiles for db_conn.
+
+.. package:: db_utils.db_convert
+
+MySQLdb converts each value with the function registered for its column type in the connection's converter dict.  The
+per column functions are looked up once when a result set is created (not per value), so choosing the dict is how we
+control conversion.  DatabaseConn used to get floats for decimals by changing the module global
+MySQLdb.converters.conversions, which changed every connection in the process; profiles are copies instead, set per
+connection (DatabaseConn(convProfile=)) or swapped in for a single query (doquery(convProfile=)).
+
+Profiles:
+    'default'   MySQLdb's conversions (decimal.Decimal, datetime...)
+    'decfloat'  decimals as python floats (~3x faster on large selects than Decimal).  Used when convertDecToFloat=True
+    'epoch'     as decfloat, with datetime/timestamp/date columns as int epoch seconds (UTC, fractional seconds dropped)
+    'raw'       no conversion; numeric and temporal values are returned as the bytes sent by the server, text as str.
+                For passing values straight through (to files, other systems...).
+    'lazy'      values are fetched unconverted and converted when accessed.  For form='list' a LazyRows is returned, which
+                converts a row (or a whole column, see LazyRows.column()) on access with per column converters built once from
+                the cursor description.  Other forms are converted up front with those same converters.
+"""
+
+import decimal
+import datetime
+import MySQLdb.converters
+import MySQLdb.times
+from MySQLdb.constants import FIELD_TYPE
+
+profiles=('default','decfloat','epoch','raw','lazy')
+
+_intTypes=(FIELD_TYPE.TINY,FIELD_TYPE.SHORT,FIELD_TYPE.LONG,FIELD_TYPE.INT24,FIELD_TYPE.LONGLONG,FIELD_TYPE.YEAR)
+_floatTypes=(FIELD_TYPE.FLOAT,FIELD_TYPE.DOUBLE)
+_decTypes=(FIELD_TYPE.DECIMAL,FIELD_TYPE.NEWDECIMAL)
+_datetimeTypes=(FIELD_TYPE.DATETIME,FIELD_TYPE.TIMESTAMP)
+
+_epochOrdinal=datetime.date(1970,1,1).toordinal()
+
+def _str(v):
+    return v.decode('ascii') if isinstance(v,(bytes,bytearray)) else v
+
+def epochSeconds(v):
+    #Converts a mysql 'YYYY-MM-DD[ HH:MM:SS[.ffffff]]' value to int epoch seconds (None for zero dates)
+    s=_str(v)
+    try:
+        days=datetime.date(int(s[0:4]),int(s[5:7]),int(s[8:10])).toordinal()-_epochOrdinal
+    except ValueError : return None #0000-00-00
+    secs=days*86400
+    if len(s)>=19 : secs+=int(s[11:13])*3600+int(s[14:16])*60+int(s[17:19])
+    return secs
+
+def _decoders(conv):
+    #Connection.converter only holds the field type (int) keys
+    return {k:v for k,v in conv.items() if isinstance(k,int)}
+
+_convCache=dict()
+def connConverters(profile):
+    #Returns a converter dict (a copy of MySQLdb.converters.conversions, with both decoders and encoders) for MySQLdb.connect(conv=)
+    if profile not in profiles : raise ValueError("Unknown conversion profile '%s', use one of %s" % (profile,profiles))
+    conv=_convCache.get(profile)
+    if conv is None :
+        conv=MySQLdb.converters.conversions.copy()
+        if profile in ('decfloat','epoch') :
+            conv[FIELD_TYPE.DECIMAL]=float
+            conv[FIELD_TYPE.NEWDECIMAL]=float
+        if profile=='epoch' :
+            for t in _datetimeTypes+(FIELD_TYPE.DATE,) : conv[t]=epochSeconds
+        if profile in ('raw','lazy') :
+            for k in [k for k in conv if isinstance(k,int)] : del conv[k]
+        _convCache[profile]=conv
+    return conv
+
+def decoders(profile):
+    #Returns the decoder part of profile's converters, for swapping into an open connection's converter attribute
+    return _decoders(connConverters(profile))
+
+
+def columnConverters(description,decFloat=True):
+    #Returns a tuple of functions (None for no conversion), 1 per column of cursor description, converting the unconverted
+    #values fetched with the 'raw'/'lazy' profiles to what the 'decfloat' (or 'default' if not decFloat) profile returns.
+    convs=[]
+    for d in description:
+        t=d[1]
+        if t in _intTypes : f=int
+        elif t in _floatTypes : f=float
+        elif t in _decTypes : f=float if decFloat else (lambda v: decimal.Decimal(_str(v)))
+        elif t in _datetimeTypes : f=lambda v: MySQLdb.times.DateTime_or_None(_str(v))
+        elif t==FIELD_TYPE.DATE : f=lambda v: MySQLdb.times.Date_or_None(_str(v))
+        elif t==FIELD_TYPE.TIME : f=lambda v: MySQLdb.times.TimeDelta_or_None(_str(v))
+        else : f=None #strings (already decoded), blobs, bits...
+        convs.append(f)
+    return tuple(convs)
+
+def convertRow(row,convs):
+    return tuple([v if (f is None or v is None) else f(v) for f,v in zip(convs,row)])
+
+def convertRows(rows,convs):
+    #Converts a list of unconverted rows with columnConverters() convs
+    if not any(convs) : return list(rows)
+    return [convertRow(row,convs) for row in rows]
+
+
+class LazyRows(object):
+    """List like container of unconverted rows.  Values are converted when accessed."""
+
+    #   rows=db.doquery(sql,form='list',convProfile='lazy')
+    #   rows[0]             converted row tuple
+    #   rows.column(2)      list of converted values of column 2 (only that column is converted)
+    #   rows.raw            the unconverted rows
+    #   list(rows)          convert everything
+
+    def __init__(self,rows,convs,header=None):
+        self.raw=rows
+        self.converters=convs
+        self.header=header
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __bool__(self):
+        return bool(self.raw)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice) : return LazyRows(self.raw[i],self.converters,self.header)
+        return convertRow(self.raw[i],self.converters)
+
+    def __iter__(self):
+        convs=self.converters
+        for row in self.raw : yield convertRow(row,convs)
+
+    def column(self,col):
+        #Returns the converted values of 1 column (index or name)
+        if not isinstance(col,int) : col=self.header.index(col)
+        f=self.converters[col]
+        if f is None : return [row[col] for row in self.raw]
+        return [None if row[col] is None else f(row[col]) for row in self.raw]
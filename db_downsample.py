@@ -0,0 +1,85 @@
+# db_downsample.py
+"""
+Downsampling of time series query results for plotting.
+
+.. package:: db_utils.db_downsample
+
+Normally used through DatabaseConn.downsample().  Rather than pulling every raw row and binning on the client, the
+query is first aggregated on the server with BldSQL.timeBucket() so only a few rows per output point come back.
+
+Methods:
+    'minmax'    the min and max value of each of points/2 time buckets, returned as 2 points per bucket (both at the bucket
+                start time, min first) so a line plot draws the full envelope of the data, spikes included.
+    'lttb'      Largest Triangle Three Buckets (Steinarsson 2013) picks the points that best keep the visual shape.  The server
+                returns the min and max of factor*points/2 fine buckets (the max placed half a bucket after the min) and lttb()
+                reduces those candidates to points on the client; transfer stays proportional to points, not to the raw row count.
+    'mean'      the mean value of each of points time buckets.
+
+Requires numpy.
+"""
+
+import math
+import numpy as np
+
+
+def lttb(x,y,n):
+    #Returns the indices of the n points of (x,y) picked by Largest Triangle Three Buckets.  x must be sorted and numeric
+    #(datetime64 can be passed as its int64 view).  The first and last points are always kept.
+    size=len(x)
+    if n>=size : return np.arange(size)
+    if n<3 : return np.array([0,size-1][:max(n,0)],dtype=np.int64)
+    x=np.asarray(x,dtype=np.float64)
+    y=np.asarray(y,dtype=np.float64)
+    edges=np.linspace(1,size-1,n-1).astype(np.int64) #n-2 buckets between the first and last points
+    out=np.empty(n,dtype=np.int64)
+    out[0]=0
+    a=0
+    for i in range(n-2):
+        lo,hi=edges[i],edges[i+1]
+        #average of the next bucket (the last point for the last bucket)
+        nlo,nhi=hi,(edges[i+2] if i+2<n-1 else size)
+        cx,cy=x[nlo:nhi].mean(),y[nlo:nhi].mean()
+        area=np.abs((x[a]-cx)*(y[lo:hi]-y[a])-(x[a]-x[lo:hi])*(cy-y[a]))
+        a=lo+int(np.argmax(area))
+        out[i+1]=a
+    out[n-1]=size-1
+    return out
+
+def minMaxPoints(bucket,vmin,vmax):
+    #Interleaves per bucket min and max arrays into 2 points per bucket (bucket time twice, min then max)
+    t=np.repeat(bucket,2)
+    v=np.empty(len(vmin)*2,dtype=np.result_type(vmin.dtype,vmax.dtype))
+    v[0::2]=vmin
+    v[1::2]=vmax
+    return t,v
+
+def bucketSeconds(db,sql,timeCol,buckets):
+    #Returns the bucket width in seconds giving about buckets buckets over the time range of sql's rows (None if there are none)
+    r=db.doquery(sql.timeRange(timeCol),form='list')
+    if not r or r[0][0] is None : return None
+    tmin,tmax=r[0]
+    span=(tmax-tmin).total_seconds() if hasattr(tmax-tmin,'total_seconds') else float(tmax-tmin)
+    return max(1,int(math.ceil(span/max(buckets,1))))
+
+def downsample(db,sql,timeCol,valueCol,points=2000,method='minmax',factor=4,seconds=None):
+    #See DatabaseConn.downsample()
+    import db_utils.bldsql as bldsql
+    if method not in ('minmax','lttb','mean') : raise ValueError("Unknown downsample method '%s', use minmax, lttb or mean" % method)
+    buckets={'minmax':points//2,'lttb':points*factor//2,'mean':points}[method]
+    if seconds is None : seconds=bucketSeconds(db,sql,timeCol,buckets)
+    if seconds is None : return None
+    t,v=bldsql.resultName(timeCol),bldsql.resultName(valueCol)
+    aggs=('mean',) if method=='mean' else ('min','max')
+    a=db.doquery(sql.timeBucket(timeCol,seconds,valueCol,aggs),form='numpy',numpyDatetime64=True)
+    if a is None : return None
+    if method=='mean' : return {t:a['bucket'],v:a[v+'_mean']}
+    x,y=minMaxPoints(a['bucket'],a[v+'_min'],a[v+'_max'])
+    if method=='lttb' :
+        #each bucket's max candidate is placed half a bucket after its min so x is increasing for the triangle areas
+        x=x.copy()
+        x[1::2]+=np.timedelta64(seconds//2,'s') if x.dtype.kind=='M' else seconds/2.
+        ok=~np.isnan(y.astype(np.float64))
+        x,y=x[ok],y[ok]
+        idx=lttb(x.view(np.int64) if x.dtype.kind=='M' else x,y,points)
+        x,y=x[idx],y[idx]
+    return {t:x,v:y}
@@ -0,0 +1,228 @@
+# db_numpy.py
+"""
+Columnar numpy fetch engine for db_conn.
+
+.. package:: db_utils.db_numpy
+
+Builds typed numpy column arrays directly from chunks of fetched rows.  Column dtypes are picked up front from the
+cursor.description type codes (instead of scanning each column for its first non-None value) and typed columns are
+filled a chunk at a time into preallocated arrays, so we never hold the full result set as python row tuples.
+
+This is imported by db_conn only when numpy output is requested, as not all environments have numpy available.
+"""
+
+import os
+import tempfile
+import zipfile
+import numpy as np
+try : from MySQLdb.constants import FIELD_TYPE,FLAG
+except ImportError : from pymysql.constants import FIELD_TYPE,FLAG #same codes, for the async (aiomysql) driver
+
+#Type code groups
+_intTypes=(FIELD_TYPE.TINY,FIELD_TYPE.SHORT,FIELD_TYPE.LONG,FIELD_TYPE.LONGLONG,FIELD_TYPE.INT24,FIELD_TYPE.YEAR)
+_floatTypes=(FIELD_TYPE.FLOAT,FIELD_TYPE.DOUBLE)
+_decTypes=(FIELD_TYPE.DECIMAL,FIELD_TYPE.NEWDECIMAL)
+_datetimeTypes=(FIELD_TYPE.DATETIME,FIELD_TYPE.TIMESTAMP)
+_dateTypes=(FIELD_TYPE.DATE,)
+
+def columnDtypes(description,flags=None,numpyFloat64=True,numpyDatetime64=False):
+    #Returns a list of numpy dtypes (1 per column) for passed cursor.description, None for columns whose type should be
+    #auto detected by numpy at the end (strings, times, blobs...).
+    #flags is cursor.description_flags, used to detect unsigned ints.
+    dtypes=[]
+    for i,d in enumerate(description):
+        t=d[1]
+        unsigned=flags is not None and (flags[i] & FLAG.UNSIGNED)
+        if t in _intTypes : dtype=np.dtype(np.uint64 if (unsigned and t==FIELD_TYPE.LONGLONG) else np.int64)
+        elif t in _floatTypes : dtype=np.dtype(np.float64)
+        elif t in _decTypes : dtype=np.dtype(np.float64) if numpyFloat64 else None
+        elif t in _datetimeTypes and numpyDatetime64 : dtype=np.dtype('datetime64[us]')
+        elif t in _dateTypes and numpyDatetime64 : dtype=np.dtype('datetime64[D]')
+        else : dtype=None
+        dtypes.append(dtype)
+    return dtypes
+
+class NumpyColumnBuilder(object):
+    """Accumulates chunks of row tuples into a dict of typed numpy column arrays"""
+
+    #Usage:
+    #   b=NumpyColumnBuilder(cursor.description,cursor.description_flags,size=cursor.rowcount)
+    #   rows=cursor.fetchmany(chunk)
+    #   while rows :
+    #       b.add(rows)
+    #       rows=cursor.fetchmany(chunk)
+    #   cols=b.result()
+    #
+    #size is the total number of rows if known (buffered cursors).  Typed columns are then preallocated and filled in place,
+    #otherwise (streaming cursors) chunk arrays are kept and concatenated at the end.
+    #nulls controls how NULLs are returned in integer columns; 'nan' (default) converts the column to float64 with NaN for nulls,
+    #'mask' returns a numpy masked array.  Float columns always use NaN and datetime64 columns NaT.
+
+    def __init__(self,description,flags=None,numpyFloat64=True,numpyDatetime64=False,nulls='nan',size=None):
+        self.keys=[d[0] for d in description]
+        self.dtypes=columnDtypes(description,flags,numpyFloat64,numpyDatetime64)
+        self.nulls=nulls
+        self.size=size if size is not None and size>=0 else None
+        self.n=0
+        self._masks=[None]*len(self.keys) #null masks for int columns, allocated on first null
+        if self.size is not None : self._cols=[np.empty(self.size,dtype=dtype) if dtype is not None else [] for dtype in self.dtypes]
+        else : self._cols=[[] for dtype in self.dtypes]
+
+    def add(self,rows):
+        #Add a chunk (list) of row tuples
+        k=len(rows)
+        if not k : return
+        i=self.n
+        for j,col in enumerate(zip(*rows)):
+            dtype=self.dtypes[j]
+            if dtype is None : #auto detected at the end
+                self._cols[j].extend(col)
+                continue
+            arr,mask=self._typedChunk(col,dtype,k)
+            if self.size is not None :
+                self._cols[j][i:i+k]=arr
+                if mask is not None :
+                    if self._masks[j] is None : self._masks[j]=np.zeros(self.size,dtype=bool)
+                    self._masks[j][i:i+k]=mask
+            else :
+                self._cols[j].append(arr)
+                if mask is not None : #keep (offset,mask) pairs and assemble at the end
+                    if self._masks[j] is None : self._masks[j]=[]
+                    self._masks[j].append((i,mask))
+        self.n+=k
+
+    def chunkArrays(self,rows):
+        #Returns a list of arrays (1 per column) for just this chunk of rows, without accumulating them.  Used by the streaming file writers.
+        #Int columns with nulls in this chunk are returned as float64 with NaN, auto columns as numpy picks them.
+        k=len(rows)
+        out=[]
+        for j,col in enumerate(zip(*rows)):
+            dtype=self.dtypes[j]
+            if dtype is None : out.append(np.asarray(col))
+            else :
+                arr,mask=self._typedChunk(col,dtype,k)
+                if mask is not None :
+                    arr=arr.astype(np.float64)
+                    arr[mask]=np.nan
+                out.append(arr)
+        return out
+
+    def _typedChunk(self,col,dtype,k):
+        #Returns (array,mask) for a column chunk.  mask is None if there are no nulls in an int column (others handle nulls natively)
+        if dtype.kind in 'iu' :
+            try : return np.fromiter(col,dtype,count=k),None
+            except TypeError: #nulls in an int column
+                mask=np.fromiter((v is None for v in col),bool,count=k)
+                return np.fromiter((0 if v is None else v for v in col),dtype,count=k),mask
+        return np.array(col,dtype=dtype),None
+
+    def result(self):
+        #Returns the dict of column arrays (col names as keys)
+        b=dict()
+        for j,key in enumerate(self.keys):
+            dtype=self.dtypes[j]
+            col=self._cols[j]
+            if dtype is None : arr=np.asarray(col)
+            else :
+                if self.size is not None : arr=col[:self.n]
+                else : arr=np.concatenate(col) if col else np.empty(0,dtype=dtype)
+                mask=self._masks[j]
+                if mask is not None :
+                    if self.size is not None : mask=mask[:self.n]
+                    else :
+                        m=np.zeros(self.n,dtype=bool)
+                        for i,chunkMask in mask : m[i:i+len(chunkMask)]=chunkMask
+                        mask=m
+                    if self.nulls=='mask' : arr=np.ma.masked_array(arr,mask=mask)
+                    else :
+                        arr=arr.astype(np.float64)
+                        arr[mask]=np.nan
+            b[key]=arr
+        return b
+
+def rowsToNumpy(rows,description,flags=None,numpyFloat64=True,numpyDatetime64=False,nulls='nan',chunk=100000):
+    #Returns a dict of numpy column arrays from an already fetched list of row tuples (None if no rows), converting a chunk at a time.
+    if not rows : return None
+    b=NumpyColumnBuilder(description,flags,numpyFloat64,numpyDatetime64,nulls,len(rows))
+    for i in range(0,len(rows),chunk) : b.add(rows[i:i+chunk])
+    return b.result()
+
+def cursorToNumpy(cursor,numpyFloat64=True,numpyDatetime64=False,nulls='nan',chunk=100000,size=None):
+    #Fetches the remaining rows of cursor into a dict of numpy column arrays.  Returns None if there are no rows.
+    #Pass size (the row count) for buffered cursors so columns can be preallocated.
+    flags=getattr(cursor,'description_flags',None)
+    b=NumpyColumnBuilder(cursor.description,flags,numpyFloat64,numpyDatetime64,nulls,size)
+    rows=cursor.fetchmany(chunk)
+    while rows :
+        b.add(rows)
+        rows=cursor.fetchmany(chunk)
+    if b.n==0 : return None
+    return b.result()
+
+def _fileSafe(arr):
+    #Returns arr as a non object dtype so it can be written to a .npy file without pickling (and so be memory mapped by readers).
+    #Object arrays (string cols with NULLs, times, sets...) are converted to str (or bytes if the values are bytes) with '' for NULL
+    if arr.dtype!=object : return arr
+    vals=[v for v in arr if v is not None]
+    if vals and all(isinstance(v,bytes) for v in vals) : return np.array([b'' if v is None else v for v in arr],dtype=bytes)
+    return np.array(['' if v is None else str(v) for v in arr],dtype=str)
+
+class _NpySpool(object):
+    #Spools the chunk arrays for one column to a temp file so the final .npy can be written once the total length and a common dtype
+    #(eg; int chunks promoted to float64 if a later chunk had NULLs, widest string width) are known.
+    def __init__(self,dir=None,dtype=None):
+        self._f=tempfile.TemporaryFile(dir=dir)
+        self.dtype=dtype if dtype is not None else np.dtype(str) #used if there are no rows
+        self.dtypes=[]
+        self.n=0
+
+    def add(self,arr):
+        np.save(self._f,arr,allow_pickle=False)
+        self.dtypes.append(arr.dtype)
+        self.n+=len(arr)
+
+    def write(self,fp):
+        #Writes spooled chunks as a single .npy array to open binary file handle fp
+        dtype=np.result_type(*self.dtypes) if self.dtypes else self.dtype
+        np.lib.format.write_array_header_1_0(fp,{'descr':np.lib.format.dtype_to_descr(dtype),'fortran_order':False,'shape':(self.n,)})
+        self._f.seek(0)
+        for i in range(len(self.dtypes)):
+            fp.write(np.load(self._f,allow_pickle=False).astype(dtype,copy=False).tobytes())
+
+    def close(self):
+        self._f.close()
+
+def cursorToNpy(cursor,outfile,form='npz',chunk=100000,numpyFloat64=True,numpyDatetime64=True,timerName=None):
+    #Writes the remaining rows of cursor as per column .npy arrays, reading a chunk of rows at a time.
+    #  form='npy'; outfile is a directory (created if needed) with 1 <col name>.npy file per column.
+    #       Readers can memory map columns with np.load(outfile+'/col.npy',mmap_mode='r')
+    #  form='npz'; outfile is a np.savez() compatible zip of the same per column .npy members.  Load with np.load(outfile)['col'].
+    #       Members are stored uncompressed so readers can also memory map them at their offset in the file.
+    #Datetime cols are written as datetime64 (numpyDatetime64) and string cols as fixed width unicode so no pickling is needed.
+    #Returns the number of rows written.
+    flags=getattr(cursor,'description_flags',None)
+    b=NumpyColumnBuilder(cursor.description,flags,numpyFloat64,numpyDatetime64)
+    names=[k.replace('/','_') for k in b.keys]
+    tmpdir=outfile if form=='npy' else os.path.dirname(os.path.abspath(outfile))
+    if form=='npy' and not os.path.isdir(outfile) : os.makedirs(outfile)
+
+    spools=[_NpySpool(tmpdir,dtype) for dtype in b.dtypes]
+    try:
+        n=0
+        rows=cursor.fetchmany(chunk)
+        while rows :
+            if timerName : print("Timer:%s writing rows %s to %s"%(timerName,n,n+len(rows)-1))
+            for spool,arr in zip(spools,b.chunkArrays(rows)): spool.add(_fileSafe(arr))
+            n+=len(rows)
+            rows=cursor.fetchmany(chunk)
+
+        if form=='npy' :
+            for name,spool in zip(names,spools):
+                with open(os.path.join(outfile,name+'.npy'),'wb') as fp : spool.write(fp)
+        else :
+            with zipfile.ZipFile(outfile,'w',compression=zipfile.ZIP_STORED,allowZip64=True) as zf:
+                for name,spool in zip(names,spools):
+                    with zf.open(name+'.npy','w',force_zip64=True) as fp : spool.write(fp)
+    finally:
+        for spool in spools : spool.close()
+    return n
@@ -0,0 +1,93 @@
+# db_paging.py
+"""
+Keyset (seek) pagination for db_conn.
+
+.. package:: db_utils.db_paging
+
+Normally used through DatabaseConn.page() and DatabaseConn.pages().  A page is selected with BldSQL.seek() (rows after the
+last key of the previous page, ordered by the key) and limit(pageSize), so page 10,000 costs the same as page 1, unlike
+'limit offset,n' where the server reads and discards offset rows.
+
+The position is returned to callers as an opaque continuation token (url safe base64 json of the last row's key values),
+suitable for passing through a web api.
+
+Example:
+    sql=bldsql.BldSQL()
+    sql.table("flask_data");sql.col("num");sql.col("value")
+    sql.where("site_num=%s",75)
+    rows,token=db.page(sql,'num',1000)
+    while token :
+        rows,token=db.page(sql,'num',1000,token)
+"""
+
+import json
+import copy
+import base64
+import decimal
+import datetime
+
+
+def _encodeValue(v):
+    if isinstance(v,datetime.datetime) : return {'dt':v.isoformat()}
+    if isinstance(v,datetime.date) : return {'d':v.isoformat()}
+    if isinstance(v,decimal.Decimal) : return {'dec':str(v)}
+    if isinstance(v,(bytes,bytearray)) : return {'b':base64.b64encode(bytes(v)).decode('ascii')}
+    if hasattr(v,'item') : return _encodeValue(v.item()) #numpy scalar
+    return v
+
+def _decodeValue(v):
+    if isinstance(v,dict) :
+        if 'dt' in v : return datetime.datetime.fromisoformat(v['dt'])
+        if 'd' in v : return datetime.date.fromisoformat(v['d'])
+        if 'dec' in v : return decimal.Decimal(v['dec'])
+        if 'b' in v : return base64.b64decode(v['b'])
+    return v
+
+def encodeToken(keys,values):
+    #Returns the continuation token for key values (the last row of a page)
+    s=json.dumps({'k':list(keys),'v':[_encodeValue(v) for v in values]},separators=(',',':'))
+    return base64.urlsafe_b64encode(s.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decodeToken(token,keys):
+    #Returns the tuple of key values from token.  Raises ValueError if it's malformed or was made for different keys.
+    try:
+        d=json.loads(base64.urlsafe_b64decode(token+'='*(-len(token)%4)).decode('utf-8'))
+        tokenKeys,values=d['k'],d['v']
+    except (ValueError,TypeError,KeyError) as e:
+        raise ValueError("Invalid page token: %s" % e)
+    if tokenKeys!=list(keys) : raise ValueError("Page token is for keys %s, not %s" % (tokenKeys,list(keys)))
+    return tuple(_decodeValue(v) for v in values)
+
+def keyColumns(keys):
+    #Result column names for key expressions ('d.num' -> 'num'), see bldsql.resultName()
+    import db_utils.bldsql as bldsql
+    return [bldsql.resultName(k) for k in keys]
+
+def lastKey(rows,form,header,keys):
+    #Returns the key values of the last row of a page of doquery results
+    cols=keyColumns(keys)
+    if form=='numpy' : return tuple(rows[c][-1] for c in cols)
+    row=rows[-1]
+    if form in ('dict','record','resultset') : return tuple(row[c] for c in cols)
+    return tuple(row[header.index(c)] for c in cols)
+
+def page(db,sql,keys,pageSize,token=None,form='dict',descending=False,**kwargs):
+    #See DatabaseConn.page()
+    if form not in ('dict','record','resultset','list','numpy') : raise ValueError("form '%s' is not supported for paging" % form)
+    if isinstance(keys,str) : keys=[keys]
+    s=copy.deepcopy(sql)
+    s.seek(keys,decodeToken(token,keys) if token else None,descending)
+    s.limit(pageSize)
+    #list pages are fetched as records so the key columns can be found by name (db._c is stale after a cache hit or replica read)
+    rows=db.doquery(s,form='record' if form=='list' else form,**kwargs)
+    n=(len(next(iter(rows.values()))) if form=='numpy' else len(rows)) if rows else 0
+    token=encodeToken(keys,lastKey(rows,'record' if form=='list' else form,None,keys)) if n>=pageSize else None
+    if form=='list' and rows : rows=[tuple(r) for r in rows]
+    return rows,token
+
+def pages(db,sql,keys,pageSize,token=None,form='dict',descending=False,**kwargs):
+    #See DatabaseConn.pages()
+    while True:
+        rows,token=page(db,sql,keys,pageSize,token,form,descending,**kwargs)
+        if rows : yield rows,token
+        if not token : return
@@ -0,0 +1,144 @@
+# db_parallel.py
+"""
+Parallel partitioned query execution for db_conn.
+
+.. package:: db_utils.db_parallel
+
+Splits a BldSQL query into partitions by adding where clauses on a partition key, runs the partitions concurrently
+on their own connections (thread or process pool) and merges the results.  Normally called through
+DatabaseConn.parallelQuery().
+
+Partitions are either (lo,hi) ranges, giving "key>=lo and key<hi", or lists of values, giving "key in (...)".
+"""
+
+import os
+import copy
+import math
+import datetime
+import shutil
+import tempfile
+import concurrent.futures
+
+import db_utils.db_conn as db_conn
+import db_utils.db_pool as db_pool
+import db_utils.db_compress as db_compress
+
+
+def numRanges(lo,hi,n):
+    #Returns n (lo,hi) int ranges covering lo to hi inclusive.  eg; numRanges(1,100,4) -> [(1,26),(26,51),(51,76),(76,101)]
+    step=max(1,-(-(hi-lo+1)//n))
+    return [(i,min(i+step,hi+1)) for i in range(lo,hi+1,step)]
+
+def dateRanges(start,end,n=None,step=None):
+    #Returns (lo,hi) datetime ranges covering start up to (not including) end, either n equal ranges or ranges of timedelta step.
+    #dates can be datetime/date objects.  eg; dateRanges(datetime.date(2000,1,1),datetime.date(2020,1,1),step=datetime.timedelta(days=365))
+    #With date objects the step is rounded up to whole days (adding part of a day to a date doesn't change it), so asking for
+    #more ranges than there are days gives 1 day ranges.
+    if step is None : step=(end-start)/n
+    if isinstance(start,datetime.date) and not isinstance(start,datetime.datetime) :
+        step=datetime.timedelta(days=max(1,math.ceil(step/datetime.timedelta(days=1))))
+    if not start+step>start : raise ValueError("dateRanges step must be positive (got %s)" % (step,))
+    ranges=[]
+    lo=start
+    while lo<end :
+        hi=min(lo+step,end)
+        ranges.append((lo,hi))
+        lo=hi
+    return ranges
+
+def valueChunks(values,n):
+    #Returns values split into n (nearly) equal lists, for 'key in (...)' partitions
+    values=list(values)
+    size=max(1,-(-len(values)//n))
+    return [values[i:i+size] for i in range(0,len(values),size)]
+
+def partitionQueries(sql,key,partitions):
+    #Returns a list of (query,parameters), 1 per partition, from BldSQL object sql (which isn't modified).
+    #Value partitions are always inline in lists.  If sql has wherein() lists that need doquery (temptable or chunk strategy),
+    #the query is the partition's BldSQL object (parameters None) so the worker's doquery loads the temp tables.
+    out=[]
+    for p in partitions:
+        s=copy.deepcopy(sql)
+        if isinstance(p,tuple) and len(p)==2 :
+            s.where(key+">=%s",p[0])
+            s.where(key+"<%s",p[1])
+        else : s.wherein(key+" in",p,strategy='inline')
+        if s.whereinTables() or s.whereinChunks() : out.append((s,None))
+        else : out.append((s.cmd(),s.bind()))
+    return out
+
+
+#Connection pools for worker processes (1 per process, created on first use)
+_processPool=None
+
+def _runPartition(connArgs,query,parameters,form,outfile,pool,kwargs):
+    #Runs 1 partition on its own connection, returns the doquery result
+    global _processPool
+    if pool is None :
+        if _processPool is None : _processPool=db_pool.ConnectionPool(maxSize=1)
+        pool=_processPool
+    db=db_conn.DatabaseConn(pool=pool,**connArgs)
+    try:
+        return db.doquery(query,parameters,form=form,outfile=outfile,**kwargs)
+    finally:
+        db.close()
+
+def mergeResults(results,form):
+    #Merge a list of partition (or chunk) doquery results
+    results=[r for r in results if r]
+    if not results : return None
+    if form=='numpy' :
+        import numpy as np
+        return {k:np.concatenate([r[k] for r in results]) for k in results[0].keys()}
+    out=[]
+    for r in results : out.extend(r)
+    return out
+
+def _concatFiles(outfile,partFiles,compression=None,compressThreads=1):
+    #Concatenate (plain) csv partition files into outfile, keeping only the first header line.  outfile is compressed per db_compress.
+    with db_compress.openBinary(outfile,compression,threads=compressThreads) as out:
+        first=True
+        for fn in partFiles:
+            if not os.path.exists(fn) : continue #partition had no rows
+            with open(fn,'rb') as f:
+                header=f.readline()
+                if first : out.write(header)
+                first=False
+                shutil.copyfileobj(f,out)
+
+def parallelQuery(connArgs,sql,key,partitions,form='numpy',concurrency=4,ordered=True,outfile=None,processes=False,pool=None,**kwargs):
+    #See DatabaseConn.parallelQuery()
+    fileForms=('csv','tsv','excel','csv-nq')
+    if form not in ('numpy','list','dict','record')+fileForms : raise ValueError("form '%s' is not supported by parallelQuery" % form)
+    if form in fileForms and outfile is None : raise ValueError("outfile is required for file output")
+
+    compression=kwargs.pop('compression',None) #partitions are written plain, only the merged file is compressed
+    compressThreads=kwargs.pop('compressThreads',1)
+    queries=partitionQueries(sql,key,partitions)
+    tmpdir=tempfile.mkdtemp(prefix='db_parallel_',dir=os.path.dirname(os.path.abspath(outfile))) if form in fileForms else None
+    partFiles=[os.path.join(tmpdir,'part%s' % i) if tmpdir else None for i in range(len(queries))]
+
+    ownPool=None
+    if processes :
+        executor=concurrent.futures.ProcessPoolExecutor(max_workers=concurrency)
+        pool=None #each process makes its own
+    else :
+        executor=concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        if pool is None : pool=ownPool=db_pool.ConnectionPool(maxSize=concurrency)
+    try:
+        futures=[executor.submit(_runPartition,connArgs,q,p,form,partFiles[i],pool,kwargs) for i,(q,p) in enumerate(queries)]
+        if ordered : results=[f.result() for f in futures]
+        else :
+            done=[]
+            for f in concurrent.futures.as_completed(futures) : done.append((f.result(),futures.index(f)))
+            results=[r for r,i in done]
+            partFiles=[partFiles[i] for r,i in done]
+
+        if form in fileForms :
+            _concatFiles(outfile,partFiles,compression,compressThreads)
+            return True
+        return mergeResults(results,form)
+    finally:
+        executor.shutdown(wait=True)
+        if ownPool : ownPool.closeAll()
+        if tmpdir : shutil.rmtree(tmpdir,ignore_errors=True)
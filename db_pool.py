@@ -0,0 +1,189 @@
+# db_pool.py
+"""
+Connection pool for db_conn.
+
+.. package:: db_utils.db_pool
+
+Keeps open MySQLdb connections around so that DatabaseConn instances (RO(), ProdDB()...) can reuse them instead of paying
+for a new connect (tcp + auth handshake) every time.  Connections are pooled by (host, user, db, converter settings).
+
+Example:
+    import db_utils.db_conn as db_conn
+    db=db_conn.RO(pool=True) #draw from the shared default pool (db_pool.defaultPool())
+    a=db.doquery("select count(*) from flask_event",numRows=0)
+    db.close() #returns the connection to the pool (also done when db is garbage collected)
+
+    or with your own pool:
+    pool=db_pool.ConnectionPool(maxSize=10,idleTimeout=60)
+    with db_conn.RO(pool=pool) as db:
+        ...
+    print(pool.stats())
+
+"""
+
+import time
+import threading
+import collections
+import MySQLdb
+
+import db_utils.db_prepared as db_prepared
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within the pool's waitTimeout"""
+    pass
+
+class ConnectionPool(object):
+    """Thread safe pool of MySQLdb connections shared across DatabaseConn instances"""
+
+    #  -maxSize is the max number of connections (in use + idle) per key.  When all are in use, checkout() waits for one to be returned.
+    #  -idleTimeout (seconds); idle connections older than this are closed instead of reused.  None to keep forever.
+    #  -waitTimeout (seconds); max time checkout() waits for a free connection before raising PoolTimeout.  None to wait forever.
+    #  -resetSession; If true, returned connections are reset with change_user(), which drops temp tables, user variables and
+    #   session settings so the next user gets a clean session.  This costs a round trip on checkin.  If false, we only rollback
+    #   and turn autocommit back on.
+    #  -ping; If true, connections are pinged on checkout and transparently replaced if the server has gone away.
+
+    def __init__(self,maxSize=5,idleTimeout=300,waitTimeout=None,resetSession=True,ping=True):
+        self.maxSize=maxSize
+        self.idleTimeout=idleTimeout
+        self.waitTimeout=waitTimeout
+        self.resetSession=resetSession
+        self.ping=ping
+
+        self._cond=threading.Condition()
+        self._idle=collections.defaultdict(collections.deque) #key -> deque of (conn,time returned)
+        self._inUse=collections.defaultdict(int) #key -> number of checked out conns
+        self._conns=dict() #id(conn) -> (key,connect args) for checked out conns
+        self._closed=False
+        self._counters=dict(hits=0,misses=0,waits=0,waitTime=0.,reconnects=0,resets=0,discarded=0,timeouts=0)
+
+    def checkout(self,host,user,password,db,conv=None,convKey=None,**connectArgs):
+        #Returns an open connection for passed connection args, reusing an idle one if available.
+        #convKey identifies the converter settings (conv dicts aren't hashable), eg the DatabaseConn conversion profile name.
+        #Any other MySQLdb.connect() args (local_infile...) are passed through and are part of the pool key.
+        key=(host,user,db,convKey)+tuple(sorted(connectArgs.items()))
+        args=dict(host=host,user=user,passwd=password,db=db,**connectArgs)
+        if conv is not None : args['conv']=conv
+
+        conn=None
+        with self._cond:
+            waitStart=None
+            while True:
+                conn=self._popIdle(key)
+                if conn is not None :
+                    self._counters['hits']+=1
+                    break
+                if self._inUse[key]+len(self._idle[key])<self.maxSize :
+                    self._counters['misses']+=1
+                    break #room to make a new one (below, outside the lock)
+                #Pool for this key is full, wait for a checkin.
+                if waitStart is None :
+                    waitStart=time.time()
+                    self._counters['waits']+=1
+                remaining=None if self.waitTimeout is None else self.waitTimeout-(time.time()-waitStart)
+                if remaining is not None and remaining<=0 :
+                    self._counters['timeouts']+=1
+                    self._counters['waitTime']+=time.time()-waitStart
+                    raise PoolTimeout("No connection available for %s@%s/%s after %s seconds" % (user,host,db,self.waitTimeout))
+                self._cond.wait(remaining)
+            if waitStart is not None : self._counters['waitTime']+=time.time()-waitStart
+            self._inUse[key]+=1 #reserve the slot
+
+        try:
+            if conn is not None and self.ping :
+                try : conn.ping()
+                except Exception :
+                    self._close(conn)
+                    conn=None
+                    with self._cond : self._counters['reconnects']+=1
+            if conn is None : conn=MySQLdb.connect(**args)
+        except Exception :
+            with self._cond:
+                self._inUse[key]-=1
+                self._cond.notify()
+            raise
+
+        with self._cond : self._conns[id(conn)]=(key,args)
+        return conn
+
+    def checkin(self,conn):
+        #Return a connection to the pool.  The session is reset so it can be handed to the next caller.
+        with self._cond:
+            key,args=self._conns.pop(id(conn))
+        ok=not self._closed
+        try:
+            conn.rollback() #anything left uncommitted
+            conn.autocommit(True)
+            if self.resetSession : #drops temp tables, user vars, prepared statements...
+                conn.change_user(args['user'],args['passwd'],args['db'])
+                db_prepared.forget(conn)
+        except Exception :
+            ok=False
+
+        with self._cond:
+            ok=ok and not self._closed
+            self._inUse[key]-=1
+            if ok :
+                self._idle[key].append((conn,time.time()))
+                if self.resetSession : self._counters['resets']+=1
+            else :
+                self._counters['discarded']+=1
+            self._cond.notify()
+        if not ok : self._close(conn)
+
+    def _popIdle(self,key):
+        #Returns the most recently returned idle conn for key (closing any that have timed out), or None.  Caller holds the lock.
+        idle=self._idle[key]
+        now=time.time()
+        while idle :
+            conn,returned=idle.pop()
+            if self.idleTimeout is None or now-returned<=self.idleTimeout : return conn
+            self._counters['discarded']+=1
+            self._close(conn)
+        return None
+
+    def _close(self,conn):
+        try : conn.close()
+        except Exception : pass
+
+    def prune(self):
+        #Close any idle connections that have passed the idleTimeout
+        with self._cond:
+            now=time.time()
+            for key,idle in self._idle.items():
+                keep=collections.deque()
+                for conn,returned in idle:
+                    if self.idleTimeout is not None and now-returned>self.idleTimeout :
+                        self._counters['discarded']+=1
+                        self._close(conn)
+                    else : keep.append((conn,returned))
+                self._idle[key]=keep
+
+    def closeAll(self):
+        #Close all idle connections.  Checked out connections are closed when they are checked back in.
+        with self._cond:
+            for key,idle in self._idle.items():
+                for conn,returned in idle : self._close(conn)
+            self._idle.clear()
+            self._closed=True #Anything returned after this gets closed
+
+    def stats(self):
+        #Returns a dict of pool counters:
+        #   hits, misses (new connections), waits (checkouts that had to wait), waitTime (total seconds waited), timeouts,
+        #   reconnects (dead idle conns replaced), resets, discarded, idle and inUse (current counts)
+        with self._cond:
+            s=dict(self._counters)
+            s['idle']=sum(len(v) for v in self._idle.values())
+            s['inUse']=sum(self._inUse.values())
+        return s
+
+
+_defaultPool=None
+_defaultPoolLock=threading.Lock()
+def defaultPool():
+    #Returns the process wide shared pool, used by DatabaseConn(pool=True), RO(pool=True)...
+    global _defaultPool
+    with _defaultPoolLock:
+        if _defaultPool is None : _defaultPool=ConnectionPool()
+    return _defaultPool
@@ -0,0 +1,141 @@
+# db_prepared.py
+"""
+Server side prepared statements for db_conn.
+
+.. package:: db_utils.db_prepared
+
+Normally used through DatabaseConn.doquery(...,prepared=True).  Each connection keeps a cache of statements it has
+prepared, keyed on the sql text, so a query run in a loop is parsed by the server once per connection instead of on
+every call.
+
+MySQLdb (mysqlclient) doesn't implement the binary prepared statement protocol, so statements are prepared with sql
+PREPARE and run with sql EXECUTE.  Bind values are escaped client side:
+    MariaDB (10.2+) takes them as literals; "execute stmt using 1,'MLO'" so only the short execute is parsed per call.
+    MySQL only takes user variables; "set @_dbc_p0=..,@_dbc_p1=..; execute stmt using @_dbc_p0,@_dbc_p1" in 1 round trip,
+        so a short set is parsed too.
+This only pays off when parsing/optimizing the full statement costs more than the execute (and set), eg; long queries
+over views run many times.  Measure with bench.py -c lookup-text,lookup-prepared against your server.
+
+Statements are per connection (and dropped when a pooled connection's session is reset).  At most maxStatements are
+kept per connection; the least recently used are deallocated beyond that (the server's max_prepared_stmt_count is global).
+DatabaseConn.close() calls release() to deallocate them and clear the @_dbc_p variables before the connection is closed
+or returned to its pool.
+"""
+
+import re
+import weakref
+import threading
+import collections
+import MySQLdb
+
+maxStatements=100
+ER_UNKNOWN_STMT_HANDLER=1243
+
+_caches=weakref.WeakKeyDictionary() #MySQLdb connection -> StatementCache
+_cachesLock=threading.Lock()
+
+_placeholders=re.compile(r"%(.)",re.S)
+
+def toQmark(query):
+    #Returns query with MySQLdb %s placeholders converted to ? (and %% to %) for PREPARE
+    def sub(m):
+        if m.group(1)=='s' : return '?'
+        if m.group(1)=='%' : return '%'
+        raise ValueError("Unsupported placeholder '%%%s' in prepared query (only %%s is supported)" % m.group(1))
+    return _placeholders.sub(sub,query)
+
+
+class StatementCache(object):
+    """LRU of the statements prepared on 1 connection"""
+
+    def __init__(self,maxStatements=maxStatements):
+        self.maxStatements=maxStatements
+        self._stmts=collections.OrderedDict() #sql -> statement name
+        self._n=0
+        self.literalUsing=None #server takes literals in execute ... using (MariaDB), set on first use
+        self.maxParams=0 #most @_dbc_p variables set
+
+    def prepare(self,cursor,sql):
+        #Returns the statement name for sql, preparing it on cursor's connection if needed
+        name=self._stmts.get(sql)
+        if name is not None :
+            self._stmts.move_to_end(sql)
+            return name
+        self._n+=1
+        name="_dbc_s%d" % self._n
+        cursor.execute("prepare %s from %%s" % name,(sql,))
+        self._stmts[sql]=name
+        while len(self._stmts)>self.maxStatements :
+            old,oldName=self._stmts.popitem(last=False)
+            cursor.execute("deallocate prepare "+oldName)
+        return name
+
+    def forget(self,sql=None):
+        #Drop sql (or all statements) from the cache, for when the server has lost them (session reset, reconnect)
+        if sql is None : self._stmts.clear()
+        else : self._stmts.pop(sql,None)
+
+    def __len__(self):
+        return len(self._stmts)
+
+
+def statementCache(conn):
+    #Returns the StatementCache for MySQLdb connection conn
+    with _cachesLock:
+        cache=_caches.get(conn)
+        if cache is None : cache=_caches[conn]=StatementCache()
+    return cache
+
+def _literalUsing(conn):
+    #True if the server accepts literals (not just user variables) in execute ... using; MariaDB 10.2 and later
+    info=conn.get_server_info()
+    if isinstance(info,bytes) : info=info.decode()
+    m=re.search(r"(\d+)\.(\d+)\.\d+-mariadb",info,re.I) #(some versions report '5.5.5-10.x.y-MariaDB')
+    return m is not None and (int(m.group(1)),int(m.group(2)))>=(10,2)
+
+def release(conn):
+    #Deallocate the statements prepared on conn and clear the bind variables (before conn is closed or returned to a pool)
+    with _cachesLock:
+        cache=_caches.pop(conn,None)
+    if cache is None : return
+    stmts=["deallocate prepare "+name for name in cache._stmts.values()]
+    if cache.maxParams : stmts.append("set "+",".join("@_dbc_p%d=null" % i for i in range(cache.maxParams)))
+    if not stmts : return
+    c=conn.cursor()
+    try:
+        c.execute("; ".join(stmts))
+        while c.nextset() : pass
+    except MySQLdb.MySQLError : pass #connection already lost, and the statements with it
+    finally:
+        c.close()
+
+def forget(conn):
+    #Forget all statements prepared on conn (call after change_user/reconnect)
+    with _cachesLock:
+        cache=_caches.get(conn)
+    if cache is not None : cache.forget()
+
+def execute(conn,cursor,query,parameters=None):
+    #Run query (with %s placeholders) with parameters as a prepared statement on cursor.  Afterwards cursor is positioned on the
+    #statement's result, as if cursor.execute(query,parameters) had been called.
+    if isinstance(parameters,dict) : raise ValueError("prepared queries take a sequence of bind parameters, not a dict")
+    params=list(parameters) if parameters is not None else []
+    sql=toQmark(query) if params else query
+    cache=statementCache(conn)
+    if cache.literalUsing is None : cache.literalUsing=_literalUsing(conn)
+    for attempt in (1,2):
+        name=cache.prepare(cursor,sql)
+        try:
+            if params and cache.literalUsing : cursor.execute("execute %s using %s" % (name,",".join(["%s"]*len(params))),params)
+            elif params :
+                cache.maxParams=max(cache.maxParams,len(params))
+                setVars=",".join("@_dbc_p%d=%%s" % i for i in range(len(params)))
+                useVars=",".join("@_dbc_p%d" % i for i in range(len(params)))
+                cursor.execute("set %s; execute %s using %s" % (setVars,name,useVars),params)
+                cursor.nextset() #skip the set's (empty) result to the execute's
+            else : cursor.execute("execute "+name)
+            return
+        except MySQLdb.MySQLError as e:
+            #Statement was lost by the server (session reset/reconnect), prepare again
+            if attempt==2 or not e.args or e.args[0]!=ER_UNKNOWN_STMT_HANDLER : raise
+            cache.forget(sql)
@@ -0,0 +1,182 @@
+# db_records.py
+"""
+Compact row containers for db_conn.
+
+.. package:: db_utils.db_records
+
+form='dict' builds a dict per row, each repeating the column names, which makes it the most memory hungry form on large
+selects.  These are lighter alternatives that still support row['col'] access:
+
+    'record'; a list of Record rows.  Record types are tuple subclasses (no per row __dict__) made once per column list and
+        shared by all rows, with a name->index map on the class.  A row takes the memory of a plain tuple.
+            row['value'], row.value, row[2], row.get('flag'), row.keys(), row.items(), dict(row.items()), row.asDict()
+        'col' in row tests the column names (as for a dict).  Columns named count or index are returned by row.count and
+        row.index (replacing the tuple methods).  Columns named like the other methods (get, keys, values, items, asDict) or
+        starting with _ are only available as row['col'].
+    'resultset'; a ResultSet holding the results as columns (1 list per column, no per row objects at all).  Rows are
+        handed out as views when accessed.
+            rs=db.doquery(sql,form='resultset')
+            for row in rs : print(row['num'],row['value'])  #row views are made on the fly
+            rs[10]['value'], rs.column('value'), len(rs), rs.toNumpy()
+"""
+
+import sys
+import operator
+import threading
+
+
+class Record(tuple):
+    """Row tuple with access by column name.  Subclassed per column list by recordType()."""
+    __slots__=()
+    _fields=()
+    _index={}
+
+    def __getitem__(self,key):
+        if isinstance(key,str) : return tuple.__getitem__(self,self._index[key])
+        return tuple.__getitem__(self,key)
+
+    def __getattr__(self,name):
+        try : return tuple.__getitem__(self,self._index[name])
+        except KeyError : raise AttributeError(name)
+
+    def __contains__(self,key):
+        return key in self._index
+
+    def get(self,key,default=None):
+        i=self._index.get(key)
+        return default if i is None else tuple.__getitem__(self,i)
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return list(zip(self._fields,self))
+
+    def asDict(self):
+        return dict(zip(self._fields,self))
+
+    def __repr__(self):
+        return "Record(%s)" % ", ".join("%s=%r" % kv for kv in zip(self._fields,self))
+
+    def __reduce__(self):
+        return (_makeRecord,(self._fields,tuple(self)))
+
+
+_types=dict()
+_typesLock=threading.Lock()
+
+def recordType(header):
+    #Returns the Record subclass for column names header (made once per distinct header and reused)
+    fields=tuple(header)
+    with _typesLock:
+        cls=_types.get(fields)
+        if cls is None :
+            attrs=dict(__slots__=(),_fields=fields,_index={name:i for i,name in enumerate(fields)})
+            for name in ('count','index'): #columns replace the tuple methods, which __getattr__ never sees
+                if name in attrs['_index'] : attrs[name]=property(operator.itemgetter(attrs['_index'][name]))
+            cls=type('Record',(Record,),attrs)
+            _types[fields]=cls
+    return cls
+
+def _makeRecord(fields,values):
+    return recordType(fields)(values)
+
+def toRecords(rows,header):
+    #Returns list of Records from a list of row tuples
+    return list(map(recordType(header),rows))
+
+
+class RowView(object):
+    """1 row of a ResultSet"""
+    __slots__=('_rs','_i')
+
+    def __init__(self,rs,i):
+        self._rs=rs
+        self._i=i
+
+    def __getitem__(self,key):
+        if isinstance(key,str) : key=self._rs._index[key]
+        return self._rs._cols[key][self._i]
+
+    def __contains__(self,key):
+        return key in self._rs._index
+
+    def get(self,key,default=None):
+        i=self._rs._index.get(key)
+        return default if i is None else self._rs._cols[i][self._i]
+
+    def keys(self):
+        return self._rs.header
+
+    def values(self):
+        return tuple(col[self._i] for col in self._rs._cols)
+
+    def items(self):
+        return list(zip(self._rs.header,self.values()))
+
+    def asDict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return "RowView(%s)" % ", ".join("%s=%r" % kv for kv in self.items())
+
+
+class ResultSet(object):
+    """Columnar query result.  Rows are views made on access."""
+
+    def __init__(self,header,cols):
+        #cols is a list of column sequences (lists, tuples or numpy arrays) in header order
+        self.header=tuple(header)
+        self._index={name:i for i,name in enumerate(self.header)}
+        self._cols=list(cols)
+        self._n=len(self._cols[0]) if self._cols else 0
+
+    @classmethod
+    def fromRows(cls,rows,header):
+        #Build from a list of row tuples (transposed to columns; the row tuples can then be freed)
+        return cls(header,[list(c) for c in zip(*rows)] if rows else [[] for h in header])
+
+    def __len__(self):
+        return self._n
+
+    def __bool__(self):
+        return self._n>0
+
+    def __getitem__(self,i):
+        #rs[i] is a row view, rs['col'] a column
+        if isinstance(i,str) : return self._cols[self._index[i]]
+        if i<0 : i+=self._n
+        if not 0<=i<self._n : raise IndexError("ResultSet index out of range")
+        return RowView(self,i)
+
+    def __iter__(self):
+        for i in range(self._n) : yield RowView(self,i)
+
+    def column(self,name):
+        return self._cols[self._index[name]]
+
+    def keys(self):
+        return self.header
+
+    def rows(self):
+        #Returns the rows as a list of tuples
+        return list(zip(*self._cols))
+
+    def toNumpy(self):
+        #Returns a dict of numpy arrays (as form='numpy', but with numpy's type detection)
+        import numpy as np
+        return {h:np.asarray(c) for h,c in zip(self.header,self._cols)}
+
+    def sizeOf(self):
+        #Approximate memory size in bytes (columns sampled), used by db_stats.sizeOf
+        n=sys.getsizeof(self)
+        for c in self._cols:
+            if hasattr(c,'nbytes') : n+=c.nbytes
+            elif len(c) : n+=sys.getsizeof(c)+len(c)*sum(sys.getsizeof(v) for v in c[:100])//min(len(c),100)
+        return n
+
+    def __repr__(self):
+        return "ResultSet(%s rows, columns=%s)" % (self._n,list(self.header))
@@ -0,0 +1,173 @@
+# db_router.py
+"""
+Read replica routing for db_conn.
+
+.. package:: db_utils.db_router
+
+A DatabaseConn made with replicas sends read only queries to a replica and everything else to the primary (its host).
+
+Example:
+    db=db_conn.RO(replicas=['db-rep1','db-rep2:3307'])
+    a=db.doquery("select * from flask_event where num=%s",[123]) #a replica
+    db.doquery("call tagwr_addFlaskDataTag(%s,%s,%s,%s)",[...])  #the primary, and reads stay there for stickySeconds
+
+    or with a shared Router to pick the policy/limits (and share host state between connections):
+    router=db_router.Router('db-int2',['db-rep1','db-rep2'],policy='latency',maxLag=10)
+    db=db_conn.RO(replicas=router)
+
+What goes to a replica; doquery/iterquery selects (select, with, show, explain) run with commit=True, except
+    -writes, multiInsert/insert, transactions (transaction(), commit=False) and doqueries() batches,
+    -queries using session state that lives on the primary connection; temporary tables (tmp.*, wherein() temp tables,
+        file output with stream=False), user variables (@x), locking reads (for update...), last_insert_id(), get_lock()...
+    -any read within stickySeconds (default maxLag) of a write through the same DatabaseConn, so callers read their own writes.
+
+Replica selection (among replicas that are up and not lagging):
+    'least-connections'; the replica with the fewest queries in flight from this process (ties by latency).
+    'latency'; random, weighted by 1/latency, so faster replicas get more of the load but all get some.
+Health; every checkInterval seconds a replica's lag (Seconds_Behind_Master from 'show slave status') and round trip latency
+    are checked.  Replicas lagging more than maxLag, with replication stopped, or that fail to connect or drop the
+    connection are skipped (down ones for retryAfter seconds) and the query is retried on the next, then the primary.
+    If the account can't run 'show slave status' lag isn't checked.
+
+Routers are shared per (primary, replicas) in a process so in flight counts and health are seen by all DatabaseConns.
+"""
+
+import re
+import time
+import random
+import threading
+
+policies=('least-connections','latency')
+
+#Statements a replica can answer; reads that don't depend on (or create) state in the primary connection's session
+_readStart=re.compile(r"^\s*(?:/\*.*?\*/\s*|--[^\n]*\n\s*|#[^\n]*\n\s*)*\(*\s*(select|with|show|explain|describe|desc)\b",re.I|re.S)
+_sessionState=re.compile(r"\bfor\s+update\b|\bfor\s+share\b|\block\s+in\s+share\s+mode\b|\binto\s+(?:outfile|dumpfile)\b|\btemporary\b|\btmp\.|"
+    r"\b(?:get_lock|release_lock|last_insert_id|found_rows|row_count|connection_id)\s*\(|@|\bnextval\b|\bsql_calc_found_rows\b",re.I)
+
+def isReadOnly(query):
+    #True if query can be answered by a replica (see above)
+    if isinstance(query,bytes) : query=query.decode('utf-8','replace')
+    return bool(_readStart.match(query)) and not _sessionState.search(query)
+
+def parseHost(host):
+    #'host' or 'host:port' -> (host,port)
+    h,sep,port=host.rpartition(':')
+    if sep and port.isdigit() : return h,int(port)
+    return host,None
+
+#mysql client errors meaning the server is unreachable or the connection was lost
+connectionErrors=(2002,2003,2005,2006,2013,2055)
+
+
+class _Host(object):
+    __slots__=('name','host','port','inFlight','latency','lag','checkedAt','downUntil','queries','failures')
+    def __init__(self,name):
+        self.name=name
+        self.host,self.port=parseHost(name)
+        self.inFlight=0
+        self.latency=None #ewma round trip seconds
+        self.lag=None #seconds behind the primary, None if unknown
+        self.checkedAt=0
+        self.downUntil=0
+        self.queries=0
+        self.failures=0
+
+
+class Router(object):
+    """Replica selection and health state, shared by DatabaseConns with the same primary and replicas"""
+
+    def __init__(self,primary,replicas,policy='least-connections',maxLag=30,checkInterval=10,retryAfter=30,stickySeconds=None):
+        if policy not in policies : raise ValueError("Unknown routing policy '%s', use one of %s" % (policy,policies))
+        self.primary=primary
+        self.replicas=[_Host(r) for r in replicas]
+        self.policy=policy
+        self.maxLag=maxLag
+        self.checkInterval=checkInterval
+        self.retryAfter=retryAfter
+        self.stickySeconds=maxLag if stickySeconds is None else stickySeconds
+        self._lock=threading.Lock()
+        self._hosts={h.name:h for h in self.replicas}
+        self.primaryQueries=0
+
+    def dueForCheck(self,now=None):
+        #Returns the names of up replicas whose health check is older than checkInterval (and marks them as being checked)
+        now=now or time.time()
+        due=[]
+        with self._lock:
+            for h in self.replicas:
+                if h.downUntil<=now and now-h.checkedAt>=self.checkInterval :
+                    h.checkedAt=now
+                    due.append(h.name)
+        return due
+
+    def checked(self,name,lag,latency):
+        #Record a health check result.  lag is seconds behind (None if unknown, float('inf') if replication is stopped)
+        with self._lock:
+            h=self._hosts[name]
+            h.lag=lag
+            h.latency=latency if h.latency is None else .7*h.latency+.3*latency
+
+    def markDown(self,name):
+        with self._lock:
+            h=self._hosts[name]
+            h.downUntil=time.time()+self.retryAfter
+            h.failures+=1
+            h.checkedAt=0 #check again as soon as it's back
+
+    def choose(self,exclude=()):
+        #Returns the name of the replica to use (None for the primary if none are usable) and counts it as in flight
+        now=time.time()
+        with self._lock:
+            ok=[h for h in self.replicas if h.name not in exclude and h.downUntil<=now and (h.lag is None or h.lag<=self.maxLag)]
+            if not ok :
+                self.primaryQueries+=1
+                return None
+            if self.policy=='least-connections' :
+                h=min(ok,key=lambda h:(h.inFlight,h.latency if h.latency is not None else 0))
+            else :
+                weights=[1./max(h.latency,1e-4) if h.latency is not None else 1e4 for h in ok] #unmeasured hosts are tried first
+                h=random.choices(ok,weights)[0]
+            h.inFlight+=1
+            h.queries+=1
+            return h.name
+
+    def release(self,name):
+        with self._lock : self._hosts[name].inFlight-=1
+
+    def stats(self):
+        #Returns a dict of per replica state and counters (and the number of reads that fell back to the primary)
+        with self._lock:
+            ret={h.name:dict(inFlight=h.inFlight,latencyMs=h.latency*1000 if h.latency is not None else None,lag=h.lag,
+                down=h.downUntil>time.time(),queries=h.queries,failures=h.failures) for h in self.replicas}
+            ret['primary']=dict(host=self.primary,reads=self.primaryQueries)
+            return ret
+
+
+def checkHost(conn):
+    #Returns (lag,latency) for replica connection conn.  Lag is None if it can't be read, inf if replication isn't running.
+    start=time.time()
+    c=conn.cursor()
+    try:
+        c.execute("select 1")
+        c.fetchall()
+        latency=time.time()-start
+        try:
+            c.execute("show slave status")
+            row=c.fetchone()
+        except Exception : return None,latency #no privilege (REPLICATION CLIENT/SLAVE MONITOR) to check
+        if row is None : return 0,latency #not a replica (a primary listed as one)
+        lag=row[[d[0] for d in c.description].index('Seconds_Behind_Master')]
+        return (float('inf') if lag is None else float(lag)),latency
+    finally:
+        c.close()
+
+
+_routers=dict()
+_routersLock=threading.Lock()
+def router(primary,replicas,**kwargs):
+    #Returns the shared Router for primary and replicas (made with kwargs the first time)
+    key=(primary,tuple(replicas))
+    with _routersLock:
+        r=_routers.get(key)
+        if r is None : r=_routers[key]=Router(primary,replicas,**kwargs)
+    return r
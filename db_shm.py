@@ -0,0 +1,215 @@
+# db_shm.py
+"""
+Shared memory handoff of numpy query results to other processes.
+
+.. package:: db_utils.db_shm
+
+Normally used through doquery(...,form='numpy',shared=True).  The columns are copied once into a shared memory segment
+(multiprocessing.shared_memory, or shared='file' for a memory mapped temp file) and a small picklable SharedResult handle is
+returned.  Other processes on the same host attach to it and get the columns as read only numpy arrays on the shared
+memory, so N workers cost 1 query and 1 copy of the data instead of N queries or N pickled copies.
+
+    h=db.doquery(sql,form='numpy',shared=True)     #the caller holds the first reference
+    with multiprocessing.Pool(8) as pool:
+        r=pool.map(work,[(h,i) for i in range(8)])  #only the handle is pickled
+    h.release()                                     #data is removed when the last reference is released
+
+    def work(args):
+        h,i=args
+        with h as a:                                #attach (a reference) and release on exit
+            return a['value'][i::8].mean()
+
+References; each attached handle holds 1 reference in a small lock file next to the data (tempfile.gettempdir() or dir).
+release() drops it, so does garbage collection of the handle and interpreter exit.  The last release removes the data.
+Processes killed without releasing leave it behind; destroy() removes it regardless.  Arrays from attach() must not be
+used after their handle is released.  Object columns (strings with NULLs...) are stored as fixed width str/bytes as in
+the 'npy' file format.  POSIX only (uses fcntl locks).
+"""
+
+import os
+import sys
+import mmap
+import fcntl
+import struct
+import secrets
+import weakref
+import tempfile
+import numpy as np
+
+import db_utils.db_numpy as db_numpy
+
+backends=('shm','file')
+_align=64 #column start alignment (bytes)
+
+
+def _openShm(name,create=False,size=0):
+    from multiprocessing import shared_memory
+    if sys.version_info>=(3,13) : return shared_memory.SharedMemory(name,create,size,track=False)
+    shm=shared_memory.SharedMemory(name,create,size)
+    #Lifetime is managed by the reference count, not the resource tracker (which unlinks it when a process that opened it exits)
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(shm._name,'shared_memory')
+    return shm
+
+def _mapShm(shm,size):
+    #Returns a mapping of shared memory segment shm and closes shm.  The mmap dups the fd, so like the 'file' backend's mapping it
+    #can't be unmapped (close() raises BufferError) while arrays on it exist, instead of leaving them pointing at freed memory.
+    mm=mmap.mmap(shm._fd,size)
+    shm.close()
+    return mm
+
+def _remove(backend,name,path):
+    #Removes the shared data
+    if backend=='file' :
+        try : os.unlink(path)
+        except FileNotFoundError : pass
+        return
+    try : shm=_openShm(name)
+    except FileNotFoundError : return
+    if sys.version_info<(3,13) :
+        from multiprocessing import resource_tracker
+        resource_tracker.register(shm._name,'shared_memory') #unlink() unregisters it
+    shm.unlink()
+    shm.close()
+
+def _addRef(refsPath,n,onZero=None):
+    #Adds n to the reference count in file refsPath (under an exclusive lock) and returns the new count.  When it drops to 0
+    #onZero() is called (still locked) and the file removed.  Raises ValueError if the count is already 0 (data removed).
+    try : f=open(refsPath,'r+b')
+    except FileNotFoundError : raise ValueError("Shared result %s has been released" % refsPath) from None
+    with f:
+        fcntl.flock(f,fcntl.LOCK_EX)
+        count=struct.unpack('q',f.read(8))[0]
+        if count<=0 : raise ValueError("Shared result %s has been released" % refsPath)
+        count+=n
+        f.seek(0)
+        f.write(struct.pack('q',count))
+        f.flush()
+        if count<=0 :
+            if onZero : onZero()
+            os.unlink(refsPath)
+    return count
+
+def _open(backend,name,path,size):
+    #Returns an mmap of existing shared data
+    if backend=='file' :
+        with open(path,'r+b') as f : return mmap.mmap(f.fileno(),size)
+    return _mapShm(_openShm(name),size)
+
+def _drop(backend,name,path,refsPath,mm):
+    #Finalizer of an attached handle; unmaps and drops its reference, removing the data with the last one
+    try : mm.close()
+    except BufferError : pass #arrays from attach() are still referenced, the mapping is freed with them
+    try : _addRef(refsPath,-1,lambda: _remove(backend,name,path))
+    except ValueError : pass #destroy()ed
+
+
+class SharedResult(object):
+    """Picklable handle to numpy columns in shared memory (see share()).  Use as a context manager or attach()/release()."""
+
+    def __init__(self,backend,name,path,refsPath,columns,size):
+        self.backend=backend
+        self.name=name
+        self.path=path #data file for the 'file' backend
+        self.refsPath=refsPath
+        self.columns=columns #[(name,dtype str,shape,offset)...]
+        self.size=size
+        self._arrays=None
+        self._fin=None
+
+    def __getstate__(self):
+        state=dict(self.__dict__)
+        state['_arrays']=None
+        state['_fin']=None
+        return state
+
+    def _map(self,mm):
+        arrays=dict()
+        for name,dtype,shape,offset in self.columns:
+            a=np.frombuffer(mm,np.dtype(dtype),int(np.prod(shape)),offset).reshape(shape) #holds a buffer export, so mm isn't unmapped under it
+            a.flags.writeable=False
+            arrays[name]=a
+        self._arrays=arrays
+        self._fin=weakref.finalize(self,_drop,self.backend,self.name,self.path,self.refsPath,mm)
+        return arrays
+
+    def attach(self):
+        #Returns the dict of read only column arrays, taking a reference the first time it's called on this handle.  Raises
+        #ValueError if the data has already been removed.
+        if self._arrays is not None : return self._arrays
+        _addRef(self.refsPath,1)
+        try : mm=_open(self.backend,self.name,self.path,self.size)
+        except BaseException :
+            _addRef(self.refsPath,-1,lambda: _remove(self.backend,self.name,self.path))
+            raise
+        return self._map(mm)
+
+    def release(self):
+        #Drops this handle's reference (if attached).  The data is removed when the last reference is released.
+        self._arrays=None
+        if self._fin is not None : self._fin()
+
+    def destroy(self):
+        #Removes the data now, whatever the reference count (cleanup after crashed workers)
+        self.release()
+        _remove(self.backend,self.name,self.path)
+        try : os.unlink(self.refsPath)
+        except FileNotFoundError : pass
+
+    def refCount(self):
+        #Returns the number of attached handles (0 once removed)
+        try:
+            with open(self.refsPath,'rb') as f:
+                fcntl.flock(f,fcntl.LOCK_SH)
+                return struct.unpack('q',f.read(8))[0]
+        except FileNotFoundError : return 0
+
+    @property
+    def rows(self):
+        return self.columns[0][2][0] if self.columns else 0
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self,exc_type,exc_value,tb):
+        self.release()
+        return False
+
+    def __repr__(self):
+        return "SharedResult(%s %s, %s cols, %s rows, %s bytes)" % (self.backend,self.name,len(self.columns),self.rows,self.size)
+
+
+def share(arrays,backend='shm',dir=None):
+    #Copies dict of numpy column arrays arrays into new shared memory (backend 'shm') or a memory mapped temp file ('file', in dir)
+    #and returns its SharedResult, attached and holding the first reference.
+    if backend not in backends : raise ValueError("Unknown shared backend '%s', use one of %s" % (backend,backends))
+    arrays={k:np.ascontiguousarray(db_numpy._fileSafe(v)) for k,v in arrays.items()}
+    columns=[]
+    size=0
+    for k,v in arrays.items():
+        size=-(-size//_align)*_align
+        columns.append((k,v.dtype.str,v.shape,size))
+        size+=v.nbytes
+    size=max(size,1)
+    name="dbshm_%s" % secrets.token_hex(8)
+    dir=dir or tempfile.gettempdir()
+    path=os.path.join(dir,name+'.dat') if backend=='file' else None
+    refsPath=os.path.join(dir,name+'.refs')
+    with open(refsPath,'xb') as f : f.write(struct.pack('q',1))
+    try:
+        if backend=='file' :
+            with open(path,'x+b') as f:
+                f.truncate(size)
+                mm=mmap.mmap(f.fileno(),size)
+        else : mm=_mapShm(_openShm(name,True,size),size)
+        h=SharedResult(backend,name,path,refsPath,columns,size)
+        for (k,dtype,shape,offset) in columns : np.ndarray(shape,np.dtype(dtype),buffer=mm,offset=offset)[...]=arrays[k]
+    except BaseException :
+        _remove(backend,name,path)
+        os.unlink(refsPath)
+        raise
+    h._map(mm)
+    return h
@@ -0,0 +1,166 @@
+# db_snapshot.py
+"""
+Incremental local snapshots of query results for db_conn.
+
+.. package:: db_utils.db_snapshot
+
+Normally used through DatabaseConn.snapshot().  The results of a BldSQL query are kept in a local directory as 1 .npy
+file per column (the form='npy' layout) plus a meta.json with a high-water mark; the max value of the since column
+(default the key) in the snapshot.  Later syncs only select rows past the mark and merge them in, and the columns are
+returned memory mapped, so a recurring job pulling the same large slice only transfers and loads what changed.
+
+    sql=db.sql
+    sql.initQuery();sql.table("flask_data_view");sql.col("data_num");sql.col("ev_datetime");sql.col("value")
+    sql.where("parameter_num=%s",1)
+    a=db.snapshot(sql,'/scratch/co2_snap',key='data_num')                       #new rows only (data_num > last max)
+    a=db.snapshot(sql,'/scratch/co2_snap',key='data_num',since='modification_datetime')  #new and changed rows
+
+-key; unique (not null) column of the results.  Rows are kept in key order and changed rows replace the old ones by key.
+-since; column selecting rows to refetch, defaulting to key (append only data).  With a modification timestamp column,
+    rows where since>= the mark are fetched (>= so rows changed in the same second as the last sync aren't missed) and
+    replace the snapshot's rows with the same key.  since must be selected and not null.
+-key and since can be the result names (or aliases) of selected columns or their expressions ('d.num'); the where clause on
+    since is built from the selected column's expression, as where can't refer to select aliases.
+Deleted rows aren't detected; pass refresh=True to rebuild the snapshot from scratch.  If the query (sql text, bind
+parameters or wherein values) changes, the snapshot is rebuilt automatically.
+
+Each sync writes a new generation subdirectory and switches meta.json to it last, so a failed sync leaves the previous
+snapshot intact, and readers that already have the old columns mapped keep valid data.  Only 1 process should sync a
+given path at a time.
+"""
+
+import os
+import json
+import copy
+import shutil
+import hashlib
+import datetime
+import numpy as np
+
+import db_utils.db_paging as db_paging
+import db_utils.db_numpy as db_numpy
+
+_metaFile='meta.json'
+
+
+def queryKey(sql):
+    #Digest identifying the query a snapshot was made from
+    return hashlib.sha1(repr((sql.cmd(),sql.bind(),sql.whereinKey())).encode('utf-8')).hexdigest()
+
+def readMeta(path):
+    #Returns the snapshot's meta dict, None if there isn't one at path
+    try:
+        with open(os.path.join(path,_metaFile)) as f : return json.load(f)
+    except FileNotFoundError : return None
+
+def load(path,meta=None):
+    #Returns the snapshot at path as a dict of read only memory mapped column arrays (None if it has no rows)
+    meta=meta or readMeta(path)
+    if meta is None : raise ValueError("No snapshot at %s" % path)
+    if not meta['rows'] : return None
+    gen=os.path.join(path,meta['generation'])
+    return {col:np.load(os.path.join(gen,fn),mmap_mode='r') for col,fn in zip(meta['columns'],meta['files'])}
+
+def _maxValue(arr):
+    #Max of a column ignoring NaN/NaT, None if there are no values
+    if arr.dtype.kind=='M' : arr=arr[~np.isnat(arr)]
+    elif arr.dtype.kind=='f' : arr=arr[~np.isnan(arr)]
+    if not len(arr) : return None
+    v=arr.max()
+    return v.item() if hasattr(v,'item') else v
+
+def _fetch(db,sql,numpyFloat64):
+    a=db.doquery(sql,form='numpy',numpyFloat64=numpyFloat64,numpyDatetime64=True)
+    if a is None : return None
+    return {k:db_numpy._fileSafe(v) for k,v in a.items()}
+
+def _writeGeneration(path,cols,n,fill):
+    #Writes a new generation dir of column files.  fill(name,out) fills memory mapped output column out.  Returns (generation,files)
+    gen="g"+datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    genDir=os.path.join(path,gen)
+    os.makedirs(genDir)
+    files=[]
+    try:
+        for name,dtype in cols:
+            fn=name.replace('/','_')+'.npy'
+            out=np.lib.format.open_memmap(os.path.join(genDir,fn),mode='w+',dtype=dtype,shape=(n,))
+            fill(name,out)
+            out.flush()
+            del out
+            files.append(fn)
+    except BaseException :
+        shutil.rmtree(genDir,ignore_errors=True)
+        raise
+    return gen,files
+
+def _commit(path,meta,oldMeta):
+    #Switch meta.json to the new generation, then remove the old one
+    tmp=os.path.join(path,_metaFile+'.tmp')
+    with open(tmp,'w') as f : json.dump(meta,f,indent=1)
+    os.replace(tmp,os.path.join(path,_metaFile))
+    if oldMeta and oldMeta.get('generation') and oldMeta['generation']!=meta['generation'] :
+        shutil.rmtree(os.path.join(path,oldMeta['generation']),ignore_errors=True)
+
+def _meta(qkey,key,since,hwm,rows,columns,gen,files):
+    return dict(query=qkey,key=key,since=since,hwm=db_paging.encodeToken([since],[hwm]) if hwm is not None else None,rows=rows,
+        columns=columns,generation=gen,files=files,synced=datetime.datetime.now().isoformat(timespec='seconds'))
+
+def _full(db,path,sql,key,since,qkey,numpyFloat64,oldMeta):
+    new=_fetch(db,sql,numpyFloat64)
+    if new is None :
+        meta=_meta(qkey,key,since,None,0,[],None,[])
+        _commit(path,meta,oldMeta)
+        return meta,0
+    keyCol=db_paging.keyColumns([key])[0]
+    order=np.argsort(new[keyCol],kind='stable')
+    n=len(order)
+    gen,files=_writeGeneration(path,[(k,v.dtype) for k,v in new.items()],n,lambda name,out: np.take(new[name],order,out=out))
+    meta=_meta(qkey,key,since,_maxValue(new[db_paging.keyColumns([since])[0]]),n,list(new.keys()),gen,files)
+    _commit(path,meta,oldMeta)
+    return meta,n
+
+def _merge(db,path,sql,key,since,qkey,numpyFloat64,meta):
+    hwm=db_paging.decodeToken(meta['hwm'],[since])[0]
+    s=copy.deepcopy(sql)
+    keyCol,sinceCol=db_paging.keyColumns([key,since])
+    s.where("%s%s%%s" % (sql.colExpression(since),'>' if sinceCol==keyCol else '>='),hwm) #aliases can't be used in where
+    new=_fetch(db,s,numpyFloat64)
+    if new is None : return meta,0
+    if list(new.keys())!=meta['columns'] : raise ValueError("Snapshot columns changed")
+
+    old=load(path,meta)
+    oldKeys,newKeys=old[keyCol],new[keyCol]
+    keep=~np.isin(oldKeys,newKeys)
+    newOrder=np.argsort(newKeys,kind='stable')
+    appendOnly=keep.all() and (not len(oldKeys) or newKeys.min()>oldKeys[-1])
+    if appendOnly : order=None #old rows then the (sorted) new rows, copied straight into place
+    else : order=np.argsort(np.concatenate([oldKeys[keep],newKeys]),kind='stable')
+    n=int(keep.sum())+len(newKeys) if not appendOnly else len(oldKeys)+len(newKeys)
+    dtypes=[(k,np.result_type(old[k].dtype,new[k].dtype)) for k in meta['columns']] #eg; wider strings, ints with nulls now floats
+
+    def fill(name,out):
+        if appendOnly :
+            m=len(old[name])
+            out[:m]=old[name]
+            out[m:]=new[name][newOrder]
+        else : out[:]=np.concatenate([old[name][keep],new[name]])[order]
+
+    gen,files=_writeGeneration(path,dtypes,n,fill)
+    old=None #unmap before the old generation is removed
+    newHwm=_maxValue(new[sinceCol])
+    if newHwm is not None and newHwm>hwm : hwm=newHwm
+    newMeta=_meta(qkey,key,since,hwm,n,meta['columns'],gen,files)
+    _commit(path,newMeta,meta)
+    return newMeta,len(newKeys)
+
+def sync(db,sql,path,key='num',since=None,numpyFloat64=True,refresh=False):
+    #See DatabaseConn.snapshot().  Returns (meta,rows fetched)
+    since=since or key
+    if not os.path.isdir(path) : os.makedirs(path)
+    qkey=queryKey(sql)
+    meta=readMeta(path)
+    rebuild=refresh or meta is None or meta['query']!=qkey or meta['key']!=key or meta['since']!=since or not meta['hwm']
+    if not rebuild :
+        try : return _merge(db,path,sql,key,since,qkey,numpyFloat64,meta)
+        except (TypeError,ValueError) : pass #column types/shape changed incompatibly (a column that was all NULL...), rebuild
+    return _full(db,path,sql,key,since,qkey,numpyFloat64,meta)
@@ -0,0 +1,231 @@
+# db_stats.py
+"""
+Query instrumentation for db_conn.
+
+.. package:: db_utils.db_stats
+
+When any hooks are registered, DatabaseConn.doquery() records a QueryStats for every query and passes it to each hook.
+With no hooks registered, doquery skips all of this (apart from a check of the hook list).
+
+A hook is any callable taking (stats,db) where db is the DatabaseConn that ran the query.  Provided hooks:
+    LoggingHook     logs each query's stats through the logging module
+    Aggregator      in process per query fingerprint counts and p50/p95/p99 timings, dumpable as a text report or json
+    SlowQueryLog    captures the sql, bind parameters, stats and EXPLAIN output of queries over a time threshold
+
+Example:
+    import db_utils.db_stats as db_stats
+    agg=db_stats.addHook(db_stats.Aggregator())
+    slow=db_stats.addHook(db_stats.SlowQueryLog(threshold=2.0))
+    ...run queries...
+    print(agg.report())
+    agg.dump('/tmp/query_stats.json')
+    for e in slow.entries : print(e['sql'],e['explain'])
+
+QueryStats fields:
+    query, parameters, fingerprint (normalized query text with literals replaced by ?), form
+    executeTime     seconds for execute (for buffered cursors this includes transferring the result set from the server)
+    fetchTime       seconds reading rows off the cursor.  For numpy, file and streaming output fetch and conversion are interleaved
+                    and are all counted here.
+    convertTime     seconds packaging rows into the requested form (dict/text...)
+    totalTime       seconds for the whole doquery call
+    rows            rows returned/written (or affected for dml)
+    bytes           approximate size of the result; in memory size for python forms, file size for file output
+    memDelta        growth in the process peak resident set size (bytes) during the query
+    error           exception text if the query failed
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import logging
+import threading
+import collections
+try : import resource
+except ImportError : resource=None #not available on windows
+
+
+_hooks=[]
+_hooksLock=threading.Lock()
+
+def addHook(hook):
+    #Register a hook (callable taking (stats,db)).  Returns the hook for convenience.
+    with _hooksLock:
+        if hook not in _hooks : _hooks.append(hook)
+    return hook
+
+def removeHook(hook):
+    with _hooksLock:
+        if hook in _hooks : _hooks.remove(hook)
+
+def enabled():
+    #True if any hooks are registered (doquery only collects stats when this is true)
+    return bool(_hooks)
+
+def record(stats,db=None):
+    #Pass stats to all registered hooks.  Hook errors are printed, not raised, so instrumentation can't break queries.
+    for hook in list(_hooks):
+        try : hook(stats,db)
+        except Exception as e : print("db_stats: hook %r failed: %s" % (hook,e),file=sys.stderr)
+
+def peakRSS():
+    #Returns process peak resident set size in bytes (0 if unavailable)
+    if resource is None : return 0
+    r=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r if sys.platform=='darwin' else r*1024 #bytes on mac, kb on linux
+
+
+def sizeOf(value):
+    #Rough memory footprint in bytes of a doquery result.  Large lists are sampled.
+    if value is None : return 0
+    if hasattr(value,'sizeOf') : return value.sizeOf() #db_records.ResultSet
+    if isinstance(value,dict) and all(hasattr(v,'nbytes') for v in value.values()) : #numpy form
+        n=0
+        for arr in value.values():
+            n+=arr.nbytes
+            if arr.dtype==object and len(arr) : n+=len(arr)*sys.getsizeof(arr[0])
+        return n
+    if isinstance(value,list) :
+        if not value : return sys.getsizeof(value)
+        sample=value[:100]
+        per=0
+        for row in sample:
+            per+=sys.getsizeof(row)
+            vals=row.values() if isinstance(row,dict) else (row if isinstance(row,(list,tuple)) else ())
+            per+=sum(sys.getsizeof(v) for v in vals)
+        return sys.getsizeof(value)+per*len(value)//len(sample)
+    return sys.getsizeof(value)
+
+_literals=re.compile(r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*"|\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b|%s""",re.I)
+_inList=re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_space=re.compile(r"\s+")
+
+def fingerprint(query):
+    #Returns query normalized so that queries differing only in literal/bind values match:
+    #literals and %s placeholders become ?, in lists become (...), whitespace is collapsed and it's lowercased.
+    q=_literals.sub('?',query)
+    q=_inList.sub('(...)',q)
+    return _space.sub(' ',q).strip().lower()
+
+
+class QueryStats(object):
+    """Metrics for 1 doquery call"""
+    __slots__=('query','parameters','fingerprint','form','start','executeTime','fetchTime','convertTime','totalTime','rows','bytes','memDelta','error')
+
+    def __init__(self,query,parameters=None,form=None):
+        self.query=query
+        self.parameters=parameters
+        self.fingerprint=fingerprint(query)
+        self.form=form
+        self.start=time.time()
+        self.executeTime=0.
+        self.fetchTime=0.
+        self.convertTime=0.
+        self.totalTime=0.
+        self.rows=0
+        self.bytes=0
+        self.memDelta=0
+        self.error=None
+
+    def asDict(self):
+        return {k:getattr(self,k) for k in self.__slots__}
+
+    def __repr__(self):
+        return "QueryStats(total=%.4f execute=%.4f fetch=%.4f convert=%.4f rows=%s bytes=%s memDelta=%s query=%r)" % (
+            self.totalTime,self.executeTime,self.fetchTime,self.convertTime,self.rows,self.bytes,self.memDelta,self.fingerprint[:80])
+
+
+class LoggingHook(object):
+    """Logs every query's stats"""
+    def __init__(self,logger=None,level=logging.DEBUG):
+        self.logger=logger if logger is not None else logging.getLogger('db_utils.db_stats')
+        self.level=level
+
+    def __call__(self,stats,db):
+        self.logger.log(self.level,"%r",stats)
+
+
+class Aggregator(object):
+    """In process per fingerprint aggregation of query stats with percentile timings"""
+
+    #maxSamples is the number of totalTime samples kept per fingerprint for percentiles (reservoir sampled beyond that)
+
+    def __init__(self,maxSamples=10000):
+        self.maxSamples=maxSamples
+        self._lock=threading.Lock()
+        self._data=dict() #fingerprint -> dict of totals and samples
+
+    def __call__(self,stats,db):
+        with self._lock:
+            d=self._data.get(stats.fingerprint)
+            if d is None :
+                d=self._data[stats.fingerprint]=dict(count=0,errors=0,totalTime=0.,executeTime=0.,fetchTime=0.,convertTime=0.,rows=0,bytes=0,maxMemDelta=0,samples=[])
+            d['count']+=1
+            if stats.error : d['errors']+=1
+            for k in ('totalTime','executeTime','fetchTime','convertTime','rows','bytes') : d[k]+=getattr(stats,k)
+            d['maxMemDelta']=max(d['maxMemDelta'],stats.memDelta)
+            samples=d['samples']
+            if len(samples)<self.maxSamples : samples.append(stats.totalTime)
+            else :
+                i=random.randrange(d['count'])
+                if i<self.maxSamples : samples[i]=stats.totalTime
+
+    @staticmethod
+    def _percentile(sortedSamples,p):
+        if not sortedSamples : return 0.
+        return sortedSamples[min(len(sortedSamples)-1,int(round(p/100.*(len(sortedSamples)-1))))]
+
+    def summary(self):
+        #Returns a list of per fingerprint summary dicts, sorted by total time descending
+        out=[]
+        with self._lock:
+            for fp,d in self._data.items():
+                s=sorted(d['samples'])
+                r={k:v for k,v in d.items() if k!='samples'}
+                r['fingerprint']=fp
+                r['mean']=d['totalTime']/d['count']
+                r['p50']=self._percentile(s,50)
+                r['p95']=self._percentile(s,95)
+                r['p99']=self._percentile(s,99)
+                out.append(r)
+        return sorted(out,key=lambda r:r['totalTime'],reverse=True)
+
+    def report(self,width=80):
+        #Returns a text report (1 line per fingerprint)
+        lines=["%-8s %10s %9s %9s %9s %9s %9s %9s %9s %12s  %s" % ('count','total(s)','execute','fetch','convert','mean','p50','p95','p99','rows','query')]
+        for r in self.summary():
+            lines.append("%-8s %10.3f %9.3f %9.3f %9.3f %9.4f %9.4f %9.4f %9.4f %12s  %s" % (r['count'],r['totalTime'],r['executeTime'],r['fetchTime'],
+                r['convertTime'],r['mean'],r['p50'],r['p95'],r['p99'],r['rows'],r['fingerprint'][:width]))
+        return "\n".join(lines)
+
+    def dump(self,filename):
+        #Write summary() as json
+        with open(filename,'w') as f : json.dump(self.summary(),f,indent=1)
+
+    def reset(self):
+        with self._lock : self._data.clear()
+
+
+class SlowQueryLog(object):
+    """Captures queries slower than threshold seconds, with their EXPLAIN output"""
+
+    #  -explain; run EXPLAIN (selects only) on the query's connection after it finishes.
+    #  -maxEntries; keep at most this many (most recent) entries.
+    #  -logger; if passed, each slow query is also logged as a warning.
+
+    def __init__(self,threshold=1.0,explain=True,maxEntries=1000,logger=None):
+        self.threshold=threshold
+        self.explain=explain
+        self.logger=logger
+        self.entries=collections.deque(maxlen=maxEntries)
+        self._lock=threading.Lock()
+
+    def __call__(self,stats,db):
+        if stats.totalTime<self.threshold : return
+        e=dict(time=stats.start,sql=stats.query,parameters=stats.parameters,stats=stats.asDict(),explain=None)
+        if self.explain and db is not None and stats.error is None and stats.query.lstrip()[:6].lower()=='select' :
+            try : e['explain']=db.explain(stats.query,stats.parameters)
+            except Exception as ex : e['explain']="explain failed: %s" % ex
+        with self._lock : self.entries.append(e)
+        if self.logger : self.logger.warning("slow query (%.3fs): %s\nparameters: %s\nexplain: %s",stats.totalTime,stats.query,stats.parameters,e['explain'])
@@ -0,0 +1,174 @@
+# db_text.py
+"""
+Streaming fixed width text output for db_conn ('dat','txt','std','scr' forms).
+
+.. package:: db_utils.db_text
+
+Formats rows as space padded columns (min 3 space gap, same layout as DatabaseConn.listToTextCols()) without holding
+the result set in memory.  Each value is converted to a string once.  Column widths come from one of:
+    'exact' (default); rows are stringified into a spooled temp file while the max widths are found, then read back
+        and written out padded.  Output is identical to listToTextCols(), memory stays flat but nothing is written
+        until the whole set has been read.
+    'sample'; widths are taken from the first sampleRows rows (which are held), then those and all following rows are written
+        as they are read.  Values wider than their column are handled per the overflow policy.
+    'description'; widths are taken from the cursor description (column display/defined sizes, capped at maxWidth)
+        and rows are written as they are read.  Values wider than their column are handled per the overflow policy.
+    a list of ints; fixed column widths (not including the gap).
+
+Overflow policies (for 'sample','description' and fixed widths):
+    'grow' (default); the column is widened from the overflowing row on (earlier lines are not realigned).
+    'truncate'; the value is cut to the column width.
+    'shift'; the value is written in full, pushing the rest of that line to the right.
+
+Normally used through DatabaseConn.doquery(form='dat'|'txt'|'std'|'scr',textWidths=,textOverflow=).
+"""
+
+import pickle
+import tempfile
+
+spacing=3 #gap between columns
+sampleRows=1000 #rows used to size columns in 'sample' mode
+maxWidth=40 #cap on column widths from 'description' mode
+chunk=10000 #rows fetched (and spooled) at a time
+
+
+def _str(row):
+    return [str(v) for v in row]
+
+def descriptionWidths(description):
+    #Returns column widths from a cursor description: the display size (buffered MySQLdb cursors report the longest value)
+    #or the defined column size, at least the name (and 'None' for nullable cols), at most maxWidth.
+    widths=[]
+    for d in description:
+        size=d[2] or d[3] or 0
+        w=min(max(int(size),1),maxWidth)
+        if len(d)>6 and d[6] : w=max(w,4)
+        widths.append(max(w,len(d[0])))
+    return widths
+
+
+class TextFormatter(object):
+    """Pads stringified rows to column widths, applying the overflow policy"""
+
+    def __init__(self,header,widths,overflow='grow'):
+        if overflow not in ('grow','truncate','shift') : raise ValueError("Unknown text overflow policy '%s'" % overflow)
+        self.header=header
+        self.widths=[max(w,len(h)) for w,h in zip(widths,header)]
+        self.overflow=overflow
+
+    def line(self,values):
+        #Returns the formatted line for a list of string values
+        widths=self.widths
+        if self.overflow=='shift' : #long values are written in full, keeping the gap after them
+            return ''.join(['%-*s' % (max(w,len(v))+spacing,v) for w,v in zip(widths,values)])
+        for i,v in enumerate(values):
+            if len(v)>widths[i] :
+                if self.overflow=='grow' : widths[i]=len(v)
+                else : values[i]=v[:widths[i]]
+        return ''.join(['%-*s' % (w+spacing,v) for w,v in zip(widths,values)])
+
+    def headerLine(self):
+        return self.line(list(self.header))
+
+
+def rowsToLines(header,rows):
+    #Returns a list of formatted lines (header first) for an in memory list of rows, stringifying each value once.
+    rows=[_str(row) for row in rows]
+    widths=[len(h) for h in header]
+    for row in rows:
+        for i,v in enumerate(row):
+            if len(v)>widths[i] : widths[i]=len(v)
+    fmt=TextFormatter(header,widths)
+    return [fmt.headerLine()]+[fmt.line(row) for row in rows]
+
+def _fetchChunks(cursor):
+    rows=cursor.fetchmany(chunk)
+    while rows :
+        yield rows
+        rows=cursor.fetchmany(chunk)
+
+def _exactLines(header,chunks,emptyHeader):
+    #2 pass; spool stringified chunks to a temp file while finding the widths, then read back and pad.
+    widths=[len(h) for h in header]
+    n=0
+    with tempfile.TemporaryFile() as spool:
+        for rows in chunks:
+            rows=[_str(row) for row in rows]
+            for row in rows:
+                for i,v in enumerate(row):
+                    if len(v)>widths[i] : widths[i]=len(v)
+            pickle.dump(rows,spool,protocol=pickle.HIGHEST_PROTOCOL)
+            n+=len(rows)
+        if not n :
+            if emptyHeader : yield TextFormatter(header,widths).headerLine()
+            return
+        spool.seek(0)
+        fmt=TextFormatter(header,widths)
+        yield fmt.headerLine()
+        while True:
+            try : rows=pickle.load(spool)
+            except EOFError : break
+            for row in rows : yield fmt.line(row)
+
+def _sampleLines(header,chunks,overflow,emptyHeader):
+    #Hold the first sampleRows rows to size the columns, then stream
+    widths=[len(h) for h in header]
+    sample=[]
+    chunks=iter(chunks)
+    for rows in chunks:
+        sample.extend(_str(row) for row in rows)
+        if len(sample)>=sampleRows : break
+    if not sample :
+        if emptyHeader : yield TextFormatter(header,widths).headerLine()
+        return
+    for row in sample:
+        for i,v in enumerate(row):
+            if len(v)>widths[i] : widths[i]=len(v)
+    fmt=TextFormatter(header,widths,overflow)
+    yield fmt.headerLine()
+    for row in sample : yield fmt.line(row)
+    del sample
+    for rows in chunks:
+        for row in rows : yield fmt.line(_str(row))
+
+def _fixedLines(header,widths,chunks,overflow,emptyHeader):
+    fmt=None
+    for rows in chunks:
+        if fmt is None :
+            fmt=TextFormatter(header,widths,overflow)
+            yield fmt.headerLine()
+        for row in rows : yield fmt.line(_str(row))
+    if fmt is None and emptyHeader : yield TextFormatter(header,widths,overflow).headerLine()
+
+def chunkLines(header,chunks,widths='exact',overflow='grow',description=None,emptyHeader=False):
+    #Returns a generator of formatted lines (header line first) from an iterable of row chunks.
+    #For an empty result only the header line is produced if emptyHeader (text files), otherwise nothing (screen forms).
+    if widths=='exact' : return _exactLines(header,chunks,emptyHeader)
+    if widths=='sample' : return _sampleLines(header,chunks,overflow,emptyHeader)
+    if widths=='description' :
+        if description is None : raise ValueError("textWidths='description' requires a cursor description")
+        widths=descriptionWidths(description)
+    if isinstance(widths,(list,tuple)) :
+        if len(widths)!=len(header) : raise ValueError("textWidths has %s widths for %s columns" % (len(widths),len(header)))
+        return _fixedLines(header,list(widths),chunks,overflow,emptyHeader)
+    raise ValueError("Unknown textWidths '%s'" % (widths,))
+
+def cursorLines(cursor,widths='exact',overflow='grow',emptyHeader=False):
+    #Returns a generator of formatted lines for the result set on cursor (read chunk by chunk with fetchmany)
+    header=[d[0] for d in cursor.description]
+    return chunkLines(header,_fetchChunks(cursor),widths,overflow,cursor.description,emptyHeader)
+
+def writeLines(lines,f):
+    #Write lines to open text file f, returns number of lines written
+    n=0
+    buf=[]
+    for line in lines:
+        buf.append(line)
+        if len(buf)>=chunk :
+            f.write('\n'.join(buf)+'\n')
+            n+=len(buf)
+            buf=[]
+    if buf :
+        f.write('\n'.join(buf)+'\n')
+        n+=len(buf)
+    return n
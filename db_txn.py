@@ -0,0 +1,180 @@
+# db_txn.py
+"""
+Transactions for db_conn.
+
+.. package:: db_utils.db_txn
+
+Normally used through DatabaseConn.transaction() and DatabaseConn.runInTransaction().
+
+    with db.transaction() as t:
+        t.execute("update flask_data set flag=%s where num=%s",('..x',12345))
+        with t.savepoint():             #rolled back to here (and re-raised) if the block fails
+            t.execute(...)
+        for num,tag in tags:            #queued and sent many statements per round trip
+            t.add("call tagwr_addFlaskDataTag(%s,%s,%s,%s)",[num,tag,'','John'])
+    #committed on exit, rolled back on exception
+
+All statements run on 1 cursor with autocommit off; autocommit is turned back on when the transaction ends.  Don't call
+db.doquery() inside the block, it turns autocommit on (committing the open transaction); use t.query() instead.
+
+Batching; add() queues statements, which are interpolated client side (as MySQLdb does for execute) and sent as multi statement
+packets of up to batchBytes (default the server's max_allowed_packet, max 16mb) when the queue fills, on flush(), before any
+execute()/query() and at commit.  Errors in a batch are raised when it's sent.
+
+Retry; the server rolls back the whole transaction on a deadlock (1213) and the statement on a lock wait timeout (1205), which
+are raised as db_conn.DeadlockError / db_conn.LockWaitTimeout.  A with block can't be rerun, so put the work in a function and use
+DatabaseConn.runInTransaction(func) which reruns it (rolling back first) with exponential backoff.
+"""
+
+import time
+import random
+import contextlib
+
+import db_utils.db_conn as db_conn
+
+
+class Transaction(object):
+    """A transaction on a DatabaseConn's connection.  Use as a context manager."""
+
+    def __init__(self,db,isolation=None,batchBytes=None):
+        self.db=db
+        self.isolation=isolation #eg 'read committed'
+        self.batchBytes=batchBytes
+        self._c=None
+        self._batch=[]
+        self._batchSize=0
+        self._savepoints=0
+        self._writeTags=[] #for cache invalidation on commit
+        self.statements=0 #round trips sent
+        self.rowcount=0 #rows affected by batched statements
+
+    def begin(self):
+        conn=self.db._conn
+        conn.autocommit(False)
+        self._c=conn.cursor()
+        self._c._defer_warnings=True
+        if self.isolation : self._c.execute("set transaction isolation level "+self.isolation)
+        self._c.execute("start transaction")
+        if self.batchBytes is None :
+            import db_utils.db_bulk as db_bulk
+            self.batchBytes=min(int(db_bulk.maxPacket(conn)*.9),16*1024*1024)
+        return self
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self,exc_type,exc_value,tb):
+        if exc_type is None :
+            try : self.commit()
+            except BaseException :
+                self.rollback()
+                raise
+        else : self.rollback()
+        return False
+
+    def _run(self,query,parameters=None):
+        try:
+            self._c.execute(query,parameters)
+            self.statements+=1
+        except Exception as e:
+            raise db_conn.queryError(e) from e
+        self._noteWrite(query)
+
+    def _noteWrite(self,query):
+        if self.db._cache is not None :
+            import db_utils.db_cache as db_cache
+            if db_cache.isWrite(query) : self._writeTags.extend(db_cache.writeTags(query))
+
+    def execute(self,query,parameters=None):
+        #Run a statement now, returns the number of rows affected.  Any queued batch is sent first.
+        self.flush()
+        self._run(query,parameters)
+        return self._c.rowcount
+
+    def query(self,query,parameters=None,form='list'):
+        #Run a select now (reading your own uncommitted writes), returns rows packaged per form ('list','dict','record'...)
+        self.flush()
+        self._run(query,parameters)
+        if self._c.description is None : return None
+        return self.db.packageRows(list(self._c.fetchall()),[d[0] for d in self._c.description],form)
+
+    @property
+    def lastrowid(self):
+        return self._c.lastrowid
+
+    def add(self,query,parameters=None):
+        #Queue a statement to be sent in a multi statement batch
+        import db_utils.db_batch as db_batch
+        stmt=db_batch.interpolate(self.db._conn,query,parameters)
+        if self._batch and self._batchSize+len(stmt)+2>self.batchBytes : self.flush()
+        self._batch.append(stmt)
+        self._batchSize+=len(stmt)+2
+        self._noteWrite(query)
+
+    def flush(self):
+        #Send queued statements.  All results are read so the first failing statement's error is raised.
+        if not self._batch : return
+        sql=b";\n".join(self._batch)
+        self._batch=[]
+        self._batchSize=0
+        try:
+            self._c.execute(sql)
+            self.statements+=1
+            n=max(self._c.rowcount,0)
+            while self._c.nextset() : n+=max(self._c.rowcount,0)
+            self.rowcount+=n
+        except Exception as e:
+            raise db_conn.queryError(e) from e
+
+    @contextlib.contextmanager
+    def savepoint(self,name=None):
+        #Block that is rolled back on its own (to the savepoint) if it raises.  The exception is re-raised.
+        self.flush()
+        self._savepoints+=1
+        name=name or "sp%d" % self._savepoints
+        self._run("savepoint "+name)
+        try:
+            yield name
+            self.flush()
+        except BaseException :
+            self._batch=[]
+            self._batchSize=0
+            try : self._c.execute("rollback to savepoint "+name)
+            except Exception : pass #the whole transaction was already rolled back (deadlock), raise the original error
+            raise
+        self._run("release savepoint "+name)
+
+    def commit(self):
+        self.flush()
+        try:
+            self.db._conn.commit()
+        except Exception as e:
+            raise db_conn.queryError(e) from e
+        if self._writeTags : self.db._cache.invalidate(self._writeTags)
+        self._end()
+
+    def rollback(self):
+        self._batch=[]
+        self._batchSize=0
+        try : self.db._conn.rollback()
+        finally : self._end()
+
+    def _end(self):
+        if self._c is not None :
+            self._c.close()
+            self._c=None
+        self.db._conn.autocommit(True)
+        self.db._lastWrite=time.time() #reads stay on the primary for a while (see db_router.py)
+
+
+def runInTransaction(db,func,retries=5,backoff=.05,maxBackoff=2.,isolation=None,batchBytes=None):
+    #See DatabaseConn.runInTransaction()
+    attempt=0
+    while True:
+        t=Transaction(db,isolation,batchBytes)
+        try:
+            with t : return func(t)
+        except (db_conn.DeadlockError,db_conn.LockWaitTimeout):
+            attempt+=1
+            if attempt>retries : raise
+            time.sleep(min(maxBackoff,backoff*2**(attempt-1))*random.uniform(.5,1.5))
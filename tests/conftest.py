@@ -0,0 +1,38 @@
+# Makes the package importable as db_utils when the checkout directory has another name (the modules import each other as db_utils.x)
+import os
+import sys
+import importlib.util
+
+try:
+    import db_utils
+except ImportError:
+    _root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    _spec=importlib.util.spec_from_file_location('db_utils',os.path.join(_root,'__init__.py'),submodule_search_locations=[_root])
+    db_utils=importlib.util.module_from_spec(_spec)
+    sys.modules['db_utils']=db_utils
+    _spec.loader.exec_module(db_utils)
+
+
+import shutil
+import tempfile
+import pytest
+
+@pytest.fixture(scope='session')
+def server():
+    #connArgs for a test database.  Uses DB_UTILS_TEST_HOST (and _PORT, _USER, _PASSWORD, _DB) if set, otherwise starts a
+    #throwaway local MariaDB with bench.startServer() if mariadbd is on the PATH, otherwise the test is skipped.
+    if os.environ.get('DB_UTILS_TEST_HOST') :
+        e=os.environ
+        yield dict(host=e['DB_UTILS_TEST_HOST'],port=int(e.get('DB_UTILS_TEST_PORT',3306)),user=e.get('DB_UTILS_TEST_USER','root'),
+            password=e.get('DB_UTILS_TEST_PASSWORD',''),db=e.get('DB_UTILS_TEST_DB','test'))
+        return
+    if not (shutil.which('mariadbd') or shutil.which('mysqld')) : pytest.skip("no test server (set DB_UTILS_TEST_HOST or put mariadbd on the PATH)")
+    pytest.importorskip('MySQLdb')
+    import db_utils.bench as bench
+    tmpdir=tempfile.mkdtemp(prefix='db_utils_test')
+    connArgs,p=bench.startServer(tmpdir)
+    try : yield connArgs
+    finally:
+        p.terminate()
+        p.wait()
+        shutil.rmtree(tmpdir,ignore_errors=True)
@@ -0,0 +1,34 @@
+# AsyncDatabaseConn against a local server (see the server fixture in conftest.py)
+import asyncio
+import pytest
+
+pytest.importorskip('aiomysql')
+import db_utils.db_async as db_async
+import db_utils.db_conn as db_conn
+
+QUERY="select 1 as num,'MLO' as site,1.5 as val union all select 2,'SPO',null union all select 3,'BRW',3.25"
+
+def run(connArgs,coro):
+    async def main():
+        async with db_async.AsyncDatabaseConn(**connArgs) as db : return await coro(db)
+    return asyncio.run(main())
+
+def test_forms(server):
+    async def q(db):
+        return await asyncio.gather(db.doquery(QUERY,form='dict'),db.doquery(QUERY,form='list'),db.doquery(QUERY,form='numpy'))
+    d,l,a=run(server,q)
+    assert d[1]=={'num':2,'site':'SPO','val':None}
+    assert [r[0] for r in l]==[1,2,3]
+    assert a['num'].tolist()==[1,2,3]
+
+@pytest.mark.parametrize('widths',['exact','sample'])
+def test_dat_file_matches_sync(server,tmp_path,widths):
+    out=tmp_path/'a.dat'
+    run(server,lambda db: db.doquery(QUERY,form='dat',outfile=str(out),textWidths=widths))
+    rows=[[1,'MLO',1.5],[2,'SPO',None],[3,'BRW',3.25]]
+    assert out.read_text()=='\n'.join(db_conn.DatabaseConn.listToTextCols(rows,['num','site','val']))+'\n'
+
+def test_errors_mapped(server):
+    with pytest.raises(db_conn.QueryError) as e:
+        run(server,lambda db: db.doquery("select * from no_such_table_xyz"))
+    assert e.value.errno==1146
@@ -0,0 +1,126 @@
+# Tests for db_batch.interpolate and doqueries (a fake multi statement connection; escaping against a local server, see conftest.py)
+import decimal
+import datetime
+import pytest
+
+import db_utils.db_conn as db_conn
+import db_utils.db_batch as db_batch
+
+class ServerError(Exception):
+    pass
+
+class Cursor(object):
+    #Runs a multi statement packet; selects return 1 row with the statement's index, other statements affect 2 rows
+    def __init__(self,conn):
+        self.conn=conn
+        self._results=[]
+        self.description=None
+        self.rowcount=0
+    def execute(self,query,parameters=None):
+        self.conn.log.append(query)
+        self._results=[]
+        for i,stmt in enumerate(query.split(b";")):
+            if b"bad" in stmt : #the server stops at the first failing statement
+                if not self._results : raise ServerError(1064,"You have an error in your SQL syntax")
+                self._results.append(ServerError(1064,"You have an error in your SQL syntax"))
+                break
+            self._results.append(i if stmt.strip().lower().startswith(b"select") else None)
+        self._next()
+    def _next(self):
+        r=self._results.pop(0)
+        if isinstance(r,Exception) : raise r
+        self.description=[('i',3,None,None,None,None,0)] if r is not None else None
+        self.rows=[(r,)] if r is not None else []
+        self.rowcount=len(self.rows) if r is not None else 2
+    def nextset(self):
+        if not self._results : return None
+        self._next()
+        return True
+    def fetchall(self):
+        return self.rows
+    def close(self):
+        pass
+
+class Conn(object):
+    def __init__(self):
+        self.log=[]
+    def cursor(self,cls=None):
+        return Cursor(self)
+    def literal(self,v):
+        return b"NULL" if v is None else b"<"+str(v).encode()+b">"
+    def autocommit(self,on):
+        pass
+    def close(self):
+        pass
+
+class BatchConn(db_conn.DatabaseConn):
+    def _open(self,host,port):
+        return Conn()
+
+def test_interpolate():
+    conn=Conn()
+    assert db_batch.interpolate(conn,"select * from t where a=%s and b=%s",(1,None))==b"select * from t where a=<1> and b=NULL"
+    assert db_batch.interpolate(conn,"select %s like 'x%%'",['y'])==b"select <y> like 'x%'"
+    assert db_batch.interpolate(conn,"select 'x%%'")==b"select 'x%%'" #no parameters, not formatted (as MySQLdb)
+    assert db_batch.interpolate(conn,"select %(a)s,%(b)s,%(a)s",dict(a=1,b='z'))==b"select <1>,<z>,<1>"
+    assert db_batch.interpolate(conn,"select 'µ',%s",['é'])=="select 'µ',<é>".encode('utf-8')
+    with pytest.raises(TypeError):
+        db_batch.interpolate(conn,"select %s,%s",[1])
+
+def test_doqueries():
+    db=BatchConn(host='p',convProfile='default')
+    r=db.doqueries([("select %s",[1]),"update t set a=1",("select %s",[2],'scalar'),("select %s",[3],'list')])
+    assert r==[[{'i':0}],2,2,[(3,)]]
+    assert db._conn.log==[b"select <1>;\nupdate t set a=1;\nselect <2>;\nselect <3>"]
+
+def test_result_count_mismatch():
+    db=BatchConn(host='p',convProfile='default')
+    with pytest.raises(ValueError,match="got 3 results for 2 queries"):
+        db.doqueries(["select 1; select 2","select 3"])
+
+def test_error_stops_batch(capsys):
+    db=BatchConn(host='p',convProfile='default')
+    with pytest.raises(db_conn.QueryError) as e:
+        db.doqueries(["select 1","select bad","select 3"])
+    assert e.value.errno==1064 and "select bad" in capsys.readouterr().out
+    with pytest.raises(db_conn.QueryError):
+        db.doqueries(["select bad","select 3"])
+
+@pytest.mark.parametrize('query',["call p(%s)","  CALL p()"])
+def test_call_rejected(query):
+    db=BatchConn(host='p',convProfile='default')
+    with pytest.raises(ValueError,match="Stored procedure calls"):
+        db.doqueries([("select 1",),(query,[1])])
+    assert db._conn.log==[] #nothing sent
+
+def test_form_rejected():
+    db=BatchConn(host='p',convProfile='default')
+    with pytest.raises(ValueError,match="not supported by doqueries"):
+        db.doqueries([("select 1",None,'iter')])
+
+
+VALUES=[("O'Brien","%s"),("back\\slash\\","%s"),("both \\' \"quotes\"","%s"),('line\nbreak\r\x00nul\x1a',"%s"),("é µ","%s"),(None,"%s"),
+    (b"bin\x00'\\\xff","%s"),(-7,"%s"),(2**63-1,"%s"),(0.1,"%s+0e0"),(decimal.Decimal('-12.345'),"cast(%s as decimal(10,3))"),
+    (datetime.datetime(2024,2,29,23,59,58,123456),"cast(%s as datetime(6))"),(datetime.date(1999,12,31),"cast(%s as date)"),
+    (datetime.timedelta(hours=-1,seconds=5),"cast(%s as time)")]
+
+@pytest.fixture(scope='module')
+def db(server):
+    db=db_conn.DatabaseConn(convertDecToFloat=False,**server)
+    yield db
+    db.close()
+
+@pytest.mark.parametrize('value,expr',VALUES)
+def test_interpolate_escaping(db,value,expr):
+    #literals made by the real connection select back as the original values
+    sql=db_batch.interpolate(db._conn,"select %s"%expr,[value])
+    if value is None : assert sql==b"select NULL"
+    c=db._conn.cursor()
+    try:
+        c.execute(sql)
+        assert c.fetchone()==(value,)
+    finally : c.close()
+
+def test_doqueries_escaping(db):
+    r=db.doqueries([("select %s,%s",["a'b;c","d\\e"],'list'),("select %(x)s",dict(x="f';"),'scalar')])
+    assert r==[[("a'b;c","d\\e")],"f';"]
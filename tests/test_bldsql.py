@@ -0,0 +1,173 @@
+# Tests for BldSQL wherein() strategies (no server needed)
+import pytest
+
+import db_utils.bldsql as bldsql
+
+def sql():
+    s=bldsql.BldSQL()
+    s.table("flask_event e")
+    s.innerJoin("gmd.site s on e.site_num=s.num")
+    s.col("e.num")
+    s.where("e.site_num=%s",75)
+    return s
+
+def test_wherein_inline():
+    s=sql()
+    s.wherein("e.num in",[1,2,3])
+    s.where("e.ev_date>%s",'2020-01-01')
+    assert "e.num in (%s,%s,%s)" in s.cmd()
+    assert s.bind()==(75,1,2,3,'2020-01-01')
+    assert s.whereinTables()==[] and s.whereinChunks() is None
+
+def test_wherein_empty():
+    s=sql()
+    s.wherein("e.num in",[])
+    s.wherein("e.gas_num not in ",[])
+    assert "in ()" not in s.cmd()
+    assert "1=0" in s.cmd() and "1=1" in s.cmd()
+    assert s.bind()==(75,)
+
+def test_wherein_temptable():
+    s=sql()
+    s.wherein("e.num not in",[3,1,3,None,2],strategy='temptable')
+    s.where("e.ev_date>%s",'2020-01-01')
+    (table,create,values),=s.whereinTables()
+    assert values==[3,1,2]
+    assert "e.num not in (select v from %s)" % table in s.cmd()
+    assert create.startswith("create temporary table %s (primary key (v)) select e.num as v from flask_event e inner join gmd.site s" % table)
+    assert s.bind()==(75,'2020-01-01')
+    assert s.whereinKey() is not None
+
+def test_wherein_temptable_needs_in():
+    with pytest.raises(ValueError):
+        sql().wherein("e.num=",[1],strategy='temptable')
+    with pytest.raises(ValueError):
+        sql().wherein("e.num in",[1],strategy='bogus')
+
+def test_wherein_threshold():
+    s=sql()
+    s.wherein("e.num in",list(range(10)),threshold=5)
+    assert len(s.whereinTables())==1
+    s=sql()
+    s.wherein("e.num in",list(range(2000)),strategy='inline')
+    assert s.whereinTables()==[] and len(s.bind())==2001
+
+def test_wherein_chunks():
+    s=sql()
+    s.wherein("e.num in",list(range(10)),strategy='chunk',threshold=4)
+    s.where("e.ev_date>%s",'2020-01-01')
+    chunks=s.whereinChunks()
+    assert len(chunks)==3
+    assert [c.bind() for c in chunks]==[(75,0,1,2,3,'2020-01-01'),(75,4,5,6,7,'2020-01-01'),(75,8,9,'2020-01-01')]
+    assert "e.num in (%s,%s) " in chunks[2].cmd()
+    assert all(c.whereinChunks() is None for c in chunks)
+    #the original and the other chunks aren't changed by changing one
+    chunks[0].where("e.x=1")
+    assert "e.x=1" not in chunks[1].cmd() and "e.x=1" not in s.cmd()
+    assert len(s.bind())==12
+
+def test_wherein_chunks_empty():
+    s=sql()
+    s.wherein("e.num in",[],strategy='chunk')
+    chunks=s.whereinChunks()
+    assert len(chunks)==1 and "1=0" in chunks[0].cmd() and chunks[0].bind()==(75,)
+
+def test_wherein_chunk_only_once():
+    s=sql()
+    s.wherein("e.num in",[1],strategy='chunk')
+    with pytest.raises(ValueError):
+        s.wherein("e.gas in",[1],strategy='chunk')
+
+def test_derived_temptable_uses_inner_tables():
+    s=sql()
+    s.wherein("e.num in",list(range(2000)))
+    d=s.derived()
+    d.col("count(*)")
+    (table,create,values),=d.whereinTables()
+    assert "from flask_event e inner join gmd.site s" in create and len(values)==2000
+    assert d.whereinKey()==s.whereinKey()
+
+def test_derived():
+    s=sql()
+    s.col("e.value as v")
+    d=s.derived()
+    d.col("max(q.v)")
+    assert d.cmd().count("select")==2 and ") as q" in d.cmd()
+    assert d.bind()==(75,)
+    s.wherein("e.num in",[1],strategy='chunk')
+    with pytest.raises(ValueError):
+        s.derived()
+
+def test_time_bucket():
+    s=sql()
+    s.col("e.ev_datetime as t")
+    s.col("e.value")
+    d=s.timeBucket("e.ev_datetime as t",3600,"e.value",aggs=('mean','max','count'))
+    c=d.cmd()
+    assert "timestampdiff(second,timestamp'1970-01-01 00:00:00',q.t)/3600)*3600 second as bucket" in c
+    assert "avg(q.value) as value_mean" in c and "max(q.value) as value_max" in c and "count(q.value) as value_count" in c
+    assert "q.t is not null" in c and "group by bucket" in c and "order by bucket" in c
+    assert d.bind()==(75,)
+    with pytest.raises(ValueError):
+        s.timeBucket("t",60,"value",aggs=('median',))
+    with pytest.raises(ValueError):
+        s.timeBucket("t",0,"value")
+
+def test_time_range():
+    s=sql()
+    s.col("e.ev_datetime")
+    c=s.timeRange("e.ev_datetime").cmd()
+    assert "min(q.ev_datetime) as tmin" in c and "max(q.ev_datetime) as tmax" in c
+
+def test_result_name():
+    assert bldsql.resultName("e.value")=="value"
+    assert bldsql.resultName("avg(e.value) as `mean`")=="mean"
+
+def test_where_replace_after_wherein():
+    #replace=True used to write parameter [index of the clause], wrong after an unbound clause or a wherein list
+    s=sql()
+    s.where("e.flag is null")
+    s.wherein("e.gas_num in",[1,2,3])
+    s.where("e.num=%s",10)
+    s.where("e.value>%s",0)
+    c=s.cmd()
+    for num in (11,12):
+        s.where("e.num=%s",num,replace=True)
+        assert s.bind()==(75,1,2,3,num,0)
+    assert s.cmd() is c #bind parameters only
+    s.where("e.site_num=%s",76,replace=True)
+    assert s.bind()==(76,1,2,3,12,0)
+    with pytest.raises(ValueError):
+        s.where("e.flag is null",1,replace=True)
+
+def test_where_replace_in_derived_and_chunks():
+    s=sql()
+    s.col("e.value")
+    d=s.derived()
+    d.where("q.value>%s",1)
+    d.where("q.value>%s",2,replace=True)
+    assert d.bind()==(75,2)
+    s=sql()
+    s.wherein("e.num in",list(range(5)),strategy='chunk',threshold=2)
+    s.where("e.x=%s",1)
+    s.where("e.x=%s",2,replace=True)
+    assert [c.bind()[-1] for c in s.whereinChunks()]==[2,2,2]
+    c=s.whereinChunks()[2]
+    c.where("e.x=%s",3,replace=True)
+    assert c.bind()==(75,4,3)
+
+@pytest.mark.parametrize('size',[0,-5])
+def test_wherein_chunk_size_checked(size):
+    #used to raise from range() in whereinChunks (0) or return no chunks, dropping the list (negative)
+    s=sql()
+    with pytest.raises(ValueError,match="chunk size"):
+        s.wherein("e.num in",[1,2],strategy='chunk',threshold=size)
+    assert s.whereinChunks() is None and s.bind()==(75,)
+
+def test_col_expression():
+    s=bldsql.BldSQL()
+    s.initQuery()
+    for c in ["d.data_num","modification_datetime as 'mdt'","avg(v) as mean"] : s.col(c)
+    assert s.colExpression('mdt')=="modification_datetime" and s.colExpression("modification_datetime as mdt")=="modification_datetime"
+    assert s.colExpression('data_num')=="d.data_num" and s.colExpression('mean')=="avg(v)"
+    assert s.colExpression('x.other')=="x.other" #not selected
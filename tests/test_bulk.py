@@ -0,0 +1,61 @@
+# Tests for db_bulk load data text and multi row insert batching (a recording connection, no server needed)
+import datetime
+import pytest
+
+pytest.importorskip('MySQLdb')
+import db_utils.db_bulk as db_bulk
+
+@pytest.mark.parametrize('v,text',[
+    (None,'\\N'),
+    ("a\tb\nc\\d\r\0",'a\\tb\\nc\\\\d\\r\\0'),
+    (True,'1'),(False,'0'),(3,'3'),(.1,'0.1'),(1e-20,'1e-20'),
+    (b'x\ty','x\\ty'),
+    (datetime.datetime(2020,1,2,3,4,5),'2020-01-02 03:04:05'),
+    (datetime.datetime(2020,1,2,3,4,5,123),'2020-01-02 03:04:05.000123'),
+    (datetime.date(2020,1,2),'2020-01-02'),
+    (datetime.timedelta(days=1,hours=2),'26:00:00'),
+    (datetime.timedelta(minutes=-90),'-1:30:00'),
+    (datetime.timedelta(seconds=5,microseconds=250000),'0:00:05.250000'),
+    (datetime.timedelta(days=-1,seconds=86399),'-0:00:01'),
+])
+def test_tsv_value(v,text):
+    assert db_bulk._tsvValue(v)==text
+
+class Cursor(object):
+    def __init__(self,log):
+        self.log=log
+    def execute(self,q,p=None):
+        self.log.append(q)
+    def close(self):
+        pass
+
+class Conn(object):
+    def __init__(self):
+        self.log=[]
+    def cursor(self):
+        return Cursor(self.log)
+    def literal(self,row):
+        return ("("+",".join("'%s'" % v for v in row)+")").encode('utf-8')
+
+def test_load_values_packet_splitting():
+    conn=Conn()
+    rows=[(i,'x'*10) for i in range(100)]
+    n,statements=db_bulk.loadValues(conn,'t',['a','b'],iter(rows),packetBytes=200)
+    assert n==100 and statements==len(conn.log)>1
+    assert all(len(q)<=200 for q in conn.log)
+    assert all(q.startswith(b"insert into t (a,b) values (") for q in conn.log)
+    values=b",".join(q[len(b"insert into t (a,b) values "):] for q in conn.log)
+    assert values==b",".join(conn.literal(r) for r in rows) #all rows, in order
+
+def test_load_values_duplicates():
+    conn=Conn()
+    db_bulk.loadValues(conn,'t',['a','b'],[(1,2)],duplicates='update',packetBytes=1000)
+    db_bulk.loadValues(conn,'t',None,[(1,2)],duplicates='ignore',packetBytes=1000)
+    assert conn.log==[b"insert into t (a,b) values ('1','2') on duplicate key update a=values(a),b=values(b)",b"insert ignore into t values ('1','2')"]
+    with pytest.raises(ValueError):
+        db_bulk.loadValues(conn,'t',None,[(1,2)],duplicates='update',packetBytes=1000)
+
+def test_load_values_big_row_and_empty():
+    conn=Conn()
+    assert db_bulk.loadValues(conn,'t',['a'],[('x'*500,),('y',)],packetBytes=100)==(2,2) #a row over the budget goes alone
+    assert db_bulk.loadValues(conn,'t',['a'],[],packetBytes=100)==(0,0)
@@ -0,0 +1,66 @@
+# Tests for db_cache table tagging, write detection and invalidation (no server needed)
+import threading
+import pytest
+
+import db_utils.db_cache as db_cache
+
+@pytest.mark.parametrize('query,tags',[
+    ("select * from gmd.site",['gmd.site','site']),
+    ("select * from flask_event e, flask_data d where e.num=d.event_num",['flask_event','flask_data']),
+    ("select * from flask_event as e,flask_data as d",['flask_event','flask_data']),
+    ("select * from `gmd`.`site` s join ccgg.flask_event e on s.num=e.site_num left join x using (num)",['gmd.site','site','ccgg.flask_event','flask_event','x']),
+    ("select * from t where a in (select b from u)",['t','u']),
+    ("select * from t where name='from v'",['t']),
+    ("select * from t1 a, t2 where a.x=1 group by 1",['t1','t2']),
+])
+def test_read_tags(query,tags):
+    assert db_cache.readTags(query)==tags
+
+@pytest.mark.parametrize('query,tags',[
+    ("insert into flask_data (num) values (1)",['flask_data']),
+    ("insert ignore gmd.site values (1)",['gmd.site','site']),
+    ("replace into t select * from u",['t']),
+    ("update t set a=1",['t']),
+    ("update t1 a join t2 b on a.x=b.x set a.y=b.y",['t1','t2']),
+    ("update t1, t2 set t1.a=t2.a",['t1','t2']),
+    ("delete from t where num=1",['t']),
+    ("delete d from flask_data d join x on d.num=x.num",['flask_data','x']),
+    ("delete from d using flask_data d, x where d.num=x.num",['d','flask_data','x']),
+    ("truncate table t",['t']),
+    ("drop table if exists a, b",['a','b']),
+    ("load data local infile 'f' into table t",['t']),
+    ("insert into a values (1); update b set x=1",['a','b']),
+])
+def test_write_tags(query,tags):
+    assert db_cache.writeTags(query)==tags
+    assert db_cache.isWrite(query)
+
+@pytest.mark.parametrize('query',["call tagwr_addFlaskDataTag(%s,%s)","create index i on t (a)",
+    "with x as (select 1) delete from t where a in (select * from x)"])
+def test_unparsed_writes_invalidate_all(query):
+    assert db_cache.writeTags(query)==[db_cache.allTables]
+    assert db_cache.isWrite(query)
+
+@pytest.mark.parametrize('query',["select * from t","show tables","set @a=1","select 'delete from t'"])
+def test_not_writes(query):
+    assert not db_cache.isWrite(query)
+
+def test_invalidate():
+    c=db_cache.QueryCache()
+    c.put('a',[1],tags=db_cache.readTags("select * from flask_event e, flask_data d"))
+    c.put('b',[2],tags=['site'])
+    c.invalidate(db_cache.writeTags("update flask_data set flag='..x'"))
+    assert c.get('a')==(False,None) and c.get('b')==(True,[2])
+    c.invalidate(db_cache.writeTags("call something()"))
+    assert c.get('b')==(False,None)
+    assert c.stats()['invalidations']==2
+
+def test_disk_store_skips_unpicklable(tmp_path,capsys):
+    c=db_cache.QueryCache(diskDir=str(tmp_path))
+    value=[threading.Lock()] #TypeError from pickle
+    c.put('k',value,60,['t'])
+    assert c.get('k')==(True,value) #still cached in memory
+    assert list(tmp_path.iterdir())==[]
+    assert "unable to write k" in capsys.readouterr().out
+    c.put('k2',[1,2],60,['t'])
+    assert db_cache.QueryCache(diskDir=str(tmp_path)).get('k2')==(True,[1,2]) #from disk
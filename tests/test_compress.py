@@ -0,0 +1,76 @@
+# Tests for db_compress output files and fetchChunks (no server needed)
+import io
+import csv
+import gzip
+import pytest
+
+import db_utils.db_compress as db_compress
+
+data=b"".join(b"%d,row %d,%f\n" % (i,i,i/7) for i in range(50000))
+
+def test_compression_for():
+    assert db_compress.compressionFor("a.csv.gz")=='gzip' and db_compress.compressionFor("a.CSV.ZST")=='zstd'
+    assert db_compress.compressionFor("a.csv") is None and db_compress.compressionFor("a.gz",'none') is None
+    assert db_compress.compressionFor("a.csv",'zstd')=='zstd'
+    with pytest.raises(ValueError):
+        db_compress.compressionFor("a.csv",'bz2')
+
+@pytest.mark.parametrize('threads',[1,4])
+def test_gzip_round_trip(tmp_path,threads):
+    fn=str(tmp_path/"out.csv.gz")
+    with db_compress.openBinary(fn,threads=threads) as f:
+        for i in range(0,len(data),12345) : f.write(data[i:i+12345])
+    with gzip.open(fn,'rb') as f : assert f.read()==data
+
+def test_parallel_gzip_members(tmp_path):
+    fn=str(tmp_path/"out.gz")
+    w=db_compress.ParallelGzipWriter(open(fn,'wb'),threads=3,blockSize=100000)
+    w.write(data)
+    w.close()
+    assert w._members==-(-len(data)//100000)
+    with gzip.open(fn,'rb') as f : assert f.read()==data
+
+@pytest.mark.parametrize('threads',[1,4])
+def test_gzip_empty(tmp_path,threads):
+    fn=str(tmp_path/"empty.gz")
+    db_compress.openBinary(fn,threads=threads).close()
+    with gzip.open(fn,'rb') as f : assert f.read()==b''
+
+def test_zstd_round_trip(tmp_path):
+    zstandard=pytest.importorskip('zstandard')
+    fn=str(tmp_path/"out.csv.zst")
+    with db_compress.openBinary(fn,threads=2) as f : f.write(data)
+    with open(fn,'rb') as f : assert zstandard.ZstdDecompressor().stream_reader(f).read()==data
+
+def test_plain(tmp_path):
+    fn=str(tmp_path/"out.csv.gz")
+    with db_compress.openBinary(fn,'none') as f : f.write(data)
+    with open(fn,'rb') as f : assert f.read()==data
+
+class Cursor(object):
+    def __init__(self,rows,error=None):
+        self.rows=list(rows)
+        self.error=error
+    def fetchmany(self,n):
+        if not self.rows and self.error : raise self.error
+        out,self.rows=self.rows[:n],self.rows[n:]
+        return out
+
+def test_write_csv_text_round_trip(tmp_path):
+    rows=[(i,"name, %d" % i,None) for i in range(1000)]
+    fn=str(tmp_path/"out.csv.gz")
+    with db_compress.openText(fn,threads=2) as f:
+        n=db_compress.writeCsv(Cursor(rows),f,csv.writer,['num','name','x'],chunk=64)
+    assert n==1000
+    with gzip.open(fn,'rt') as f : r=list(csv.reader(f))
+    assert r[0]==['num','name','x'] and len(r)==1001 and r[5]==['4','name, 4','']
+
+def test_fetch_chunks():
+    assert [len(c) for c in db_compress.fetchChunks(Cursor(range(10)),chunk=4)]==[4,4,2]
+    with pytest.raises(RuntimeError):
+        list(db_compress.fetchChunks(Cursor(range(3),RuntimeError('lost')),chunk=2))
+
+def test_fetch_chunks_stop_early():
+    g=db_compress.fetchChunks(Cursor(range(100)),chunk=1,depth=1)
+    assert next(g)==[0]
+    g.close() #stops the producer blocked on a full queue
@@ -0,0 +1,148 @@
+# Tests for db_convert profiles, column converters and LazyRows, and conversion of the binary file forms (no server needed,
+# except the round trips at the end which use the server fixture in conftest.py)
+import decimal
+import datetime
+import numpy as np
+import pytest
+
+pytest.importorskip('MySQLdb')
+from MySQLdb.constants import FIELD_TYPE
+import db_utils.db_convert as db_convert
+import db_utils.db_conn as db_conn
+
+@pytest.mark.parametrize('v,secs',[
+    (b'1970-01-01 00:00:00',0),
+    ('1970-01-02',86400),
+    (b'2020-02-29 12:34:56',1582979696),
+    (b'2020-02-29 12:34:56.789',1582979696), #fractional seconds dropped
+    (b'1969-12-31 23:59:59',-1),
+    (b'0000-00-00 00:00:00',None),
+    (b'0000-00-00',None),
+])
+def test_epoch_seconds(v,secs):
+    assert db_convert.epochSeconds(v)==secs
+
+def test_profiles():
+    d=db_convert.decoders('default')
+    assert d[FIELD_TYPE.NEWDECIMAL] is not float
+    for p in ('decfloat','epoch'):
+        d=db_convert.decoders(p)
+        assert d[FIELD_TYPE.NEWDECIMAL] is float and d[FIELD_TYPE.DECIMAL] is float
+    d=db_convert.decoders('epoch')
+    assert all(d[t] is db_convert.epochSeconds for t in (FIELD_TYPE.DATETIME,FIELD_TYPE.TIMESTAMP,FIELD_TYPE.DATE))
+    assert db_convert.decoders('raw')=={} and db_convert.decoders('lazy')=={}
+    assert db_convert.decoders('decfloat')[FIELD_TYPE.DATETIME] is db_convert.decoders('default')[FIELD_TYPE.DATETIME]
+    assert db_convert.connConverters('epoch') is db_convert.connConverters('epoch') #built once
+    with pytest.raises(ValueError):
+        db_convert.connConverters('fast')
+
+def description(*types):
+    return [('c%d' % i,t,None,None,None,None,1) for i,t in enumerate(types)]
+
+def test_column_converters():
+    desc=description(FIELD_TYPE.LONG,FIELD_TYPE.DOUBLE,FIELD_TYPE.NEWDECIMAL,FIELD_TYPE.DATETIME,FIELD_TYPE.DATE,FIELD_TYPE.TIME,FIELD_TYPE.VAR_STRING)
+    row=(b'12',b'1.5',b'2.25',b'2020-01-02 03:04:05',b'2020-01-02',b'26:00:00','text')
+    convs=db_convert.columnConverters(desc)
+    assert convs[-1] is None
+    assert db_convert.convertRow(row,convs)==(12,1.5,2.25,datetime.datetime(2020,1,2,3,4,5),datetime.date(2020,1,2),datetime.timedelta(hours=26),'text')
+    assert db_convert.convertRow(row,db_convert.columnConverters(desc,decFloat=False))[2]==decimal.Decimal('2.25')
+    assert db_convert.convertRow((None,)*7,convs)==(None,)*7
+
+def test_convert_rows_no_converters():
+    rows=[('a',),('b',)]
+    out=db_convert.convertRows(rows,(None,))
+    assert out==rows and out is not rows
+
+def test_lazy_rows():
+    rows=[(b'1',b'1.5','a'),(b'2',None,'b'),(b'3',b'3.5','c')]
+    convs=db_convert.columnConverters(description(FIELD_TYPE.LONG,FIELD_TYPE.DOUBLE,FIELD_TYPE.VAR_STRING))
+    lazy=db_convert.LazyRows(rows,convs,['num','value','name'])
+    assert len(lazy)==3 and bool(lazy) and not db_convert.LazyRows([],convs)
+    assert lazy[1]==(2,None,'b') and lazy[-1]==(3,3.5,'c')
+    assert isinstance(lazy[1:],db_convert.LazyRows) and list(lazy[1:])==[(2,None,'b'),(3,3.5,'c')]
+    assert lazy.column('value')==[1.5,None,3.5] and lazy.column(2)==['a','b','c']
+    assert lazy.raw is rows
+
+
+#Binary file forms with the epoch and raw profiles, on a fake connection that converts like MySQLdb (with the connection's
+#converter dict at execute time)
+ROWS=[('2020-01-02 03:04:05','2020-01-02','1.25'),('2021-06-30 23:59:59','2021-06-30',None)]
+DESCRIPTION=description(FIELD_TYPE.DATETIME,FIELD_TYPE.DATE,FIELD_TYPE.NEWDECIMAL)
+
+class Cursor(object):
+    def __init__(self,conn):
+        self.conn=conn
+        self.description=None
+        self.rowcount=self.rownumber=0
+    def execute(self,query,parameters=None):
+        convs=[self.conn.converter.get(d[1]) for d in DESCRIPTION]
+        self.rows=[tuple(v if (v is None or f is None) else f(v) for f,v in zip(convs,row)) for row in ROWS]
+        self.description=DESCRIPTION
+        self.rowcount=len(self.rows)
+    def fetchmany(self,n):
+        out,self.rows=self.rows[:n],self.rows[n:]
+        self.rownumber+=len(out)
+        return out
+    def close(self):
+        pass
+
+class Conn(object):
+    def __init__(self,converter):
+        self.converter=converter
+    def cursor(self,cls=None):
+        return Cursor(self)
+    def autocommit(self,on):
+        pass
+    def close(self):
+        pass
+
+class FakeConn(db_conn.DatabaseConn):
+    def _open(self,host,port):
+        return Conn(db_convert.decoders(self._convProfile))
+
+@pytest.mark.parametrize('profile',['epoch','raw'])
+@pytest.mark.parametrize('convProfile',[None,'query'])
+def test_npz_ignores_epoch_and_raw(tmp_path,profile,convProfile):
+    #epoch seconds used to be written as datetime64[us] (so 1970 dates) and raw values as unconverted text
+    db=FakeConn(convProfile=profile if convProfile is None else 'decfloat')
+    out=str(tmp_path/'a.npz')
+    db.doquery("select dt,d,v from t",form='npz',outfile=out,convProfile=profile if convProfile else None)
+    with np.load(out) as z:
+        assert z['c0'].tolist()==[datetime.datetime(2020,1,2,3,4,5),datetime.datetime(2021,6,30,23,59,59)]
+        assert z['c1'].astype('datetime64[D]').tolist()==[datetime.date(2020,1,2),datetime.date(2021,6,30)]
+        assert z['c2'][0]==1.25 and np.isnan(z['c2'][1])
+    db.close()
+
+@pytest.mark.parametrize('profile',['epoch','raw'])
+def test_arrow_ignores_epoch_and_raw(tmp_path,profile):
+    ipc=pytest.importorskip('pyarrow.ipc')
+    db=FakeConn(convProfile=profile)
+    out=str(tmp_path/'a.arrow')
+    db.doquery("select dt,d,v from t",form='arrow',outfile=out)
+    with ipc.open_file(out) as r : t=r.read_all()
+    assert t.column('c0').to_pylist()==[datetime.datetime(2020,1,2,3,4,5),datetime.datetime(2021,6,30,23,59,59)]
+    assert t.column('c1').to_pylist()==[datetime.date(2020,1,2),datetime.date(2021,6,30)]
+    assert t.column('c2').to_pylist()==[1.25,None]
+    db.close()
+
+
+QUERY="select timestamp'2020-01-02 03:04:05' as dt, date'2020-01-02' as d, 1.25 as v"
+
+def test_epoch_profile_server(server):
+    db=db_conn.DatabaseConn(convProfile='epoch',**server)
+    assert db.doquery(QUERY,form='list')==[(1577934245,1577923200,1.25)]
+    db.close()
+
+@pytest.mark.parametrize('form',['npz','arrow'])
+def test_epoch_profile_binary_files_server(server,tmp_path,form):
+    db=db_conn.DatabaseConn(convProfile='epoch',**server)
+    out=str(tmp_path/('a.'+form))
+    db.doquery(QUERY,form=form,outfile=out)
+    if form=='npz' :
+        with np.load(out) as z : dt,d=z['dt'].tolist()[0],z['d'].astype('datetime64[D]').tolist()[0]
+    else :
+        import pyarrow.ipc as ipc
+        with ipc.open_file(out) as r : t=r.read_all()
+        dt,d=t.column('dt').to_pylist()[0],t.column('d').to_pylist()[0]
+    assert dt==datetime.datetime(2020,1,2,3,4,5) and d==datetime.date(2020,1,2)
+    db.close()
@@ -0,0 +1,77 @@
+# Tests for db_downsample (no server needed)
+import datetime
+import numpy as np
+import pytest
+
+import db_utils.bldsql as bldsql
+import db_utils.db_downsample as db_downsample
+
+def test_lttb_small():
+    x=np.arange(10)
+    assert list(db_downsample.lttb(x,x,20))==list(range(10))
+    assert list(db_downsample.lttb(x,x,2))==[0,9]
+    assert list(db_downsample.lttb(x,x,0))==[]
+
+def test_lttb_keeps_spike():
+    x=np.arange(1000)
+    y=np.zeros(1000)
+    y[437]=100
+    idx=db_downsample.lttb(x,y,20)
+    assert len(idx)==20 and idx[0]==0 and idx[-1]==999
+    assert np.all(np.diff(idx)>0)
+    assert 437 in idx
+
+def test_lttb_datetime64():
+    t=np.arange('2020-01-01','2020-02-01',dtype='datetime64[h]').astype('datetime64[s]')
+    y=np.sin(np.arange(len(t))/10.)
+    idx=db_downsample.lttb(t.view(np.int64),y,50)
+    assert len(idx)==50 and np.all(np.diff(idx)>0)
+
+def test_min_max_points():
+    t,v=db_downsample.minMaxPoints(np.array([1,2]),np.array([0,5]),np.array([3.5,9]))
+    assert list(t)==[1,1,2,2] and list(v)==[0,3.5,5,9]
+
+class FakeDB(object):
+    #Answers the timeRange query and the timeBucket query
+    def __init__(self,tmin,tmax,buckets):
+        self.tmin,self.tmax,self.buckets=tmin,tmax,buckets
+        self.queries=[]
+    def doquery(self,query,form='dict',numpyDatetime64=False):
+        self.queries.append(query.cmd())
+        if 'tmin' in query.cmd() : return [(self.tmin,self.tmax)]
+        return self.buckets
+
+def sql():
+    s=bldsql.BldSQL()
+    s.table("insitu")
+    s.col("date")
+    s.col("value")
+    return s
+
+def test_bucket_seconds():
+    db=FakeDB(datetime.datetime(2020,1,1),datetime.datetime(2020,1,2),None)
+    assert db_downsample.bucketSeconds(db,sql(),"date",24)==3600
+    assert db_downsample.bucketSeconds(FakeDB(None,None,None),sql(),"date",24) is None
+
+def test_downsample_minmax():
+    b=np.array(['2020-01-01T00','2020-01-01T12'],dtype='datetime64[s]')
+    db=FakeDB(datetime.datetime(2020,1,1),datetime.datetime(2020,1,2),dict(bucket=b,value_min=np.array([1.,2.]),value_max=np.array([5.,6.])))
+    r=db_downsample.downsample(db,sql(),"date","value",points=4)
+    assert list(r['value'])==[1,5,2,6] and list(r['date'])==[b[0],b[0],b[1],b[1]]
+    assert "/43200)*43200 second" in db.queries[1]
+
+def test_downsample_lttb():
+    n=200
+    b=np.datetime64('2020-01-01T00:00:00')+np.arange(n)*np.timedelta64(60,'s')
+    vmin=np.sin(np.arange(n)/5.)
+    vmax=vmin+1
+    vmin[17]=np.nan
+    db=FakeDB(datetime.datetime(2020,1,1),datetime.datetime(2020,1,1,3,20),dict(bucket=b,value_min=vmin,value_max=vmax))
+    r=db_downsample.downsample(db,sql(),"date","value",points=50,method='lttb',factor=4,seconds=60)
+    assert len(r['date'])==50 and np.all(np.diff(r['date'].view(np.int64))>0)
+    assert not np.isnan(r['value']).any()
+    assert len(db.queries)==1 #seconds passed, no time range query
+
+def test_downsample_bad_method():
+    with pytest.raises(ValueError):
+        db_downsample.downsample(FakeDB(None,None,None),sql(),"date","value",method='median')
@@ -0,0 +1,53 @@
+# Tests for db_numpy.NumpyColumnBuilder (no server needed)
+import datetime
+import numpy as np
+import pytest
+
+import db_utils.db_numpy as db_numpy
+from db_utils.db_numpy import FIELD_TYPE,FLAG
+
+DESC=[('num',FIELD_TYPE.LONG),('big',FIELD_TYPE.LONGLONG),('val',FIELD_TYPE.DOUBLE),('dt',FIELD_TYPE.DATETIME),('site',FIELD_TYPE.VAR_STRING)]
+FLAGS=[0,FLAG.UNSIGNED,0,0,0]
+ROWS=[(1,2**63+5,1.5,datetime.datetime(2020,1,1),'MLO'),
+      (2,7,None,None,'SPO'),
+      (3,2**64-1,3.5,datetime.datetime(2020,1,3),None)]
+
+def build(rows,size,chunk=2,**kwargs):
+    b=db_numpy.NumpyColumnBuilder(DESC,FLAGS,size=size,**kwargs)
+    for i in range(0,len(rows),chunk) : b.add(rows[i:i+chunk])
+    return b.result()
+
+@pytest.mark.parametrize('size',[None,len(ROWS)])
+def test_dtypes(size):
+    a=build(ROWS,size,numpyDatetime64=True)
+    assert a['num'].dtype==np.int64 and a['num'].tolist()==[1,2,3]
+    assert a['big'].dtype==np.uint64 and a['big'][2]==2**64-1 and a['big'][0]==2**63+5
+    assert a['val'].dtype==np.float64 and np.isnan(a['val'][1])
+    assert a['dt'].dtype==np.dtype('datetime64[us]') and np.isnat(a['dt'][1])
+    assert a['site'].tolist()==['MLO','SPO',None]
+
+@pytest.mark.parametrize('size',[None,4])
+def test_int_nulls_nan(size):
+    rows=[(1,1,0.,None,''),(None,2,0.,None,''),(3,None,0.,None,''),(4,4,0.,None,'')]
+    a=build(rows,size)
+    assert a['num'].dtype==np.float64
+    assert np.isnan(a['num'][1]) and a['num'][[0,2,3]].tolist()==[1,3,4]
+    assert a['big'].dtype==np.float64 and np.isnan(a['big'][2])
+
+@pytest.mark.parametrize('size',[None,4])
+def test_int_nulls_mask(size):
+    rows=[(1,1,0.,None,''),(None,2,0.,None,''),(3,None,0.,None,''),(4,4,0.,None,'')]
+    a=build(rows,size,nulls='mask')
+    assert isinstance(a['num'],np.ma.MaskedArray) and a['num'].dtype==np.int64
+    assert a['num'].mask.tolist()==[False,True,False,False]
+    assert a['big'].dtype==np.uint64 and a['big'].mask.tolist()==[False,False,True,False]
+
+def test_chunk_arrays():
+    b=db_numpy.NumpyColumnBuilder(DESC,FLAGS)
+    num,big,val,dt,site=b.chunkArrays([(1,2,1.,None,'a'),(None,3,2.,None,'b')])
+    assert num.dtype==np.float64 and np.isnan(num[1])
+    assert big.dtype==np.uint64
+    assert b.n==0
+
+def test_rows_to_numpy_empty():
+    assert db_numpy.rowsToNumpy([],DESC,FLAGS) is None
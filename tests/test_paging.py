@@ -0,0 +1,73 @@
+# Tests for db_paging tokens, BldSQL.seek and page() (a fake db, no server needed)
+import decimal
+import datetime
+import pytest
+
+import db_utils.bldsql as bldsql
+import db_utils.db_paging as db_paging
+import db_utils.db_records as db_records
+
+@pytest.mark.parametrize('values',[(5,),('MLO',12),(datetime.datetime(2020,1,2,3,4,5,6),),(datetime.date(2020,1,2),decimal.Decimal('1.25')),
+    (b'\x00\xff',None),(1.5,)])
+def test_token_round_trip(values):
+    keys=['k%d' % i for i in range(len(values))]
+    token=db_paging.encodeToken(keys,values)
+    assert all(c.isalnum() or c in '-_' for c in token)
+    assert db_paging.decodeToken(token,keys)==values
+
+def test_token_numpy_scalar():
+    np=pytest.importorskip('numpy')
+    token=db_paging.encodeToken(['num','dt'],[np.int64(7),np.datetime64('2020-01-01T00:00:00','us')])
+    assert db_paging.decodeToken(token,['num','dt'])==(7,datetime.datetime(2020,1,1))
+
+def test_token_errors():
+    with pytest.raises(ValueError) : db_paging.decodeToken("not a token!",['num'])
+    with pytest.raises(ValueError) : db_paging.decodeToken(db_paging.encodeToken(['num'],[1]),['date'])
+
+def test_key_columns():
+    assert db_paging.keyColumns(['d.num','`dt`','value'])==['num','dt','value']
+
+def sql():
+    s=bldsql.BldSQL()
+    s.table("flask_data")
+    s.col("num");s.col("value")
+    s.where("site_num=%s",75)
+    return s
+
+def test_seek_sql():
+    s=sql()
+    s.seek(['date','num'],('2020-01-01',5))
+    s.limit(10)
+    assert "(date>=%s and (date>%s or (date=%s and num>%s)))" in s.cmd()
+    assert "order by date, num limit 10" in s.cmd()
+    assert tuple(s.bind())==(75,'2020-01-01','2020-01-01','2020-01-01',5)
+    cmd=s.cmd()
+    s.seek(['date','num'],('2020-02-01',1))
+    assert s.cmd()==cmd #only the parameters change
+    s.seek('num',None,True)
+    assert "order by num desc" in s.cmd() and tuple(s.bind())==(75,)
+
+class FakeDB(object):
+    #Serves pages of ROWS like the server would; _c is None as after a cache hit or a replica read
+    _c=None
+    def __init__(self,rows):
+        self.rows=rows
+    def doquery(self,s,form='dict',**kwargs):
+        after=s._seekAfter[0] if s._seekAfter else -1
+        rows=[r for r in self.rows if r[0]>after][:3] #page size used by the tests
+        if not rows : return None
+        if form=='list' : return rows
+        if form=='record' : return db_records.toRecords(rows,['num','value'])
+        return [dict(zip(['num','value'],r)) for r in rows]
+
+@pytest.mark.parametrize('form',['list','dict','record'])
+def test_pages(form):
+    rows=[(i,i*.5) for i in range(10)]
+    got=[]
+    for page,token in db_paging.pages(FakeDB(rows),sql(),'num',3,form=form) : got.extend(page)
+    if form=='dict' : got=[(r['num'],r['value']) for r in got]
+    assert [tuple(r) for r in got]==rows
+    if form=='list' : assert all(type(r) is tuple for r in got)
+
+def test_page_bad_form():
+    with pytest.raises(ValueError) : db_paging.page(FakeDB([]),sql(),'num',3,form='text')
@@ -0,0 +1,78 @@
+# Tests for db_parallel partition helpers (no server needed)
+import datetime
+import pytest
+
+pytest.importorskip('MySQLdb') #db_parallel imports db_pool
+import db_utils.bldsql as bldsql
+import db_utils.db_parallel as db_parallel
+
+def test_num_ranges():
+    assert db_parallel.numRanges(1,100,4)==[(1,26),(26,51),(51,76),(76,101)]
+    r=db_parallel.numRanges(5,7,10)
+    assert r[0][0]==5 and r[-1][1]==8 and all(a[1]==b[0] for a,b in zip(r,r[1:]))
+
+def covers(ranges,start,end):
+    return ranges[0][0]==start and ranges[-1][1]==end and all(a[1]==b[0] and a[0]<a[1] for a,b in zip(ranges,ranges[1:]))
+
+def test_date_ranges_n():
+    s,e=datetime.datetime(2020,1,1),datetime.datetime(2020,1,2)
+    r=db_parallel.dateRanges(s,e,n=4)
+    assert len(r)==4 and covers(r,s,e)
+
+def test_date_ranges_step():
+    s,e=datetime.date(2000,1,1),datetime.date(2003,1,1)
+    r=db_parallel.dateRanges(s,e,step=datetime.timedelta(days=365))
+    assert covers(r,s,e) and len(r)==4
+
+def test_date_ranges_more_ranges_than_days():
+    #used to loop forever; date+part of a day==date
+    s,e=datetime.date(2020,1,1),datetime.date(2020,1,4)
+    r=db_parallel.dateRanges(s,e,n=10)
+    assert r==[(datetime.date(2020,1,1),datetime.date(2020,1,2)),(datetime.date(2020,1,2),datetime.date(2020,1,3)),(datetime.date(2020,1,3),datetime.date(2020,1,4))]
+
+def test_date_ranges_bad_step():
+    with pytest.raises(ValueError):
+        db_parallel.dateRanges(datetime.datetime(2020,1,1),datetime.datetime(2020,1,2),step=datetime.timedelta(0))
+
+def test_value_chunks():
+    assert db_parallel.valueChunks(range(10),3)==[[0,1,2,3],[4,5,6,7],[8,9]]
+
+def sql():
+    s=bldsql.BldSQL()
+    s.table("flask_event")
+    s.col("num")
+    s.where("site_num=%s",75)
+    return s
+
+def test_partition_queries_ranges():
+    s=sql()
+    q=db_parallel.partitionQueries(s,"num",[(1,10),(10,20)])
+    assert len(q)==2
+    assert "num>=%s" in q[0][0] and "num<%s" in q[0][0]
+    assert list(q[1][1])==[75,10,20]
+    assert s.bind()==(75,) #not modified
+
+def test_partition_queries_values():
+    q=db_parallel.partitionQueries(sql(),"num",[[1,2,3],[4]])
+    assert " in (" in q[0][0] and list(q[0][1])==[75,1,2,3]
+    assert list(q[1][1])==[75,4]
+
+def test_partition_queries_long_value_lists_inline():
+    #partitions over the temptable threshold used to reference a temp table the worker never made
+    values=list(range(2500))
+    q=db_parallel.partitionQueries(sql(),"num",[values[:1500],values[1500:]])
+    assert all(isinstance(query,str) for query,p in q)
+    assert "tmp." not in q[0][0] and len(q[0][1])==1501 and list(q[1][1])==[75]+values[1500:]
+
+def test_partition_queries_caller_temptable():
+    #wherein temp tables in the caller's sql are loaded by the worker's doquery, so the BldSQL object is passed
+    s=sql()
+    s.wherein("gas_num in",list(range(2000)))
+    q=db_parallel.partitionQueries(s,"num",[(1,10),(10,20)])
+    assert all(isinstance(query,bldsql.BldSQL) and p is None for query,p in q)
+    assert len(q[0][0].whereinTables())==1 and list(q[1][0].bind())==[75,10,20]
+
+def test_partition_queries_zero_bound():
+    #where() binds falsy values (numRanges(0,...) starts at 0)
+    q=db_parallel.partitionQueries(sql(),"num",db_parallel.numRanges(0,9,2))
+    assert list(q[0][1])==[75,0,5] and q[0][0].count("%s")==3
@@ -0,0 +1,118 @@
+# Tests for db_pool.ConnectionPool checkout/checkin, reset and limits (fake connections, no server needed)
+import threading
+import time
+import pytest
+
+pytest.importorskip('MySQLdb')
+import db_utils.db_pool as db_pool
+import db_utils.db_prepared as db_prepared
+
+class Conn(object):
+    def __init__(self,**args):
+        self.args=args
+        self.log=[]
+        self.alive=True
+        self.failReset=False
+    def ping(self):
+        if not self.alive : raise Exception("gone away")
+    def rollback(self):
+        self.log.append('rollback')
+    def autocommit(self,on):
+        self.log.append(('autocommit',on))
+    def change_user(self,user,passwd,db):
+        if self.failReset : raise Exception("lost connection")
+        self.log.append(('change_user',user,db))
+    def close(self):
+        self.log.append('close')
+
+class Cursor(object):
+    def execute(self,q,p=None):
+        pass
+
+@pytest.fixture
+def connects(monkeypatch):
+    made=[]
+    def connect(**args):
+        made.append(Conn(**args))
+        return made[-1]
+    monkeypatch.setattr(db_pool.MySQLdb,'connect',connect)
+    return made
+
+def checkout(pool,db='ccgg',**kwargs):
+    return pool.checkout('h','u','pw',db,**kwargs)
+
+def test_reuse_and_checkin_reset(connects):
+    pool=db_pool.ConnectionPool()
+    a=checkout(pool)
+    assert connects==[a] and a.args==dict(host='h',user='u',passwd='pw',db='ccgg')
+    db_prepared.statementCache(a).prepare(Cursor(),"select 1")
+    pool.checkin(a)
+    assert a.log==['rollback',('autocommit',True),('change_user','u','ccgg')]
+    assert len(db_prepared.statementCache(a))==0 #server dropped them with change_user
+    assert checkout(pool) is a and len(connects)==1
+    s=pool.stats()
+    assert s['hits']==1 and s['misses']==1 and s['resets']==1 and s['inUse']==1 and s['idle']==0
+
+def test_no_reset_session(connects):
+    pool=db_pool.ConnectionPool(resetSession=False)
+    a=checkout(pool)
+    pool.checkin(a)
+    assert a.log==['rollback',('autocommit',True)] and pool.stats()['resets']==0
+
+def test_failed_reset_discards(connects):
+    pool=db_pool.ConnectionPool()
+    a=checkout(pool)
+    a.failReset=True
+    pool.checkin(a)
+    assert a.log[-1]=='close' and pool.stats()['discarded']==1 and pool.stats()['idle']==0
+    assert checkout(pool) is not a
+
+def test_keys(connects):
+    pool=db_pool.ConnectionPool()
+    a=checkout(pool)
+    pool.checkin(a)
+    assert checkout(pool,db='other') is not a
+    assert checkout(pool,convKey='epoch') is not a
+    assert checkout(pool,local_infile=1).args['local_infile']==1
+
+def test_exhausted_times_out(connects):
+    pool=db_pool.ConnectionPool(maxSize=2,waitTimeout=.05)
+    checkout(pool);checkout(pool)
+    with pytest.raises(db_pool.PoolTimeout):
+        checkout(pool)
+    s=pool.stats()
+    assert s['timeouts']==1 and s['waits']==1 and s['inUse']==2 and len(connects)==2
+    checkout(pool,db='other') #other keys have their own limit
+
+def test_exhausted_waits_for_checkin(connects):
+    pool=db_pool.ConnectionPool(maxSize=1,waitTimeout=5)
+    a=checkout(pool)
+    t=threading.Timer(.05,pool.checkin,[a])
+    t.start()
+    assert checkout(pool) is a
+    t.join()
+    assert pool.stats()['waits']==1 and len(connects)==1
+
+def test_dead_idle_replaced(connects):
+    pool=db_pool.ConnectionPool()
+    a=checkout(pool)
+    pool.checkin(a)
+    a.alive=False
+    b=checkout(pool)
+    assert b is not a and a.log[-1]=='close' and pool.stats()['reconnects']==1
+
+def test_idle_timeout(connects):
+    pool=db_pool.ConnectionPool(idleTimeout=0)
+    a=checkout(pool)
+    pool.checkin(a)
+    time.sleep(.01)
+    assert checkout(pool) is not a and pool.stats()['discarded']==1
+
+def test_close_all(connects):
+    pool=db_pool.ConnectionPool()
+    a,b=checkout(pool),checkout(pool)
+    pool.checkin(a)
+    pool.closeAll()
+    assert a.log[-1]=='close' and pool.stats()['idle']==0
+    pool.checkin(b) #checked out ones are closed on return
+    assert b.log[-1]=='close' and pool.stats()['inUse']==0
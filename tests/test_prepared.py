@@ -0,0 +1,53 @@
+# Tests for db_prepared statement caching and execute forms (a recording cursor, no server needed)
+import pytest
+
+pytest.importorskip('MySQLdb')
+import db_utils.db_prepared as db_prepared
+
+class Cursor(object):
+    def __init__(self,log):
+        self.log=log
+    def execute(self,q,p=None):
+        self.log.append((q,tuple(p) if p is not None else None))
+    def nextset(self):
+        return None
+    def close(self):
+        pass
+
+class Conn(object):
+    def __init__(self,info):
+        self.info=info
+        self.log=[]
+    def get_server_info(self):
+        return self.info
+    def cursor(self):
+        return Cursor(self.log)
+
+def test_to_qmark():
+    assert db_prepared.toQmark("select * from t where a=%s and b like 'x%%'")=="select * from t where a=? and b like 'x%'"
+    with pytest.raises(ValueError) : db_prepared.toQmark("select %d")
+
+def test_lru():
+    log=[]
+    c=db_prepared.StatementCache(maxStatements=2)
+    a=c.prepare(Cursor(log),"select 1")
+    c.prepare(Cursor(log),"select 2")
+    assert c.prepare(Cursor(log),"select 1")==a
+    c.prepare(Cursor(log),"select 3")
+    assert len(c)==2 and log[-1]==("deallocate prepare _dbc_s2",None)
+
+@pytest.mark.parametrize('info,literal',[('10.6.12-MariaDB','yes'),('5.5.5-10.11.2-MariaDB-log','yes'),('8.0.36','no'),('10.1.48-MariaDB','no')])
+def test_execute_forms_and_release(info,literal):
+    conn=Conn(info)
+    db_prepared.execute(conn,conn.cursor(),"select * from t where a=%s and b=%s",[1,'x'])
+    db_prepared.execute(conn,conn.cursor(),"select * from t where a=%s and b=%s",[2,'y'])
+    assert conn.log[0]==("prepare _dbc_s1 from %s",("select * from t where a=? and b=?",))
+    if literal=='yes' : assert conn.log[-1]==("execute _dbc_s1 using %s,%s",(2,'y'))
+    else : assert conn.log[-1]==("set @_dbc_p0=%s,@_dbc_p1=%s; execute _dbc_s1 using @_dbc_p0,@_dbc_p1",(2,'y'))
+    assert len(conn.log)==3 #prepared once
+    db_prepared.release(conn)
+    expected="deallocate prepare _dbc_s1"+("" if literal=='yes' else "; set @_dbc_p0=null,@_dbc_p1=null")
+    assert conn.log[-1]==(expected,None)
+    n=len(conn.log)
+    db_prepared.release(conn) #nothing left
+    assert len(conn.log)==n
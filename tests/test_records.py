@@ -0,0 +1,52 @@
+# Tests for db_records Record rows and ResultSet
+import pickle
+import pytest
+
+import db_utils.db_records as db_records
+
+header=['num','value','count','index','flag']
+rows=[(1,2.5,10,0,'a'),(2,3.5,20,1,None)]
+
+def test_record_access():
+    r=db_records.toRecords(rows,header)
+    assert len(r)==2 and r[0]==rows[0] and isinstance(r[0],tuple)
+    assert r[0]['value']==2.5 and r[0].value==2.5 and r[0][1]==2.5
+    assert r[1].get('flag') is None and r[1].get('missing','x')=='x'
+    assert r[0].keys()==tuple(header) and r[0].values()==rows[0]
+    assert r[0].asDict()==dict(zip(header,rows[0])) and dict(r[0].items())==r[0].asDict()
+    with pytest.raises(KeyError):
+        r[0]['missing']
+    with pytest.raises(AttributeError):
+        r[0].missing
+
+def test_record_column_names_shadowing_tuple_methods():
+    r=db_records.toRecords(rows,header)[1]
+    assert r.count==20 and r.index==1
+    #records without those columns keep the tuple methods
+    r=db_records.toRecords([(1,1,2)],['a','b','c'])[0]
+    assert r.count(1)==2 and r.index(2)==2
+
+def test_record_contains_tests_names():
+    r=db_records.toRecords(rows,header)[0]
+    assert 'value' in r and 'missing' not in r
+    assert 2.5 not in r
+
+def test_record_type_shared_and_pickle():
+    a=db_records.toRecords(rows,header)
+    assert type(a[0]) is type(a[1]) is db_records.recordType(header)
+    b=pickle.loads(pickle.dumps(a))
+    assert b==a and b[1].count==20 and b[0]['flag']=='a'
+
+def test_resultset():
+    rs=db_records.ResultSet.fromRows(rows,header)
+    assert len(rs)==2 and bool(rs)
+    assert rs[1]['count']==20 and rs[-1]['num']==2 and rs['value']==[2.5,3.5] and rs.column('num')==[1,2]
+    assert 'flag' in rs[0] and 'missing' not in rs[0]
+    assert [row['num'] for row in rs]==[1,2]
+    assert rs.rows()==rows and rs[0].asDict()==dict(zip(header,rows[0]))
+    with pytest.raises(IndexError):
+        rs[2]
+
+def test_resultset_empty():
+    rs=db_records.ResultSet.fromRows([],header)
+    assert len(rs)==0 and not rs and rs['num']==[] and rs.rows()==[]
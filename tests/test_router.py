@@ -0,0 +1,127 @@
+# Tests for db_router and read routing in DatabaseConn.doquery (fake connections, no server needed)
+import random
+import pytest
+
+import db_utils.db_router as db_router
+import db_utils.db_conn as db_conn
+import db_utils.db_cache as db_cache
+
+@pytest.mark.parametrize('query',["select * from t","  (select 1)","with x as (select 1) select * from x","show tables","explain select 1",
+    "/* hint */ select 1","-- note\nselect 1",b"select 1"])
+def test_is_read_only(query):
+    assert db_router.isReadOnly(query)
+
+@pytest.mark.parametrize('query',["insert t values (1)","update t set a=1","call p()","select * from t for update","select * from tmp.t",
+    "select @x","select last_insert_id()","select get_lock('a',1)","create temporary table x select 1","select 1 into outfile '/tmp/x'"])
+def test_is_not_read_only(query):
+    assert not db_router.isReadOnly(query)
+
+def test_parse_host():
+    assert db_router.parseHost("db1")==("db1",None)
+    assert db_router.parseHost("db1:3307")==("db1",3307)
+
+def test_choose_least_connections():
+    r=db_router.Router('p',['a','b'])
+    assert r.choose()=='a' and r.choose()=='b' and r.choose()=='a'
+    r.release('a');r.release('a')
+    assert r.choose()=='a'
+    assert r.stats()['a']['queries']==3
+
+def test_choose_skips_down_and_lagging():
+    r=db_router.Router('p',['a','b','c'],maxLag=10)
+    r.markDown('a')
+    r.checked('b',60,.01)
+    assert r.choose()=='c'
+    assert r.choose(exclude=['c']) is None and r.stats()['primary']['reads']==1
+    assert r.stats()['a']['down'] and r.stats()['a']['failures']==1
+
+def test_latency_policy(monkeypatch):
+    #replicas are picked at random weighted by 1/latency (unmeasured first); check the weights and that the pick is the one used
+    calls=[]
+    def choices(population,weights):
+        calls.append(([h.name for h in population],weights))
+        return [population[-1]]
+    monkeypatch.setattr(db_router.random,'choices',choices)
+    r=db_router.Router('p',['a','b','c'],policy='latency',maxLag=10)
+    r.checked('a',0,.001)
+    r.checked('b',0,.01)
+    assert r.choose()=='c' and calls[-1]==(['a','b','c'],[1000.,100.,1e4])
+    r.checked('c',60,.5) #lagging
+    assert r.choose()=='b' and calls[-1]==(['a','b'],[1000.,100.])
+    assert r.choose(exclude=['b'])=='a' and calls[-1]==(['a'],[1000.])
+    assert r.stats()['b']['inFlight']==1 and r.stats()['a']['inFlight']==1 and r.stats()['c']['queries']==1
+    r.markDown('a')
+    r.checked('b',11,.01)
+    n=len(calls)
+    assert r.choose() is None and len(calls)==n and r.stats()['primary']['reads']==1 #none usable, the primary
+    with pytest.raises(ValueError):
+        db_router.Router('p',['a'],policy='random')
+
+def test_latency_policy_distribution(monkeypatch):
+    monkeypatch.setattr(db_router,'random',random.Random(5))
+    r=db_router.Router('p',['a','b'],policy='latency')
+    r.checked('a',0,.001)
+    r.checked('b',0,.003)
+    picks=[r.choose() for i in range(4000)]
+    assert picks.count('b')==pytest.approx(1000,abs=120) #weights 1000:333
+
+def test_due_for_check():
+    r=db_router.Router('p',['a','b'],checkInterval=10)
+    assert r.dueForCheck(now=100)==['a','b'] and r.dueForCheck(now=105)==[] and r.dueForCheck(now=111)==['a','b']
+
+def test_shared_router():
+    assert db_router.router('p1',['a']) is db_router.router('p1',['a'])
+
+
+class Cursor(object):
+    def __init__(self,conn):
+        self.conn=conn
+        self.description=None
+        self.rowcount=0
+        self.rows=[]
+    def execute(self,query,parameters=None):
+        self.conn.queries.append(query)
+        if query=="show slave status" : self.rows=[]
+        else : self.rows=[(self.conn.host,)]
+        self.description=[('host',253,None,None,None,None,1)]
+        self.rowcount=self.rownumber=len(self.rows)
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+    def fetchall(self):
+        return self.rows
+    def __iter__(self):
+        return iter(self.rows)
+    def close(self):
+        pass
+
+class Conn(object):
+    converter={}
+    def __init__(self,host):
+        self.host=host
+        self.queries=[]
+    def cursor(self,cls=None):
+        return Cursor(self)
+    def autocommit(self,on):
+        pass
+    def close(self):
+        pass
+
+class RoutedConn(db_conn.DatabaseConn):
+    def _open(self,host,port):
+        return Conn(host)
+
+def test_routed_reads():
+    db=RoutedConn(host='p',replicas=db_router.Router('p',['r1']),convProfile='default')
+    assert db.doquery("select host",form='list')==[('r1',)]
+    assert db.doquery("update t set a=1",form='list')==[('p',)]
+    assert db.doquery("select host",form='list')==[('p',)] #read your writes
+    db.close()
+
+def test_routed_read_checks_cache_once():
+    cache=db_cache.QueryCache()
+    db=RoutedConn(host='p',replicas=db_router.Router('p',['r1']),cache=cache,convProfile='default')
+    assert db.doquery("select host",form='list',cacheTTL=60)==[('r1',)]
+    assert cache.stats()['misses']==1 and cache.stats()['puts']==1
+    assert db.doquery("select host",form='list',cacheTTL=60)==[('r1',)]
+    assert cache.stats()['hits']==1 and cache.stats()['misses']==1
+    db.close()
@@ -0,0 +1,141 @@
+# Tests for db_shm shared results across processes (numpy only, no server needed)
+import os
+import gc
+import pickle
+import struct
+import multiprocessing
+import numpy as np
+import pytest
+
+import db_utils.db_shm as db_shm
+
+backends=pytest.mark.parametrize('backend',db_shm.backends)
+ctx=multiprocessing.get_context('fork') #the test package alias isn't importable from a spawned interpreter
+
+def _arrays():
+    return dict(num=np.arange(1000,dtype='int64'),value=np.linspace(0,1,1000),site=np.array(['MLO',None]*500,dtype=object))
+
+def _gone(h):
+    #True if the data and the reference file have been removed
+    if os.path.exists(h.refsPath) : return False
+    if h.backend=='file' : return not os.path.exists(h.path)
+    try : db_shm._openShm(h.name).close()
+    except FileNotFoundError : return True
+    return False
+
+def _work(h):
+    with h as a:
+        return int(a['num'].sum()),float(a['value'][-1]),str(a['site'][1]),h.refCount()
+
+def _detached(h):
+    #a copy of handle h as another process gets it
+    return pickle.loads(pickle.dumps(h))
+
+@backends
+def test_share_attach_release(backend,tmp_path):
+    h=db_shm.share(_arrays(),backend,dir=str(tmp_path))
+    assert h.refCount()==1 and len(h)==1000
+    a=h.attach()
+    assert a['num'][999]==999 and list(a['site'][:2])==['MLO',''] and not a['value'].flags.writeable
+    h2=_detached(h)
+    assert h2._arrays is None and h2.refCount()==1 #pickling doesn't take a reference
+    assert h2.attach()['value'][-1]==1. and h.refCount()==2
+    h2.release()
+    h2.release() #once only
+    assert h.refCount()==1 and not _gone(h)
+    h.release()
+    assert h.refCount()==0 and _gone(h)
+
+@backends
+def test_workers(backend,tmp_path):
+    h=db_shm.share(_arrays(),backend,dir=str(tmp_path))
+    with ctx.Pool(3) as pool:
+        r=pool.map(_work,[h]*6)
+    assert all(x[:3]==(499500,1.,'') for x in r) and all(2<=x[3]<=4 for x in r) #the caller's reference plus the attached workers'
+    assert h.refCount()==1 #workers released theirs
+    h.release()
+    assert _gone(h)
+
+@backends
+def test_last_release_in_child(backend,tmp_path):
+    #share, the caller releases while a child holds a reference; the child's release removes the data
+    h=db_shm.share(_arrays(),backend,dir=str(tmp_path))
+    h2=_detached(h)
+    h2.attach()
+    h.release()
+    assert h.refCount()==1 and not _gone(h)
+    p=ctx.Process(target=h2.release)
+    p.start()
+    p.join()
+    assert p.exitcode==0 and _gone(h)
+    with pytest.raises(ValueError,match="has been released"):
+        _detached(h).attach()
+    with pytest.raises(ValueError):
+        with _detached(h) : pass
+
+@backends
+def test_gc_releases(backend,tmp_path):
+    h=db_shm.share(_arrays(),backend,dir=str(tmp_path))
+    h2=_detached(h)
+    h2.attach()
+    assert h.refCount()==2
+    del h2
+    gc.collect()
+    assert h.refCount()==1
+    h.release()
+    assert _gone(h)
+
+@backends
+def test_arrays_outlive_release(backend,tmp_path):
+    #the mapping stays valid while arrays from attach() are referenced (close() is deferred), it isn't reused
+    h=db_shm.share(_arrays(),backend,dir=str(tmp_path))
+    a=h.attach()['num']
+    h.release()
+    assert _gone(h) and a[10]==10
+
+@backends
+def test_destroy(backend,tmp_path):
+    h=db_shm.share(_arrays(),backend,dir=str(tmp_path))
+    h2=_detached(h)
+    h2.attach()
+    h.destroy()
+    assert _gone(h) and h.refCount()==0
+    h2.release() #nothing left to drop
+    with pytest.raises(ValueError):
+        _detached(h).attach()
+
+def test_attach_failure_restores_count(tmp_path):
+    h=db_shm.share(_arrays(),'file',dir=str(tmp_path))
+    os.unlink(h.path)
+    with pytest.raises(FileNotFoundError):
+        _detached(h).attach()
+    assert h.refCount()==1
+    h.release()
+    assert _gone(h)
+
+def _bump(refsPath,n):
+    for i in range(n):
+        db_shm._addRef(refsPath,1)
+        db_shm._addRef(refsPath,-1)
+
+def test_ref_count_file(tmp_path):
+    refs=str(tmp_path/'x.refs')
+    with open(refs,'xb') as f : f.write(struct.pack('q',1))
+    procs=[ctx.Process(target=_bump,args=(refs,200)) for i in range(4)]
+    for p in procs : p.start()
+    for p in procs : p.join()
+    assert all(p.exitcode==0 for p in procs)
+    assert db_shm._addRef(refs,1)==2 #no updates lost
+    removed=[]
+    assert db_shm._addRef(refs,-1,lambda: removed.append(1))==1 and not removed
+    assert db_shm._addRef(refs,-1,lambda: removed.append(1))==0 and removed==[1] and not os.path.exists(refs)
+    with pytest.raises(ValueError):
+        db_shm._addRef(refs,1)
+
+def test_share_errors(tmp_path):
+    with pytest.raises(ValueError,match="Unknown shared backend"):
+        db_shm.share(_arrays(),'pipe')
+    h=db_shm.share(dict(),'file',dir=str(tmp_path))
+    assert len(h)==0 and h.attach()=={}
+    h.release()
+    assert _gone(h)
@@ -0,0 +1,123 @@
+# Tests for db_snapshot sync/merge (a fake db returning numpy results, no server needed)
+import os
+import datetime
+import numpy as np
+import pytest
+
+import db_utils.bldsql as bldsql
+import db_utils.db_snapshot as db_snapshot
+import db_utils.db_paging as db_paging
+
+class FakeDB(object):
+    #doquery returns the queued results in turn and records the (sql,bind) it was called with
+    def __init__(self):
+        self.results=[]
+        self.queries=[]
+    def doquery(self,sql,form=None,numpyFloat64=True,numpyDatetime64=False):
+        assert form=='numpy' and numpyDatetime64
+        self.queries.append((sql.cmd(),sql.bind()))
+        r=self.results.pop(0)
+        if isinstance(r,Exception) : raise r
+        return r
+
+def _sql(*cols):
+    s=bldsql.BldSQL()
+    s.initQuery()
+    s.table("flask_data d")
+    for c in cols : s.col(c)
+    s.where("d.parameter_num=%s",1)
+    return s
+
+def _cols(num,value,mdt=None):
+    r=dict(data_num=np.array(num,dtype='int64'),value=np.array(value,dtype='float64'))
+    if mdt is not None : r['mdt']=np.array(mdt,dtype='datetime64[s]')
+    return r
+
+def _gens(path):
+    return sorted(d for d in os.listdir(path) if d.startswith('g'))
+
+def test_append_only(tmp_path):
+    path=str(tmp_path)
+    db=FakeDB()
+    sql=_sql("d.data_num","d.value")
+    db.results=[_cols([3,1,2],[30.,10.,20.]),_cols([5,4],[50.,40.]),None]
+    meta,n=db_snapshot.sync(db,sql,path,key='d.data_num')
+    a=db_snapshot.load(path,meta)
+    assert n==3 and list(a['data_num'])==[1,2,3] and list(a['value'])==[10.,20.,30.]
+    assert db_paging.decodeToken(meta['hwm'],['d.data_num'])==(3,)
+    assert db.queries[0]==(sql.cmd(),(1,)) #first sync selects everything
+    first=meta['generation']
+
+    meta,n=db_snapshot.sync(db,sql,path,key='d.data_num')
+    assert "d.data_num>%s" in db.queries[1][0] and db.queries[1][1]==(1,3)
+    a=db_snapshot.load(path,meta)
+    assert n==2 and list(a['data_num'])==[1,2,3,4,5] and list(a['value'])==[10.,20.,30.,40.,50.]
+    assert db_paging.decodeToken(meta['hwm'],['d.data_num'])==(5,)
+    assert _gens(path)==[meta['generation']] and meta['generation']!=first #old generation removed
+
+    meta2,n=db_snapshot.sync(db,sql,path,key='d.data_num') #nothing new
+    assert n==0 and meta2==meta and db.queries[2][1]==(1,5)
+    assert isinstance(a['value'],np.memmap) and not a['value'].flags.writeable
+
+def test_since_alias(tmp_path):
+    #since is a select alias; the where clause uses the column's expression and rows changed since the mark replace the old ones
+    path=str(tmp_path)
+    db=FakeDB()
+    sql=_sql("d.data_num","d.value","d.modification_datetime as mdt")
+    t0,t1,t2='2024-01-01T00:00:00','2024-01-02T00:00:00','2024-01-03T00:00:00'
+    db.results=[_cols([1,2,3],[10.,20.,30.],[t0,t1,t1]),_cols([4,2],[40.,21.],[t2,t1])]
+    meta,n=db_snapshot.sync(db,sql,path,key='data_num',since='mdt')
+    assert db_paging.decodeToken(meta['hwm'],['mdt'])==(datetime.datetime(2024,1,2),)
+
+    meta,n=db_snapshot.sync(db,sql,path,key='data_num',since='mdt')
+    cmd,bind=db.queries[1]
+    assert "d.modification_datetime>=%s" in cmd and 'mdt>' not in cmd and bind==(1,datetime.datetime(2024,1,2))
+    a=db_snapshot.load(path,meta)
+    assert n==2 and list(a['data_num'])==[1,2,3,4] and list(a['value'])==[10.,21.,30.,40.]
+    assert a['mdt'][1]==np.datetime64(t1) and a['mdt'][3]==np.datetime64(t2)
+    assert db_paging.decodeToken(meta['hwm'],['mdt'])==(datetime.datetime(2024,1,3),)
+
+def test_hwm_not_lowered(tmp_path):
+    path=str(tmp_path)
+    db=FakeDB()
+    sql=_sql("d.data_num","d.value","d.modification_datetime as mdt")
+    db.results=[_cols([1,2],[10.,20.],['2024-01-05T00:00:00','2024-01-01T00:00:00']),_cols([2],[21.],['NaT'])]
+    db_snapshot.sync(db,sql,path,key='data_num',since='mdt')
+    meta,n=db_snapshot.sync(db,sql,path,key='data_num',since='mdt')
+    assert n==1 and db_paging.decodeToken(meta['hwm'],['mdt'])==(datetime.datetime(2024,1,5),)
+
+def test_rebuilds(tmp_path):
+    path=str(tmp_path)
+    db=FakeDB()
+    sql=_sql("d.data_num","d.value")
+    db.results=[_cols([1],[10.]),_cols([1,2],[11.,20.]),_cols([1,2],[12.,20.]),dict(data_num=np.array([3]),other=np.array([1.])),
+        _cols([1,2,3],[12.,20.,30.])]
+    db_snapshot.sync(db,sql,path,key='data_num')
+    meta,n=db_snapshot.sync(db,sql,path,key='data_num',refresh=True)
+    assert n==2 and db.queries[1][1]==(1,) and list(db_snapshot.load(path,meta)['value'])==[11.,20.]
+    sql.where("d.flag=%s",'...') #query changed
+    meta,n=db_snapshot.sync(db,sql,path,key='data_num')
+    assert n==2 and db.queries[2][1]==(1,'...')
+    meta,n=db_snapshot.sync(db,sql,path,key='data_num') #the columns changed, so the merge is abandoned for a full rebuild
+    assert db.queries[3][1]==(1,'...',2) and db.queries[4][1]==(1,'...')
+    assert n==3 and list(db_snapshot.load(path,meta)['data_num'])==[1,2,3] and _gens(path)==[meta['generation']]
+
+def test_failed_sync_keeps_snapshot(tmp_path):
+    path=str(tmp_path)
+    db=FakeDB()
+    sql=_sql("d.data_num","d.value")
+    db.results=[_cols([1,2],[10.,20.]),RuntimeError("lost connection")]
+    meta,n=db_snapshot.sync(db,sql,path,key='data_num')
+    with pytest.raises(RuntimeError):
+        db_snapshot.sync(db,sql,path,key='data_num')
+    assert db_snapshot.readMeta(path)==meta and _gens(path)==[meta['generation']]
+    assert list(db_snapshot.load(path)['value'])==[10.,20.]
+
+def test_empty(tmp_path):
+    path=str(tmp_path)
+    db=FakeDB()
+    db.results=[None,_cols([1],[10.])]
+    meta,n=db_snapshot.sync(db,_sql("d.data_num","d.value"),path,key='data_num')
+    assert n==0 and meta['hwm'] is None and db_snapshot.load(path,meta) is None
+    meta,n=db_snapshot.sync(db,_sql("d.data_num","d.value"),path,key='data_num') #no mark yet, selects everything
+    assert n==1 and db.queries[1][1]==(1,)
@@ -0,0 +1,92 @@
+# Tests for db_stats fingerprints, Aggregator percentiles and SlowQueryLog (no server needed)
+import json
+import random
+import pytest
+
+import db_utils.db_stats as db_stats
+
+def stats(query,total,error=None,parameters=None):
+    s=db_stats.QueryStats(query,parameters,'list')
+    s.totalTime=total
+    s.rows=1
+    s.error=error
+    return s
+
+@pytest.mark.parametrize('a,b',[
+    ("select * from t where num=5","SELECT *  from t\n where num=%s"),
+    ("select * from t where name='o''hare' and x=1.5e3","select * from t where name=\"x\" and x=2"),
+    ("select * from t where num in (1,2,3)","select * from t where num in (%s,%s)"),
+])
+def test_fingerprint_groups(a,b):
+    assert db_stats.fingerprint(a)==db_stats.fingerprint(b)
+
+def test_fingerprint_text():
+    assert db_stats.fingerprint("select a from t1 where x in (1, 2) and y='z'")=="select a from t1 where x in (...) and y=?"
+    assert db_stats.fingerprint("select * from t where a=1")!=db_stats.fingerprint("select * from t where b=1")
+
+def test_aggregator_percentiles():
+    agg=db_stats.Aggregator()
+    durations=list(range(1,101))
+    random.Random(1).shuffle(durations)
+    for d in durations : agg(stats("select * from t where num=%d" % d,d),None)
+    agg(stats("select 1",.5,error="boom"),None)
+    s=agg.summary()
+    assert [r['fingerprint'] for r in s]==["select * from t where num=?","select ?"]
+    r=s[0]
+    assert r['count']==100 and r['totalTime']==5050 and r['mean']==50.5 and r['rows']==100
+    assert r['p50'] in (50,51) and r['p95']==95 and r['p99']==99
+    assert s[1]['errors']==1 and s[1]['p50']==.5
+    assert len(agg.report().splitlines())==3
+
+def test_aggregator_reservoir():
+    random.seed(5)
+    agg=db_stats.Aggregator(maxSamples=500)
+    for i in range(20000) : agg(stats("select 1",i/20000.),None)
+    r=agg.summary()[0]
+    assert r['count']==20000 and len(agg._data["select ?"]['samples'])==500
+    assert abs(r['p50']-.5)<.1 and abs(r['p95']-.95)<.05
+
+def test_aggregator_dump_and_reset(tmp_path):
+    agg=db_stats.Aggregator()
+    agg(stats("select 1",1),None)
+    agg.dump(str(tmp_path/'s.json'))
+    assert json.load(open(str(tmp_path/'s.json')))[0]['count']==1
+    agg.reset()
+    assert agg.summary()==[]
+
+class DB(object):
+    def __init__(self,fail=False):
+        self.fail=fail
+        self.explained=[]
+    def explain(self,query,parameters):
+        if self.fail : raise Exception("no such table")
+        self.explained.append((query,parameters))
+        return [{'table':'t'}]
+
+def test_slow_query_log_threshold():
+    log=db_stats.SlowQueryLog(threshold=1.0,maxEntries=2)
+    db=DB()
+    log(stats("select * from t where a=%s",.999,parameters=(1,)),db)
+    assert not log.entries and not db.explained
+    log(stats("select * from t where a=%s",1.0,parameters=(1,)),db)
+    assert len(log.entries)==1 and log.entries[0]['explain']==[{'table':'t'}] and db.explained==[("select * from t where a=%s",(1,))]
+    log(stats("update t set a=1",5),db) #only selects are explained
+    log(stats("select 2",5,error="gone away"),db)
+    assert len(log.entries)==2 and [e['explain'] for e in log.entries]==[None,None] and len(db.explained)==1
+    log(stats("select 3",5),DB(fail=True))
+    assert log.entries[-1]['explain']=="explain failed: no such table"
+    assert db_stats.SlowQueryLog(threshold=0,explain=False)(stats("select 1",0),db) is None and len(db.explained)==1
+
+def test_hooks(capsys):
+    seen=[]
+    def bad(s,db) : raise ValueError("oops")
+    hook=db_stats.addHook(lambda s,db: seen.append(s))
+    db_stats.addHook(bad)
+    try:
+        assert db_stats.enabled()
+        db_stats.record(stats("select 1",1))
+        assert len(seen)==1 and "failed: oops" in capsys.readouterr().err
+    finally:
+        db_stats.removeHook(hook)
+        db_stats.removeHook(bad)
+    assert not db_stats.enabled()
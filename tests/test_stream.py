@@ -0,0 +1,58 @@
+# Streaming (SSCursor) doquery paths and form='iter' against a local server (see the server fixture in conftest.py)
+import gc
+import pytest
+
+import db_utils.db_conn as db_conn
+
+ROWS=25000
+QUERY="select n,concat('row ',n) as name from t__db_utils_stream order by n"
+
+@pytest.fixture(scope='module')
+def db(server):
+    db=db_conn.DatabaseConn(**server)
+    db.doquery("drop table if exists t__db_utils_stream")
+    db.doquery("create table t__db_utils_stream (n int primary key)")
+    db.bulkLoad('t__db_utils_stream',['n'],((i,) for i in range(ROWS)),method='values')
+    yield db
+    db.doquery("drop table if exists t__db_utils_stream")
+    db.close()
+
+def test_iter_all_rows(db):
+    rows=list(db.doquery(QUERY,form='iter'))
+    assert len(rows)==ROWS and rows[10]==(10,'row 10')
+    assert next(db.doquery(QUERY,form='iterdict'))=={'n':0,'name':'row 0'}
+
+def test_iter_closed_early_releases_cursor(db):
+    g=db.doquery(QUERY,form='iter')
+    assert [next(g) for i in range(5)]==[(i,'row %d' % i) for i in range(5)]
+    g.close()
+    #the rest of the result was read off the wire, so the connection is usable ("commands out of sync" otherwise)
+    assert db.doquery("select count(*) from t__db_utils_stream",numRows=0)==ROWS
+    assert sum(1 for r in db.doquery(QUERY,form='iter'))==ROWS
+
+def test_iter_abandoned_released_on_gc(db):
+    g=db.doquery(QUERY,form='iter')
+    next(g)
+    del g
+    gc.collect()
+    assert db.doquery("select 1",numRows=0)==1
+
+def test_break_out_of_loop(db):
+    for i,row in enumerate(db.doquery(QUERY,form='iter')):
+        if i==100 : break
+    assert db.doquery("select n from t__db_utils_stream where n=%s",(7,),form='list')==[(7,)]
+
+def test_batches(db):
+    sizes=[len(b) for b in db.doquery(QUERY,form='batches')]
+    assert sum(sizes)==ROWS and max(sizes)<=10000 and len(sizes)==3
+
+def test_stream_list_matches_buffered(db):
+    assert db.doquery(QUERY,form='list',stream=True)==db.doquery(QUERY,form='list',stream=False)
+    assert db.doquery("select 1",numRows=0)==1
+
+def test_stream_file_matches_temp_table_path(db,tmp_path):
+    a,b=str(tmp_path/'a.csv'),str(tmp_path/'b.csv')
+    db.doquery(QUERY,form='csv',outfile=a)
+    db.doquery(QUERY,form='csv',outfile=b,stream=False)
+    with open(a) as fa, open(b) as fb : assert fa.read()==fb.read()
+    with open(a) as f : assert sum(1 for line in f)==ROWS+1
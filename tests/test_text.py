@@ -0,0 +1,72 @@
+# Tests for db_text fixed width formatting against the original listToTextCols (no server needed)
+import io
+import datetime
+import pytest
+
+import db_utils.db_text as db_text
+import db_utils.db_conn as db_conn
+
+def baseline(lines,header):
+    #listToTextCols as it was before db_text
+    spacing=3
+    lines=list(lines)
+    lines.append(header)
+    widths=[max(len(str(value)) for value in column)+spacing for column in zip(*lines)]
+    lines.pop()
+    out=[''.join('%-*s' % item for item in zip(widths,header))]
+    for line in lines : out.append(''.join('%-*s' % item for item in zip(widths,line)))
+    return out
+
+HEADER=['num','site','value','dt']
+ROWS=[(i,'S'*(i%9) or None,i*1.25 if i%4 else None,datetime.datetime(2020,1,1)+datetime.timedelta(hours=i)) for i in range(2500)]
+
+def chunks(rows,size):
+    return [rows[i:i+size] for i in range(0,len(rows),size)]
+
+class Cursor(object):
+    def __init__(self,rows,description):
+        self.rows=list(rows)
+        self.description=description
+    def fetchmany(self,n):
+        r,self.rows=self.rows[:n],self.rows[n:]
+        return r
+
+def test_list_to_text_cols_matches_baseline():
+    assert db_conn.DatabaseConn.listToTextCols(list(ROWS),HEADER)==baseline(ROWS,HEADER)
+
+@pytest.mark.parametrize('size',[1,7,1000,5000])
+def test_exact_matches_baseline(size):
+    assert list(db_text.chunkLines(HEADER,chunks(ROWS,size)))==baseline(ROWS,HEADER)
+
+def test_sample_matches_when_sample_covers_result():
+    rows=ROWS[:db_text.sampleRows]
+    assert list(db_text.chunkLines(HEADER,chunks(rows,100),'sample'))==baseline(rows,HEADER)
+
+def test_cursor_lines_and_write_lines():
+    desc=[(h,253,None,None,None,None,1) for h in HEADER]
+    f=io.StringIO()
+    n=db_text.writeLines(db_text.cursorLines(Cursor(ROWS,desc)),f)
+    assert n==len(ROWS)+1
+    assert f.getvalue()=='\n'.join(baseline(ROWS,HEADER))+'\n'
+
+def test_overflow_policies():
+    rows=[('a','b'),('abcdef','b')]
+    grow=list(db_text.chunkLines(['x','y'],[rows],[2,2],'grow'))
+    assert grow==['x    y    ','a    b    ','abcdef   b    ']
+    trunc=list(db_text.chunkLines(['x','y'],[rows],[2,2],'truncate'))
+    assert trunc[2]=='ab   b    '
+    shift=list(db_text.chunkLines(['x','y'],[rows],[2,2],'shift'))
+    assert shift[1]=='a    b    ' and shift[2]=='abcdef   b    '
+
+def test_empty():
+    assert list(db_text.chunkLines(HEADER,[]))==[]
+    assert list(db_text.chunkLines(HEADER,[],emptyHeader=True))==[''.join('%-*s' % (len(h)+3,h) for h in HEADER)]
+
+def test_bad_widths():
+    with pytest.raises(ValueError) : db_text.chunkLines(HEADER,[],[1,2])
+    with pytest.raises(ValueError) : db_text.chunkLines(HEADER,[],'description')
+    with pytest.raises(ValueError) : db_text.TextFormatter(HEADER,[1,1,1,1],'wrap')
+
+def test_description_widths():
+    desc=[('num',3,11,11,None,None,0),('site',253,None,200,None,None,1)]
+    assert db_text.descriptionWidths(desc)==[11,db_text.maxWidth]
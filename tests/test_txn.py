@@ -0,0 +1,185 @@
+# Tests for db_txn transactions (a recording connection, no server needed)
+import pytest
+
+import db_utils.db_conn as db_conn
+import db_utils.db_txn as db_txn
+import db_utils.db_cache as db_cache
+
+class ServerError(Exception):
+    pass
+
+class Cursor(object):
+    def __init__(self,conn):
+        self.conn=conn
+        self.description=None
+        self.rowcount=0
+        self._sets=0
+    def execute(self,query,parameters=None):
+        self.conn.log.append(query)
+        for text,e in list(self.conn.failOn.items()):
+            if text in (query if isinstance(query,str) else query.decode()) :
+                raise e
+        self._sets=query.count(b";\n") if isinstance(query,bytes) else 0 #one result per batched statement
+        self.rowcount=1
+    def nextset(self):
+        if not self._sets : return None
+        self._sets-=1
+        return True
+    def close(self):
+        self.conn.log.append('close')
+
+class Conn(object):
+    def __init__(self):
+        self.log=[]
+        self.failOn={} #query text -> exception raised by execute
+    def cursor(self,cls=None):
+        return Cursor(self)
+    def literal(self,v):
+        return str(v).encode() if isinstance(v,int) else b"'"+v.encode()+b"'"
+    def autocommit(self,on):
+        self.log.append('autocommit %s' % on)
+    def commit(self):
+        self.log.append('commit')
+    def rollback(self):
+        self.log.append('rollback')
+    def close(self):
+        pass
+
+class RecordingConn(db_conn.DatabaseConn):
+    def _open(self,host,port):
+        return Conn()
+
+def _db(**kwargs):
+    db=RecordingConn(host='p',convProfile='default',**kwargs)
+    return db,db._conn
+
+def test_commit_and_rollback():
+    db,conn=_db()
+    with db.transaction(batchBytes=1000) as t:
+        assert t.execute("update t set a=%s",(1,))==1
+    assert conn.log==['autocommit False',"start transaction","update t set a=%s",'commit','close','autocommit True']
+    assert db._lastWrite>0
+    conn.log.clear()
+    with pytest.raises(KeyError):
+        with db.transaction(isolation='read committed',batchBytes=1000) as t:
+            t.execute("update t set a=%s",(2,))
+            raise KeyError('x')
+    assert conn.log==['autocommit False',"set transaction isolation level read committed","start transaction","update t set a=%s",
+        'rollback','close','autocommit True']
+
+def test_savepoint_release_and_rollback():
+    db,conn=_db()
+    with db.transaction(batchBytes=1000) as t:
+        with t.savepoint() as name:
+            assert name=='sp1'
+            t.add("update t set a=%s",[1])
+        with pytest.raises(ValueError):
+            with t.savepoint():
+                t.execute("update t set a=%s",(2,))
+                t.add("update t set a=%s",[3]) #queued, dropped on rollback
+                raise ValueError()
+        with t.savepoint('mine') : pass
+        t.execute("update t set a=%s",(4,))
+    assert conn.log[1:-3]==["start transaction","savepoint sp1",b"update t set a=1","release savepoint sp1",
+        "savepoint sp2","update t set a=%s","rollback to savepoint sp2","savepoint mine","release savepoint mine","update t set a=%s"]
+    assert conn.log[-3:]==['commit','close','autocommit True']
+
+def test_savepoint_after_deadlock():
+    #the server already rolled back the whole transaction; the failing 'rollback to savepoint' doesn't hide the deadlock
+    db,conn=_db()
+    conn.failOn={"update":ServerError(1213,'Deadlock found'),"rollback to":ServerError(1305,'SAVEPOINT sp1 does not exist')}
+    with pytest.raises(db_conn.DeadlockError):
+        with db.transaction(batchBytes=1000) as t:
+            with t.savepoint() : t.execute("update t set a=1")
+    assert conn.log[-3:]==['rollback','close','autocommit True']
+
+def test_add_batches():
+    db,conn=_db()
+    stmt=b"insert t values (1)"
+    with db.transaction(batchBytes=3*(len(stmt)+2)) as t:
+        for i in range(7) : t.add("insert t values (%s)",(1,))
+        assert t.statements==2 and t.rowcount==6 #2 full batches sent, 1 queued
+        t.execute("update t set a=1") #sends the queue first
+        assert conn.log[-2:]==[stmt,"update t set a=1"]
+        t.add("insert t values (%s)",(1,))
+    batches=[q for q in conn.log if isinstance(q,bytes)]
+    assert batches==[b";\n".join([stmt]*3),b";\n".join([stmt]*3),stmt,stmt]
+    assert conn.log[-3]=='commit' and conn.log[-4]==stmt #flushed before the commit
+    assert t.statements==5 and t.rowcount==8 #4 batches and the update
+
+def test_add_interpolates():
+    db,conn=_db()
+    with db.transaction(batchBytes=1000) as t:
+        t.add("insert t values (%s,%s,'x%%')",(1,'a'))
+        t.add("update t set a=%s where b=%s",[2,'c'])
+        t.add("delete from t")
+    assert conn.log[2]==b"insert t values (1,'a','x%');\nupdate t set a=2 where b='c';\ndelete from t"
+
+def test_batch_error():
+    db,conn=_db()
+    conn.failOn={"values (2)":ServerError(1062,"Duplicate entry")}
+    with pytest.raises(db_conn.QueryError) as e:
+        with db.transaction(batchBytes=1000) as t:
+            t.add("insert t values (%s)",(1,))
+            t.add("insert t values (%s)",(2,))
+    assert e.value.errno==1062 and 'commit' not in conn.log and conn.log[-3]=='rollback'
+
+def test_cache_invalidation():
+    cache=db_cache.QueryCache()
+    db,conn=_db(cache=cache)
+    def fill():
+        cache.put('a',1,tags=['t1'])
+        cache.put('b',2,tags=['t2'])
+    fill()
+    with pytest.raises(ValueError):
+        with db.transaction(batchBytes=1000) as t:
+            t.execute("update t1 set a=1")
+            raise ValueError()
+    assert cache.get('a')==(True,1) #rolled back, nothing invalidated
+    with db.transaction(batchBytes=1000) as t:
+        t.add("insert t1 values (%s)",(1,))
+        t.query("select * from t2") #reads don't invalidate
+        assert cache.get('a')==(True,1) #not until the commit
+    assert cache.get('a')==(False,None) and cache.get('b')==(True,2)
+    fill()
+    with db.transaction(batchBytes=1000) as t : t.execute("call p()")
+    assert cache.get('a')==(False,None) and cache.get('b')==(False,None) #unknown tables drop everything
+
+def test_run_in_transaction_retries(monkeypatch):
+    db,conn=_db()
+    sleeps=[]
+    monkeypatch.setattr(db_txn.time,'sleep',sleeps.append)
+    conn.failOn={"update":ServerError(1213,'Deadlock found')}
+    calls=[]
+    def work(t):
+        calls.append(1)
+        if len(calls)==3 : conn.failOn.clear()
+        t.execute("update t set a=1")
+        return 'done'
+    assert db.runInTransaction(work,backoff=1,maxBackoff=3,batchBytes=1000)=='done'
+    assert len(calls)==3 and conn.log.count('rollback')==2 and conn.log.count('commit')==1
+    assert len(sleeps)==2 and .5<=sleeps[0]<=1.5 and 1<=sleeps[1]<=3 #backoff*2^n with +-50% jitter
+
+def test_run_in_transaction_backoff_cap(monkeypatch):
+    db,conn=_db()
+    sleeps=[]
+    monkeypatch.setattr(db_txn.time,'sleep',sleeps.append)
+    monkeypatch.setattr(db_txn.random,'uniform',lambda a,b : 1)
+    conn.failOn={"update":ServerError(1205,'Lock wait timeout exceeded')}
+    def work(t):
+        t.execute("update t set a=1")
+    with pytest.raises(db_conn.LockWaitTimeout):
+        db.runInTransaction(work,retries=4,backoff=.1,maxBackoff=.5,batchBytes=1000)
+    assert sleeps==pytest.approx([.1,.2,.4,.5]) and conn.log.count('rollback')==5
+
+def test_run_in_transaction_other_errors(monkeypatch):
+    db,conn=_db()
+    monkeypatch.setattr(db_txn.time,'sleep',lambda s : pytest.fail("slept"))
+    conn.failOn={"update":ServerError(1146,"Table 't' doesn't exist")}
+    calls=[]
+    def work(t):
+        calls.append(1)
+        t.execute("update t set a=1")
+    with pytest.raises(db_conn.QueryError) as e:
+        db.runInTransaction(work,batchBytes=1000)
+    assert e.value.errno==1146 and not isinstance(e.value,db_conn.DeadlockError) and len(calls)==1